@@ -0,0 +1,88 @@
+# Цена хода в зависимости от размера поля: Game.place проверяет только линии
+# через последнюю клетку, полная проверка (check_winner) — все отрезки длины k.
+# Партии — случайные ходы до победы или заполнения поля.
+# Запуск: python bench/bench_boards.py [games]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import Game, check_winner, layout
+from keyboards import BoardKeyboardCache
+
+BOARDS = ((3, 3), (4, 4), (5, 4), (7, 5), (9, 5), (11, 5), (15, 5))
+
+
+def scripts(size, n, seed=42):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        cells = list(range(size * size))
+        rng.shuffle(cells)
+        out.append(cells)
+    return out
+
+
+def run_incremental(size, k, games):
+    moves = 0
+    started = time.perf_counter()
+    for cells in games:
+        game = Game('g', 1, 0, 30, size=size, k=k)
+        symbol = 'X'
+        for idx in cells:
+            moves += 1
+            if game.place(idx, symbol):
+                break
+            symbol = 'O' if symbol == 'X' else 'X'
+    return moves, time.perf_counter() - started
+
+
+def run_full_scan(size, k, games):
+    moves = 0
+    started = time.perf_counter()
+    for cells in games:
+        x_bits = o_bits = 0
+        symbol = 'X'
+        for idx in cells:
+            moves += 1
+            if symbol == 'X':
+                x_bits |= 1 << idx
+            else:
+                o_bits |= 1 << idx
+            if check_winner(x_bits, o_bits, size, k):
+                break
+            symbol = 'O' if symbol == 'X' else 'X'
+    return moves, time.perf_counter() - started
+
+
+def keyboard_cost(size, n=2000):
+    # сборка клавиатуры без попаданий в кэш: каждый раз новая позиция
+    cache = BoardKeyboardCache(maxsize=1)
+    rng = random.Random(1)
+    started = time.perf_counter()
+    for _ in range(n):
+        x_bits = rng.getrandbits(size * size)
+        top, left = cache.origin(size, rng.randrange(size * size))
+        cache.get('g', x_bits, 0, size, top, left)
+    return (time.perf_counter() - started) / n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'board':<12} {'lines':>6} {'moves/game':>10} {'place ns/move':>14} {'full scan ns/move':>18} {'keyboard us':>12}")
+    for size, k in BOARDS:
+        games = scripts(size, n)
+        moves, elapsed = run_incremental(size, k, games)
+        # полная проверка квадратична по площади — на больших полях хватит части партий
+        part = games[:max(n // (size * size // 9), 50)]
+        scan_moves, scan_elapsed = run_full_scan(size, k, part)
+        print(
+            f"{f'{size}x{size} k={k}':<12} {len(layout(size, k).lines()):>6} {moves / len(games):>10.1f} "
+            f"{elapsed / moves * 1e9:>14.0f} {scan_elapsed / scan_moves * 1e9:>18.0f} {keyboard_cost(size) * 1e6:>12.0f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# Стоимость хода и память на игру: старые списки + check_winner против битбордов.
+# Запуск: python bench/bench_engine.py
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import Game
+
+
+# --- прежняя реализация из main.py, для сравнения ---
+
+def legacy_new_board():
+    return [" "] * 9
+
+
+def legacy_check_winner(board):
+    win_lines = [
+        (0,1,2),(3,4,5),(6,7,8),
+        (0,3,6),(1,4,7),(2,5,8),
+        (0,4,8),(2,4,6)
+    ]
+    for a, b, c in win_lines:
+        if board[a] != " " and board[a] == board[b] == board[c]:
+            return board[a]
+    if " " not in board:
+        return "draw"
+    return None
+
+
+def legacy_game(game_id):
+    return {"type": "inline", "x": 1, "o": 2, "board": legacy_new_board(), "turn": "X",
+            "started": True, "price": 1000, "timeout": 30, "last_move_time": 0.0,
+            "inline_message_id": "AAAAAAAAAAAAAAAAAAAAAAAA"}
+
+
+def new_game(game_id):
+    g = Game(game_id, 1, 1000, 30)
+    g.o = 2
+    g.started = True
+    g.inline_message_id = "AAAAAAAAAAAAAAAAAAAAAAAA"
+    return g
+
+
+def scripts(n):
+    rnd = random.Random(42)
+    out = []
+    for _ in range(n):
+        cells = list(range(9))
+        rnd.shuffle(cells)
+        out.append(cells)
+    return out
+
+
+def run_legacy(games):
+    moves = 0
+    t0 = time.perf_counter()
+    for cells in games:
+        game = legacy_game('g')
+        symbol = 'X'
+        for idx in cells:
+            if game["board"][idx] != " ":
+                continue
+            game["board"][idx] = symbol
+            moves += 1
+            if legacy_check_winner(game["board"]):
+                break
+            symbol = 'O' if symbol == 'X' else 'X'
+    return moves, time.perf_counter() - t0
+
+
+def run_bitboard(games):
+    moves = 0
+    t0 = time.perf_counter()
+    for cells in games:
+        game = new_game('g')
+        symbol = 'X'
+        for idx in cells:
+            if not game.is_free(idx):
+                continue
+            moves += 1
+            if game.place(idx, symbol):
+                break
+            symbol = 'O' if symbol == 'X' else 'X'
+    return moves, time.perf_counter() - t0
+
+
+def memory_per_game(factory, n=10000):
+    tracemalloc.start()
+    games = {f"{i:08x}": factory(i) for i in range(n)}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del games
+    return size / n
+
+
+def main():
+    games = scripts(200000)
+    print(f"{'engine':<10} {'ns/move':>9} {'bytes/game':>11}")
+    for name, run, factory in (('legacy', run_legacy, legacy_game), ('bitboard', run_bitboard, new_game)):
+        moves, elapsed = run(games)
+        print(f"{name:<10} {elapsed / moves * 1e9:>9.0f} {memory_per_game(factory):>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Пропускная способность общего SqliteGameStore при нескольких процессах-воркерах.
+# Каждый воркер играет свои партии (game_id делятся по crc32 — shard_for
+# ниже): лобби -> cas join -> cas на каждый ход -> cas
+# удаление. Для сравнения — MemoryGameStore в одном процессе.
+# Запуск: python bench/bench_gamestore.py [seconds] [max_workers] [concurrency]
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import Game
+from gamestore import GAMES, MemoryGameStore, SqliteGameStore
+
+
+def shard_for(key, workers):
+    # в отличие от hash() crc32 одинаков во всех процессах
+    return zlib.crc32(str(key).encode()) % workers
+
+
+async def play(store, game_id, rng):
+    game = Game(game_id, 1, 100, 30)
+    version = await store.put(GAMES, game_id, game, ttl=3600)
+    ops = 1
+    game, version = await store.get(GAMES, game_id)
+    game = game.copy()
+    game.o = 2
+    game.started = True
+    version = await store.cas(GAMES, game_id, version, game)
+    ops += 2
+    cells = list(range(9))
+    rng.shuffle(cells)
+    for idx in cells:
+        game, version = await store.get(GAMES, game_id)
+        game = game.copy()
+        result = game.place(idx, game.turn)
+        game.turn = 'O' if game.turn == 'X' else 'X'
+        version = await store.cas(GAMES, game_id, version, game)
+        ops += 2
+        if version is None:
+            return ops, 1
+        if result:
+            await store.cas(GAMES, game_id, version, None)
+            return ops + 1, 0
+    return ops, 0
+
+
+async def run_worker(store, index, workers, seconds, concurrency):
+    rng = random.Random(index)
+    games = ops = conflicts = 0
+    deadline = time.perf_counter() + seconds
+    seq = 0
+
+    def next_id():
+        nonlocal seq
+        while True:
+            seq += 1
+            game_id = f'{seq:x}'
+            if shard_for(game_id, workers) == index:
+                return game_id
+
+    async def loop():
+        nonlocal games, ops, conflicts
+        while time.perf_counter() < deadline:
+            n, c = await play(store, next_id(), rng)
+            games += 1
+            ops += n
+            conflicts += c
+
+    await asyncio.gather(*[loop() for _ in range(concurrency)])
+    return games, ops, conflicts
+
+
+def worker_main(path, index, workers, seconds, concurrency, start, out):
+    store = SqliteGameStore(path, codecs={GAMES: (Game.to_dict, Game.from_dict)})
+    start.wait()
+    out.put(asyncio.run(run_worker(store, index, workers, seconds, concurrency)))
+    store.close()
+
+
+def run_sqlite(workers, seconds, concurrency):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'live.db')
+        SqliteGameStore(path).close()
+        start = multiprocessing.Event()
+        out = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=worker_main, args=(path, i, workers, seconds, concurrency, start, out))
+            for i in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        time.sleep(0.5)
+        start.set()
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+    return [sum(r[i] for r in results) for i in range(3)]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    print(f'{os.cpu_count()} CPU, {seconds:.0f}s per run, {concurrency} concurrent games per worker')
+
+    games, ops, conflicts = asyncio.run(run_worker(MemoryGameStore(), 0, 1, seconds, concurrency))
+    print(f'memory    1 worker : {games / seconds:9.0f} games/s {ops / seconds:9.0f} ops/s')
+
+    workers = 1
+    while workers <= max_workers:
+        games, ops, conflicts = run_sqlite(workers, seconds, concurrency)
+        print(f'sqlite {workers:4d} worker{"s" if workers > 1 else " "}: {games / seconds:9.0f} games/s {ops / seconds:9.0f} ops/s  cas conflicts {conflicts}')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# Бенчмарк хендлеров main.py без Telegram: Bot.request подменён фейком, который
+# только записывает вызовы, апдейты собираются вручную и идут в dp.process_update.
+# База — временная, с заранее залитыми пользователями.
+# Запуск: python bench/bench_handlers.py [--users 100000] [--games 300] [--rounds 200]
+import argparse
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import storage
+
+
+def populate(path, n_users):
+    storage.init_db(path)
+    conn = sqlite3.connect(path)
+    rng = random.Random(1)
+    rows = (
+        (100000 + i, f'user{i}', f'User {i}', rng.randint(0, 20000), rng.randint(0, 300), rng.randint(0, 300), rng.randint(0, 50), rng.randint(800, 2400))
+        for i in range(n_users)
+    )
+    conn.executemany('INSERT INTO users (id, username, name, coins, wins, losses, draws, rating) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+class FakeTelegram:
+    # вместо HTTP к Bot API: считаем методы и отдаём правдоподобный ответ
+    def __init__(self):
+        self.calls = Counter()
+        self.last_markup = None
+        self._message_id = 0
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        if data and data.get('reply_markup'):
+            self.last_markup = data['reply_markup']
+        if method == 'sendMessage':
+            self._message_id += 1
+            chat_id = int(data['chat_id'])
+            return {'message_id': self._message_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text', '')}
+        return True
+
+
+class Updates:
+    def __init__(self):
+        self._id = 0
+
+    def _next(self):
+        self._id += 1
+        return self._id
+
+    @staticmethod
+    def user(uid):
+        return {'id': uid, 'is_bot': False, 'first_name': f'User {uid}', 'username': f'user{uid}'}
+
+    def message(self, uid, text):
+        from aiogram import types
+        n = self._next()
+        return types.Update(**{'update_id': n, 'message': {
+            'message_id': n, 'date': 0, 'chat': {'id': uid, 'type': 'private'}, 'from': self.user(uid), 'text': text,
+        }})
+
+    def callback(self, uid, data, inline_message_id=None):
+        from aiogram import types
+        n = self._next()
+        query = {'id': str(n), 'from': self.user(uid), 'chat_instance': 'bench', 'data': data}
+        if inline_message_id:
+            query['inline_message_id'] = inline_message_id
+        else:
+            query['message'] = {'message_id': n, 'date': 0, 'chat': {'id': uid, 'type': 'private'}, 'text': '.'}
+        return types.Update(**{'update_id': n, 'callback_query': query})
+
+    def inline(self, uid, query):
+        from aiogram import types
+        n = self._next()
+        return types.Update(**{'update_id': n, 'inline_query': {'id': str(n), 'from': self.user(uid), 'query': query, 'offset': ''}})
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Harness:
+    def __init__(self, main, fake):
+        self.main = main
+        self.fake = fake
+        self.updates = Updates()
+
+    async def feed(self, update, latencies):
+        main = self.main
+        main.Bot.set_current(main.bot)
+        main.Dispatcher.set_current(main.dp)
+        started = time.perf_counter()
+        await main.dp.process_update(update)
+        latencies.append(time.perf_counter() - started)
+
+    async def run(self, name, scenario):
+        main = self.main
+        latencies = []
+        statements = main.db.statements
+        api = sum(self.fake.calls.values()) + main.outbox.enqueued
+        started = time.perf_counter()
+        await scenario(latencies)
+        # отложенные записи — тоже цена этих апдейтов
+        await main.user_writes.flush()
+        elapsed = time.perf_counter() - started
+        n = len(latencies)
+        latencies.sort()
+        statements = main.db.statements - statements
+        api = sum(self.fake.calls.values()) + main.outbox.enqueued - api
+        print(
+            f'{name:12s} {n:7d} upd {n / elapsed:9.0f} upd/s  '
+            f'p50 {percentile(latencies, 0.50) * 1000:6.2f}  p95 {percentile(latencies, 0.95) * 1000:6.2f}  '
+            f'p99 {percentile(latencies, 0.99) * 1000:6.2f} ms  '
+            f'{statements / max(n, 1):5.2f} sql/upd  {api / max(n, 1):4.2f} api/upd'
+        )
+
+    def latest_game(self):
+        # id игры — из кнопки «Подключиться» последнего отправленного лобби
+        return re.search(r'join:(\w+)', self.fake.last_markup).group(1)
+
+    async def games(self, latencies, n_games, first_uid):
+        u = self.updates
+        # X собирает верхнюю строку: 0, 1, 2; O отвечает 3, 4
+        script = ((0, 0), (1, 3), (0, 1), (1, 4), (0, 2))
+        for i in range(n_games):
+            x, o = first_uid + 2 * i, first_uid + 2 * i + 1
+            await self.feed(u.inline(x, '100'), latencies)
+            await self.feed(u.message(x, '🎮 Создание игры…|100'), latencies)
+            game_id = self.latest_game()
+            inline_id = f'bench-{i}'
+            await self.feed(u.callback(o, f'join:{game_id}', inline_id), latencies)
+            for player, cell in script:
+                await self.feed(u.callback((x, o)[player], f'move:{game_id}:{cell}', inline_id), latencies)
+
+    async def leaderboard(self, latencies, rounds, uids):
+        u = self.updates
+        for i in range(rounds):
+            uid = uids[i % len(uids)]
+            await self.feed(u.callback(uid, 'show:top'), latencies)
+            for mode in ('wins', 'coins', 'rating'):
+                await self.feed(u.callback(uid, f'top:{mode}'), latencies)
+            await self.feed(u.callback(uid, 'show:profile'), latencies)
+
+    async def shop(self, latencies, rounds, uids):
+        u = self.updates
+        items = list(self.main.catalog.items.values())
+        for i in range(rounds):
+            uid = uids[i % len(uids)]
+            it = items[i % len(items)]
+            await self.feed(u.callback(uid, 'show:shop'), latencies)
+            await self.feed(u.callback(uid, f"shop:cat:{it['category']}"), latencies)
+            await self.feed(u.callback(uid, f"shop:item:{it['id']}"), latencies)
+            await self.feed(u.callback(uid, f"shop:buy:{it['id']}"), latencies)
+            await self.feed(u.callback(uid, f"shop:equip:{it['id']}"), latencies)
+
+    async def big_table(self, latencies, rounds, n_users):
+        # случайные пользователи из большой таблицы: промахи кэша, чтение из БД
+        u = self.updates
+        rng = random.Random(2)
+        for _ in range(rounds):
+            uid = 100000 + rng.randrange(n_users)
+            await self.feed(u.message(uid, '/start'), latencies)
+            await self.feed(u.callback(uid, 'show:profile'), latencies)
+
+
+async def run(args):
+    import main
+    fake = FakeTelegram()
+    main.bot.request = fake.request
+    h = Harness(main, fake)
+    await main.on_startup(main.dp)
+    try:
+        print(f'users in db: {args.users}, games: {args.games}, rounds: {args.rounds}')
+        players = list(range(1, 2 * args.games + 1))
+        await h.run('games', lambda lat: h.games(lat, args.games, 1))
+        await h.run('leaderboard', lambda lat: h.leaderboard(lat, args.rounds, players))
+        await h.run('shop', lambda lat: h.shop(lat, args.rounds, players))
+        await h.run('big table', lambda lat: h.big_table(lat, args.rounds, args.users))
+        print('api calls:', dict(fake.calls), 'edits queued:', main.outbox.enqueued)
+    finally:
+        await main.on_shutdown(main.dp)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--games', type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=200)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.db')
+        populate(path, args.users)
+        os.environ['XO_DB_PATH'] = path
+        asyncio.run(run(args))
@@ -0,0 +1,106 @@
+# game_history на миллионах партий: скорость вставки пачками (как их
+# сбрасывает write-behind), байты на партию на диске и время страницы
+# /history в начале и в глубине истории. Для сравнения — та же таблица с
+# ходами JSON-строкой, id игры и результатом текстом, временем REAL.
+# Запуск: python bench/bench_history.py [games] [batch]
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import history
+import storage
+from engine import Game
+
+USERS = 50000
+NAIVE_SQL = (
+    'CREATE TABLE game_history (id INTEGER PRIMARY KEY, game_id TEXT, x INTEGER, o INTEGER, price INTEGER, '
+    'result TEXT, size INTEGER, k INTEGER, started REAL, finished REAL, moves TEXT)'
+)
+
+
+def games(n, seed=7):
+    rng = random.Random(seed)
+    now = 1.7e9
+    for i in range(n):
+        size, k = (3, 3) if rng.random() < 0.9 else (15, 5)
+        g = Game(f'{rng.getrandbits(32):08x}', rng.randrange(1, USERS), rng.choice((100, 500, 1000)), 30, created_at=now, size=size, k=k)
+        # 1% партий у одного «активного» игрока — для страницы в глубине истории
+        g.o = 1 if rng.random() < 0.01 else rng.randrange(1, USERS)
+        g.started, g.started_at = True, now
+        cells = list(range(size * size))
+        rng.shuffle(cells)
+        symbol, result = 'X', None
+        for idx in cells:
+            result = g.place(idx, symbol)
+            if result:
+                break
+            symbol = 'O' if symbol == 'X' else 'X'
+        now += rng.random()
+        yield g, result, now + rng.randrange(20, 300)
+
+
+def naive_row(game, result, finished):
+    return (game.id, game.x, game.o, game.price, result, game.size, game.k, game.started_at, finished, json.dumps(list(game.moves)))
+
+
+def fill(path, rows, sql, batch):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        conn.executemany(sql, rows[i:i + batch])
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    played = list(games(n))
+    packed = [history.history_row(g, r, f) for g, r, f in played]
+    naive = [naive_row(g, r, f) for g, r, f in played]
+    print(f'{n} games, {batch} per transaction; moves blob avg {sum(len(r[-1]) for r in packed) / n:.1f} B vs json {sum(len(r[-1]) for r in naive) / n:.1f} B')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'packed.db')
+        storage.init_db(path)
+        elapsed = fill(path, packed, storage.HISTORY_SQL, batch)
+        print(f'packed : {n / elapsed:9.0f} games/s  {os.path.getsize(path) / n:6.1f} B/game on disk (with indexes)')
+
+        conn = sqlite3.connect(path)
+        ids = [r[0] for r in conn.execute('SELECT id FROM game_history WHERE x=1 OR o=1 ORDER BY id DESC')]
+        for label, cursor in (('first page', None), ('deep page', ids[len(ids) * 9 // 10])):
+            started = time.perf_counter()
+            for _ in range(200):
+                rows, _ = storage.user_history(conn, 1, cursor, False, 8)
+            print(f'/history {label:<10}: {(time.perf_counter() - started) / 200 * 1000:6.3f} ms  ({len(ids)} games of the busiest player)')
+        # реплей последней позиции
+        rec = storage.get_history(conn, ids[0])
+        started = time.perf_counter()
+        for _ in range(10000):
+            history.replay(rec)
+        print(f'replay: {(time.perf_counter() - started) / 10000 * 1e6:.1f} us per position')
+        conn.close()
+
+        path = os.path.join(tmp, 'naive.db')
+        conn = sqlite3.connect(path)
+        conn.execute(NAIVE_SQL)
+        conn.execute('CREATE INDEX idx_x ON game_history(x, id)')
+        conn.execute('CREATE INDEX idx_o ON game_history(o, id)')
+        conn.close()
+        elapsed = fill(path, naive, 'INSERT INTO game_history VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+        print(f'naive  : {n / elapsed:9.0f} games/s  {os.path.getsize(path) / n:6.1f} B/game on disk (with indexes)')
+
+
+if __name__ == '__main__':
+    main()
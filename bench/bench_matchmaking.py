@@ -0,0 +1,136 @@
+# Пропускная способность MatchQueue: поток игроков с нормально распределённым
+# рейтингом и несколькими ставками, время — виртуальное. Каждые tick секунд
+# вызывается match(now), как фоновый matchmaker в main.py. Для сравнения —
+# наивный подбор, который на каждом шаге просматривает всю очередь.
+# Запуск: python bench/bench_matchmaking.py [players] [arrivals_per_sec]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from matchmaking import MatchQueue, TOLERANCE_STEPS
+
+STAKES = (100, 500, 1000, 5000)
+
+
+def arrivals(n, rate, spread=250, seed=1):
+    rng = random.Random(seed)
+    now = 0.0
+    for uid in range(n):
+        now += rng.expovariate(rate)
+        yield uid, int(rng.gauss(1400, spread)), rng.choice(STAKES), now
+
+
+def run_queue(players, tick=1.0):
+    q = MatchQueue()
+    pairs, expired = [], 0
+    next_tick = tick
+    started = time.perf_counter()
+    for uid, rating, stake, now in players:
+        while now >= next_tick:
+            p, e = q.match(next_tick)
+            pairs += p
+            expired += len(e)
+            next_tick += tick
+        _, pair = q.enqueue(uid, rating, stake, now)
+        if pair is not None:
+            pairs.append(pair)
+    elapsed = time.perf_counter() - started
+    return elapsed, pairs, expired, len(q)
+
+
+class NaiveQueue:
+    # то, что получилось бы без индекса: список ждущих и полный проход
+    def __init__(self, max_wait=120):
+        self.max_wait = max_wait
+        self.waiting = []
+
+    def tolerance(self, t, now):
+        tol = 0
+        for after, value in TOLERANCE_STEPS:
+            if now - t[3] >= after:
+                tol = value
+        return tol
+
+    def enqueue(self, uid, rating, stake, now):
+        me = (uid, rating, stake, now)
+        pair = self._best(me, now)
+        if pair is None:
+            self.waiting.append(me)
+        return pair
+
+    def _best(self, me, now):
+        best = None
+        for other in self.waiting:
+            if other[2] != me[2]:
+                continue
+            diff = abs(other[1] - me[1])
+            if diff <= max(self.tolerance(me, now), self.tolerance(other, now)) and (best is None or diff < best[0]):
+                best = (diff, other)
+        if best is None:
+            return None
+        self.waiting.remove(best[1])
+        return best[1], me
+
+    def match(self, now):
+        pairs = []
+        for t in list(self.waiting):
+            if t not in self.waiting:
+                continue
+            if now - t[3] >= self.max_wait:
+                self.waiting.remove(t)
+                continue
+            self.waiting.remove(t)
+            pair = self._best(t, now)
+            if pair is None:
+                self.waiting.append(t)
+            else:
+                pairs.append(pair)
+        return pairs
+
+
+def run_naive(players, tick=1.0):
+    q = NaiveQueue()
+    pairs = []
+    next_tick = tick
+    started = time.perf_counter()
+    for uid, rating, stake, now in players:
+        while now >= next_tick:
+            pairs += q.match(next_tick)
+            next_tick += tick
+        pair = q.enqueue(uid, rating, stake, now)
+        if pair is not None:
+            pairs.append(pair)
+    return time.perf_counter() - started, pairs
+
+
+def scenario(n, rate, spread):
+    players = list(arrivals(n, rate, spread))
+    print(f'{n} players, {rate:.0f} arrivals/s of virtual time, rating sd {spread}, stakes {STAKES}')
+
+    elapsed, pairs, expired, left = run_queue(players)
+    gaps = sorted(abs(a.rating - b.rating) for a, b in pairs)
+    print(
+        f'MatchQueue : {n / elapsed:9.0f} players/s {len(pairs) / elapsed:9.0f} pairs/s  '
+        f'pairs {len(pairs)}, expired {expired}, left {left}, '
+        f'rating gap median {gaps[len(gaps) // 2]} p95 {gaps[int(len(gaps) * 0.95)]}'
+    )
+
+    # наивный вариант квадратичен по длине очереди — гоняем на части потока
+    m = min(n, 20000)
+    elapsed, pairs = run_naive(players[:m])
+    print(f'naive scan : {m / elapsed:9.0f} players/s {len(pairs) / elapsed:9.0f} pairs/s  (first {m} players)')
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 2000.0
+    scenario(n, rate, 250)
+    # широкий разброс рейтингов: пары находятся не сразу, очередь длинная
+    scenario(n, rate * 10, 20000)
+
+
+if __name__ == '__main__':
+    main()
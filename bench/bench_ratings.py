@@ -0,0 +1,104 @@
+# Пересчёт рейтингов по game_history: слоями на NumPy (ratings.recompute)
+# против последовательного прохода партия за партией теми же формулами,
+# что в боте (elo_delta / draw_deltas). Итоговые рейтинги должны совпасть.
+# load — чтение и раскладка по слоям, один раз на любое число вариантов.
+# skew — перекос активности: игрок берётся как players * random() ** skew,
+# чем больше skew, тем больше партий у самых активных и тем уже слои.
+# Запуск: python bench/bench_ratings.py [games] [players] [skew]
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import history
+import ratings
+import storage
+
+
+def fill(path, n, players, skew, seed=3):
+    rng = random.Random(seed)
+    storage.init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO users (id, username, coins) VALUES (?, ?, 0)', [(uid, f'u{uid}') for uid in range(1, players + 1)])
+    rows = []
+    for i in range(n):
+        x = int(players * rng.random() ** skew) + 1
+        o = int(players * rng.random() ** skew) + 1
+        if o == x:
+            o = o % players + 1
+        if rng.random() < 0.05:
+            o = ratings.BOT_ID
+        moves = tuple(rng.sample(range(9), rng.randint(5, 9)))
+        result = rng.choice((0, 1, 1, 2, 2, 3))
+        rows.append((i, x, o, 100, result, 3, 3, 1700000000 + i, 30, history.pack_moves(moves)))
+        if len(rows) == 100000:
+            conn.executemany(storage.HISTORY_SQL, rows)
+            rows = []
+    conn.executemany(storage.HISTORY_SQL, rows)
+    conn.commit()
+    return conn
+
+
+def sequential(conn):
+    # как бот: по одной партии, рейтинги в словаре
+    rating = {}
+    c = conn.execute('SELECT x, o, result, size, moves FROM game_history WHERE o != ? ORDER BY id', (ratings.BOT_ID,))
+    for x, o, result, size, moves in c:
+        ra, rb = rating.get(x, ratings.START_RATING), rating.get(o, ratings.START_RATING)
+        win = history.winner(history.RESULTS[result], history.unpack_moves(moves, size))
+        if win is None:
+            da, db = ratings.draw_deltas(ra, rb)
+        elif win == 'X':
+            da = ratings.elo_delta(ra, rb)
+            db = -da
+        else:
+            db = ratings.elo_delta(rb, ra)
+            da = -db
+        rating[x], rating[o] = ra + da, rb + db
+    return rating
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    skew = float(sys.argv[3]) if len(sys.argv) > 3 else 2
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = fill(os.path.join(tmp, 'r.db'), n, players, skew)
+        print(f'{n} games, {players} players, skew {skew}')
+
+        started = time.perf_counter()
+        ids, chunks = ratings.load(conn)
+        layers = sum(len(chunk[3]) + 1 for chunk in chunks)
+        print(f'load        : {time.perf_counter() - started:6.2f} s  ({sum(len(chunk[0]) for chunk in chunks)} games, {layers} layers)')
+        for label, formula in (('elo', ratings.Elo()), ('glicko', ratings.Glicko())):
+            started = time.perf_counter()
+            result = ratings.recompute(ids, chunks, formula)
+            print(f'{label:<12}: {time.perf_counter() - started:6.2f} s')
+            if label == 'elo':
+                elo = result
+        # то же по одной партии на Python, без слоёв
+        started = time.perf_counter()
+        ratings.recompute(ids, chunks, ratings.Elo(), narrow=len(ids) + 1)
+        print(f'elo, scalar : {time.perf_counter() - started:6.2f} s')
+
+        started = time.perf_counter()
+        expected = sequential(conn)
+        print(f'sequential  : {time.perf_counter() - started:6.2f} s  (read + decode + update, as the bot would)')
+        same = len(expected) == len(ids) and all(expected[uid] == r for uid, r in zip(ids.tolist(), elo.tolist()))
+        print('elo matches sequential:', same)
+
+        found, before = ratings.current_ratings(conn, ids)
+        print(ratings.report(conn, ids[found], before[found], elo[found], top=3))
+        started = time.perf_counter()
+        with conn:
+            changed = storage.set_ratings(conn, zip(ids.tolist(), elo.tolist()))
+        print(f'apply       : {time.perf_counter() - started:6.2f} s  ({changed} users)')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
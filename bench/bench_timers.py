@@ -0,0 +1,106 @@
+# Сравнение таймеров ходов: задача asyncio на каждую игру (как было в move_timer)
+# против одного TimerWheel. Запуск: python bench/bench_timers.py [games] [moves]
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduler import TimerWheel
+
+
+TIMEOUT = 30.0
+FIRE_TIMEOUT = 0.5
+
+
+async def per_task(n_games, n_moves):
+    fired = 0
+
+    async def timer(game_id, delay):
+        nonlocal fired
+        try:
+            await asyncio.sleep(delay)
+            fired += 1
+        except asyncio.CancelledError:
+            return
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    tasks = {g: asyncio.create_task(timer(g, TIMEOUT)) for g in range(n_games)}
+    await asyncio.sleep(0)
+    arm = time.perf_counter() - t0
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for _ in range(n_moves):
+        for g in range(n_games):
+            tasks[g].cancel()
+            tasks[g] = asyncio.create_task(timer(g, TIMEOUT))
+        await asyncio.sleep(0)
+    rearm = time.perf_counter() - t0
+
+    for t in tasks.values():
+        t.cancel()
+    await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(timer(g, FIRE_TIMEOUT)) for g in range(n_games)]
+    await asyncio.gather(*tasks)
+    fire = time.perf_counter() - t0 - FIRE_TIMEOUT
+    return arm, rearm, mem, fire, fired
+
+
+async def wheel(n_games, n_moves):
+    fired = 0
+    done = asyncio.Event()
+
+    async def on_timeout(game_id):
+        nonlocal fired
+        fired += 1
+        if fired == n_games:
+            done.set()
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    w = TimerWheel(on_timeout, tick=0.05)
+    for g in range(n_games):
+        w.arm(g, TIMEOUT)
+    arm = time.perf_counter() - t0
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for _ in range(n_moves):
+        for g in range(n_games):
+            w.arm(g, TIMEOUT)
+        await asyncio.sleep(0)
+    rearm = time.perf_counter() - t0
+
+    for g in range(n_games):
+        w.cancel(g)
+    w.start()
+    t0 = time.perf_counter()
+    for g in range(n_games):
+        w.arm(g, FIRE_TIMEOUT)
+    await done.wait()
+    fire = time.perf_counter() - t0 - FIRE_TIMEOUT
+    await w.stop()
+    return arm, rearm, mem, fire, fired
+
+
+def main():
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_moves = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{n_games} concurrent games, {n_moves} re-arms per game")
+    print(f"{'approach':<10} {'arm ms':>9} {'re-arm/s':>12} {'memory KiB':>11} {'fire lag ms':>12}")
+    for name, fn in (('per-task', per_task), ('wheel', wheel)):
+        arm, rearm, mem, fire, fired = asyncio.run(fn(n_games, n_moves))
+        assert fired == n_games, fired
+        print(f"{name:<10} {arm * 1000:>9.1f} {n_games * n_moves / rearm:>12,.0f} {mem / 1024:>11,.0f} {fire * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
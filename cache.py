@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    # LRU-кэш пользователей с ограничением размера и TTL.
+    # Закреплённые записи (игроки за столом в активных играх) не вытесняются
+    # и не протухают, пока их не открепят.
+
+    def __init__(self, maxsize=10000, ttl=600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # uid -> (record, loaded_at)
+        self._pins = {}  # uid -> сколько игр держат запись
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, user_id):
+        return user_id in self._data
+
+    def __getitem__(self, user_id):
+        # прямой доступ без учёта статистики — для горячих путей игры,
+        # где записи заведомо закреплены
+        return self._data[user_id][0]
+
+    def __setitem__(self, user_id, record):
+        self._data[user_id] = (record, self._clock())
+        self._data.move_to_end(user_id)
+        if len(self._data) > self.maxsize:
+            self._evict()
+
+    def get(self, user_id, default=None):
+        entry = self._data.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return default
+        record, loaded_at = entry
+        if user_id not in self._pins and self._clock() - loaded_at > self.ttl:
+            del self._data[user_id]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return record
+
+    def pop(self, user_id, default=None):
+        entry = self._data.pop(user_id, None)
+        return entry[0] if entry else default
+
+    def pin(self, user_id):
+        self._pins[user_id] = self._pins.get(user_id, 0) + 1
+
+    def unpin(self, user_id):
+        n = self._pins.get(user_id, 0) - 1
+        if n > 0:
+            self._pins[user_id] = n
+        else:
+            self._pins.pop(user_id, None)
+
+    def _evict(self):
+        # выбрасываем самые старые незакреплённые; закреплённые переносим в хвост
+        for _ in range(len(self._data)):
+            if len(self._data) <= self.maxsize:
+                return
+            user_id = next(iter(self._data))
+            if user_id in self._pins:
+                self._data.move_to_end(user_id)
+                continue
+            del self._data[user_id]
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'pinned': len(self._pins),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,122 @@
+import json
+from types import MappingProxyType
+
+
+# категория -> поле пользователя, в котором лежит надетый предмет
+EQUIP_FIELDS = {
+    'symbol': 'equipped_symbol',
+    'background': 'equipped_bg',
+    'emoji_pack': 'equipped_emoji_pack',
+    'animation': 'equipped_animation',
+}
+
+CATEGORY_LABELS = {
+    'symbol': 'Символы',
+    'background': 'Фоны',
+    'emoji_pack': 'Эмодзи',
+    'animation': 'Анимации',
+}
+
+SHOP_TEXT = "<b>🛍️ Магазин — трать коины, прокачай стиль!</b>\n\nВыбирай категорию: символы, фоны, эмодзи или анимации. Всё четко, красиво и ахуенно."
+
+# состояния кнопки на карточке предмета для конкретного пользователя
+BUY, EQUIP, UNEQUIP = 'buy', 'equip', 'unequip'
+
+
+def _markup(rows):
+    # как в keyboards.py: готовая строка reply_markup, aiogram отдаёт её в API как есть
+    return json.dumps({'inline_keyboard': rows}, ensure_ascii=False, separators=(',', ':'))
+
+
+def _button(text, data):
+    return {'text': text, 'callback_data': data}
+
+
+class Catalog:
+    # Неизменяемый снимок магазина: индексы и все тексты/клавиатуры собраны
+    # один раз в конструкторе, хендлеры только выбирают готовое. Перезагрузка
+    # строит новый Catalog и подменяет ссылку целиком, так что хендлер,
+    # начавший работу со старым снимком, дорабатывает с ним же.
+    # Позиция предмета — номер его бита в маске купленного у пользователя;
+    # при перезагрузке позиции старых id (и удалённых тоже) сохраняются.
+
+    def __init__(self, items, previous=None):
+        positions = dict(previous.positions) if previous is not None else {}
+        by_category = {}
+        for it in items:
+            if it['category'] not in EQUIP_FIELDS:
+                raise ValueError(f"{it['id']}: unknown category {it['category']}")
+            if not isinstance(it['price'], int) or it['price'] < 0:
+                raise ValueError(f"{it['id']}: bad price {it['price']!r}")
+            by_category.setdefault(it['category'], []).append(it)
+        self.items = MappingProxyType({it['id']: MappingProxyType(dict(it)) for it in items})
+        if len(self.items) != len(items):
+            raise ValueError('duplicate item id')
+        for item_id in self.items:
+            if item_id not in positions:
+                positions[item_id] = len(positions)
+        self.positions = MappingProxyType(positions)
+        self.bits = MappingProxyType({item_id: 1 << positions[item_id] for item_id in self.items})
+        self.by_category = MappingProxyType({cat: tuple(self.items[it['id']] for it in its) for cat, its in by_category.items()})
+
+        self.shop_page = (SHOP_TEXT, self._shop_markup())
+        self.category_pages = MappingProxyType({cat: self._category_page(cat, its) for cat, its in self.by_category.items()})
+        self.item_texts = MappingProxyType({item_id: self._item_text(it) for item_id, it in self.items.items()})
+        self.item_markups = MappingProxyType({item_id: self._item_markups(it) for item_id, it in self.items.items()})
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return item_id in self.items
+
+    def get(self, item_id):
+        return self.items.get(item_id)
+
+    def mask(self, item_ids):
+        mask = 0
+        for item_id in item_ids:
+            mask |= self.bits.get(item_id, 0)
+        return mask
+
+    def item_page(self, item_id, state):
+        # state — BUY / EQUIP / UNEQUIP, единственная часть, зависящая от пользователя
+        return self.item_texts[item_id], self.item_markups[item_id][state]
+
+    def _shop_markup(self):
+        cats = [_button(CATEGORY_LABELS.get(cat, cat.title()), f'shop:cat:{cat}') for cat in EQUIP_FIELDS if cat in self.by_category]
+        rows = [cats[i:i + 2] for i in range(0, len(cats), 2)]
+        rows.append([_button("◀️ Назад", 'back:start')])
+        return _markup(rows)
+
+    @staticmethod
+    def _category_page(cat, items):
+        text = f"<b>🛍️ Магазин — {cat.title()}</b>\n\n"
+        rows = []
+        for it in items:
+            text += f"{it['name']} — {it['price']} 💰\n{it.get('desc','')}\n\n"
+            rows.append([_button(f"Просмотр: {it['name']}", f"shop:item:{it['id']}")])
+        rows.append([_button("◀️ Назад", 'show:shop')])
+        return text, _markup(rows)
+
+    @staticmethod
+    def _item_text(it):
+        return f"<b>{it['name']}</b> — {it['price']} 💰\n\n{it.get('desc','')}\n\nПревью: {it.get('preview','')}."
+
+    @staticmethod
+    def _item_markups(it):
+        back = [_button("◀️ Назад", f"shop:cat:{it['category']}")]
+        return {
+            BUY: _markup([[_button(f"Купить — {it['price']} 💰", f"shop:buy:{it['id']}")], back]),
+            EQUIP: _markup([[_button("Надеть", f"shop:equip:{it['id']}")], back]),
+            UNEQUIP: _markup([[_button("Снять", f"shop:unequip:{it['id']}")], back]),
+        }
+
+    @classmethod
+    def from_json(cls, path, previous=None):
+        # файл — список предметов в формате ITEMS: [{"id", "category", "name", "price", "preview", "desc"}, ...]
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = list(data.values())
+        return cls(data, previous=previous)
@@ -2,3 +2,31 @@ TOKEN = "8534403926:AAFPmQLL8wAWObdpXSZTHZ93v_t6VIlrwps"
 ADMIN_ID = 7528568061  
 
 
+
+# polling | webhook (можно переопределить: python main.py --mode webhook)
+MODE = "polling"
+# публичный адрес бота для setWebhook, например "https://example.com"; пусто — не вызывать
+WEBHOOK_URL = ""
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = None
+WEBAPP_HOST = "0.0.0.0"
+WEBAPP_PORT = 8080
+# сколько апдейтов обрабатываем одновременно в режиме вебхука
+WEBHOOK_MAX_CONCURRENCY = 64
+# свой Bot API сервер (или локальный фейк для тестов), например "http://127.0.0.1:8081"
+TELEGRAM_API_SERVER = None
+# общий SQLite для живых игр, если бот запущен в нескольких процессах; None — в памяти
+GAME_STORE_PATH = None
+# путь к базе; None — data.db рядом с main.py (переменная окружения XO_DB_PATH важнее)
+DB_PATH = None
+# метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics; None — выключено
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+# раз в сколько секунд писать сводку метрик в лог; 0 — не писать
+METRICS_LOG_INTERVAL = 0
+# JSON-каталог магазина (список предметов в формате ITEMS из main.py); None — встроенный
+CATALOG_PATH = None
+# упакованная таблица ходов бота (python solver.py путь); нет файла — считается при старте и сохраняется
+BOT_TABLE_PATH = None
+# учитывать ли игры с ботом в рейтинге (против рейтинга уровня из BOT_LEVELS)
+BOT_RATED = False
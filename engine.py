@@ -0,0 +1,219 @@
+# Движок крестиков-ноликов на битбордах: клетки X и O — по маске, бит i
+# соответствует клетке i (построчно). Классика 3×3 — 9-битные маски и
+# таблица WINNING; поля N×N с победой k в ряд — те же маски, только длиннее.
+
+WIN_LINES = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),
+    (0, 4, 8), (2, 4, 6)
+)
+WIN_MASKS = tuple((1 << a) | (1 << b) | (1 << c) for a, b, c in WIN_LINES)
+FULL = (1 << 9) - 1
+
+# WINNING[bits] — есть ли в маске собранная линия; 512 байт на все позиции
+WINNING = bytes(any(bits & m == m for m in WIN_MASKS) for bits in range(FULL + 1))
+
+
+# направления линий: строка, столбец, две диагонали
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+MAX_SIZE = 15
+
+
+class Layout:
+    # Геометрия поля size×size с победой k в ряд. Для каждой клетки заранее
+    # собраны лучи в обе стороны по четырём направлениям, не длиннее k-1:
+    # после хода проверяются только линии через эту клетку, так что цена
+    # хода зависит от k, а не от площади поля. 3×3 — по таблице WINNING.
+
+    def __init__(self, size, k):
+        if not 3 <= k <= size <= MAX_SIZE:
+            raise ValueError(f'bad board {size}x{size}, k={k}')
+        self.size = size
+        self.k = k
+        self.cells = size * size
+        self.full = (1 << self.cells) - 1
+        self.table = WINNING if (size, k) == (3, 3) else None
+        self.rays = tuple(self._rays(idx) for idx in range(self.cells))
+        self._lines = None
+
+    def _rays(self, idx):
+        row, col = divmod(idx, self.size)
+        rays = []
+        for dr, dc in DIRECTIONS:
+            pair = []
+            for sign in (-1, 1):
+                ray = []
+                for step in range(1, self.k):
+                    r, c = row + sign * dr * step, col + sign * dc * step
+                    if not (0 <= r < self.size and 0 <= c < self.size):
+                        break
+                    ray.append(1 << (r * self.size + c))
+                pair.append(tuple(ray))
+            rays.append(tuple(pair))
+        return tuple(rays)
+
+    def wins(self, bits, idx):
+        # собрана ли линия через клетку idx, куда только что поставили фишку
+        if self.table is not None:
+            return self.table[bits]
+        k = self.k
+        for back, forward in self.rays[idx]:
+            n = 1
+            for bit in back:
+                if not bits & bit:
+                    break
+                n += 1
+            for bit in forward:
+                if not bits & bit:
+                    break
+                n += 1
+            if n >= k:
+                return True
+        return False
+
+    def lines(self):
+        # все отрезки длины k — для полной проверки позиции, не для хода
+        if self._lines is None:
+            size, k = self.size, self.k
+            lines = []
+            for row in range(size):
+                for col in range(size):
+                    for dr, dc in DIRECTIONS:
+                        end_r, end_c = row + dr * (k - 1), col + dc * (k - 1)
+                        if 0 <= end_r < size and 0 <= end_c < size:
+                            lines.append(sum(1 << ((row + dr * i) * size + col + dc * i) for i in range(k)))
+            self._lines = tuple(lines)
+        return self._lines
+
+
+_layouts = {}
+
+
+def layout(size=3, k=3):
+    lay = _layouts.get((size, k))
+    if lay is None:
+        lay = _layouts[(size, k)] = Layout(size, k)
+    return lay
+
+
+def check_winner(x_bits, o_bits, size=3, k=3):
+    # полная проверка позиции; в ходе игры — Game.place, он смотрит только последний ход
+    if (size, k) == (3, 3):
+        if WINNING[x_bits]:
+            return "X"
+        if WINNING[o_bits]:
+            return "O"
+        if x_bits | o_bits == FULL:
+            return "draw"
+        return None
+    lay = layout(size, k)
+    for m in lay.lines():
+        if x_bits & m == m:
+            return "X"
+        if o_bits & m == m:
+            return "O"
+    if x_bits | o_bits == lay.full:
+        return "draw"
+    return None
+
+
+class Game:
+    __slots__ = (
+        'id', 'type', 'x', 'o', 'x_bits', 'o_bits', 'turn', 'started', 'price',
+        'timeout', 'last_move_time', 'created_at', 'started_at', 'chat_id', 'message_id',
+        'inline_message_id', 'messages', 'bot', 'size', 'k', 'moves'
+    )
+
+    def __init__(self, game_id, x, price, timeout, type='inline', created_at=0.0, size=3, k=3):
+        self.id = game_id
+        self.type = type
+        self.x = x
+        self.o = None
+        self.x_bits = 0
+        self.o_bits = 0
+        self.turn = 'X'
+        self.started = False
+        self.price = price
+        self.timeout = timeout
+        self.last_move_time = 0.0
+        self.created_at = created_at
+        # вход второго игрока: до него — ожидание в лобби, не партия
+        self.started_at = 0.0
+        self.chat_id = None
+        self.message_id = None
+        self.inline_message_id = None
+        # игры из подбора: [[chat_id, message_id]] — по сообщению у каждого игрока
+        self.messages = None
+        # игра с ботом: уровень из solver.LEVELS, бот всегда за O
+        self.bot = None
+        self.size = size
+        self.k = k
+        # клетки по порядку ходов (X, O, X, ...) — для истории партий; байт на
+        # ход (клеток не больше 225): дописывание без копии, в сторе — hex
+        self.moves = bytearray()
+
+    def cell(self, idx):
+        bit = 1 << idx
+        if self.x_bits & bit:
+            return 'X'
+        if self.o_bits & bit:
+            return 'O'
+        return ' '
+
+    def is_free(self, idx):
+        return 0 <= idx < self.size * self.size and not ((self.x_bits | self.o_bits) >> idx) & 1
+
+    def place(self, idx, symbol):
+        # ставит символ и возвращает итог: 'X' / 'O' / 'draw' / None
+        self.moves.append(idx)
+        if self.size == 3 and self.k == 3:
+            # классика — самый частый случай, без поиска геометрии
+            if symbol == 'X':
+                self.x_bits |= 1 << idx
+                if WINNING[self.x_bits]:
+                    return 'X'
+            else:
+                self.o_bits |= 1 << idx
+                if WINNING[self.o_bits]:
+                    return 'O'
+            return 'draw' if self.x_bits | self.o_bits == FULL else None
+        lay = layout(self.size, self.k)
+        if symbol == 'X':
+            self.x_bits |= 1 << idx
+            if lay.wins(self.x_bits, idx):
+                return 'X'
+        else:
+            self.o_bits |= 1 << idx
+            if lay.wins(self.o_bits, idx):
+                return 'O'
+        if self.x_bits | self.o_bits == lay.full:
+            return 'draw'
+        return None
+
+    def copy(self):
+        game = Game.__new__(Game)
+        for name in Game.__slots__:
+            setattr(game, name, getattr(self, name))
+        # копию меняют и кладут через cas — список ходов у неё должен быть свой
+        game.moves = bytearray(self.moves)
+        return game
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in Game.__slots__}
+        data['moves'] = self.moves.hex()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        game = cls.__new__(cls)
+        # полей, добавленных позже, в старых записях может не быть
+        for name in cls.__slots__:
+            setattr(game, name, data.get(name))
+        if game.size is None:
+            game.size, game.k = 3, 3
+        if game.started_at is None:
+            game.started_at = game.created_at if game.started else 0.0
+        moves = game.moves or ''
+        # старые записи — список клеток
+        game.moves = bytearray.fromhex(moves) if isinstance(moves, str) else bytearray(moves)
+        return game
@@ -0,0 +1,245 @@
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+
+import storage
+
+
+GAMES = 'games'
+ADMIN = 'admin'
+# user_id -> id живой игры, за которой он сидит
+SEATS = 'seats'
+
+
+class GameStore(ABC):
+    # Общий интерфейс хранилищ живого состояния, разбитого на пространства
+    # имён (игры, ожидающий ввод админа). Каждая запись несёт версию: get
+    # возвращает (value, version), cas пишет только поверх той же версии.
+    # Версия 0 — «записи нет», value=None в cas — удаление. Значения,
+    # полученные из get, на месте не меняются: правим копию и отдаём в cas.
+
+    @abstractmethod
+    async def get(self, ns, key):
+        pass
+
+    @abstractmethod
+    async def put(self, ns, key, value, ttl=None):
+        pass
+
+    @abstractmethod
+    async def cas(self, ns, key, version, value, ttl=None):
+        pass
+
+    @abstractmethod
+    async def expire(self, ns, now=None):
+        pass
+
+    @abstractmethod
+    async def items(self, ns):
+        pass
+
+    async def update(self, ns, key, fn, ttl=None, attempts=16):
+        # fn(старое значение) -> новое; повторяем, пока не выиграем гонку
+        for _ in range(attempts):
+            value, version = await self.get(ns, key)
+            new = fn(value)
+            if new is None and value is None:
+                return None, 0
+            version = await self.cas(ns, key, version, new, ttl)
+            if version is not None:
+                return new, version
+        raise RuntimeError(f'cas on {ns}:{key} lost {attempts} times in a row')
+
+    async def pop(self, ns, key):
+        for _ in range(16):
+            value, version = await self.get(ns, key)
+            if value is None:
+                return None
+            if await self.cas(ns, key, version, None) is not None:
+                return value
+        return None
+
+    def close(self):
+        pass
+
+
+class MemoryGameStore(GameStore):
+    # Всё в словаре процесса, значения хранятся как есть, без сериализации.
+    # Подходит для одного процесса бота. Как и в SQLite, удалённый ключ
+    # начинает версии заново с 1.
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._data = {}  # (ns, key) -> (value, version, expires)
+
+    def _live(self, ns, key, now):
+        entry = self._data.get((ns, key))
+        if entry is None or (entry[2] is not None and entry[2] <= now):
+            return None
+        return entry
+
+    async def get(self, ns, key):
+        entry = self._live(ns, key, self._clock())
+        if entry is None:
+            return None, 0
+        return entry[0], entry[1]
+
+    async def put(self, ns, key, value, ttl=None):
+        return self._write(ns, key, value, ttl)
+
+    async def cas(self, ns, key, version, value, ttl=None):
+        entry = self._live(ns, key, self._clock())
+        current = entry[1] if entry is not None else 0
+        if current != version or (value is None and version == 0):
+            return None
+        return self._write(ns, key, value, ttl)
+
+    def _write(self, ns, key, value, ttl):
+        k = (ns, key)
+        old = self._data.get(k)
+        version = (old[1] if old is not None else 0) + 1
+        if value is None:
+            self._data.pop(k, None)
+            return version
+        expires = self._clock() + ttl if ttl is not None else None
+        self._data[k] = (value, version, expires)
+        return version
+
+    async def expire(self, ns, now=None):
+        now = self._clock() if now is None else now
+        dead = [k for k, e in self._data.items() if k[0] == ns and e[2] is not None and e[2] <= now]
+        return [(k[1], self._data.pop(k)[0]) for k in dead]
+
+    async def items(self, ns):
+        now = self._clock()
+        return [(k[1], e[0]) for k, e in self._data.items() if k[0] == ns and (e[2] is None or e[2] > now)]
+
+    def __len__(self):
+        return len(self._data)
+
+
+def init_live_games(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS live_games (
+            ns TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            expires REAL,
+            PRIMARY KEY (ns, key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_live_expires ON live_games(ns, expires) WHERE expires IS NOT NULL')
+    conn.commit()
+    conn.close()
+
+
+class SqliteGameStore(GameStore):
+    # Общее для нескольких процессов хранилище в SQLite (WAL). cas — это
+    # UPDATE ... WHERE version=?, поэтому из двух воркеров, одновременно
+    # обработавших ход в одной игре, запишет только один. codecs задаёт для
+    # пространства имён пару (to_dict, from_dict); по умолчанию значение — JSON.
+    # Удалённый ключ начинает версии заново с 1: game_id не переиспользуются.
+    # Между процессами общие только записи; объекты Game у каждого свои.
+
+    def __init__(self, path, codecs=None, clock=time.time):
+        init_live_games(path)
+        self.db = storage.Database(path)
+        self.codecs = codecs or {}
+        self._clock = clock
+
+    def _encode(self, ns, value):
+        codec = self.codecs.get(ns)
+        return json.dumps(codec[0](value) if codec else value, separators=(',', ':'))
+
+    def _decode(self, ns, data):
+        value = json.loads(data)
+        codec = self.codecs.get(ns)
+        return codec[1](value) if codec else value
+
+    @staticmethod
+    def _get(conn, ns, key, now):
+        return conn.execute(
+            'SELECT data, version FROM live_games WHERE ns=? AND key=? AND (expires IS NULL OR expires>?)',
+            (ns, key, now)
+        ).fetchone()
+
+    @staticmethod
+    def _put(conn, ns, key, data, expires):
+        return conn.execute(
+            'INSERT INTO live_games (ns, key, version, data, expires) VALUES (?, ?, 1, ?, ?) '
+            'ON CONFLICT(ns, key) DO UPDATE SET version=version+1, data=excluded.data, expires=excluded.expires '
+            'RETURNING version',
+            (ns, key, data, expires)
+        ).fetchone()[0]
+
+    @staticmethod
+    def _cas(conn, ns, key, version, data, expires, now):
+        if version == 0:
+            # вставка, только если записи нет или она просрочена
+            row = conn.execute(
+                'INSERT INTO live_games (ns, key, version, data, expires) VALUES (?, ?, 1, ?, ?) '
+                'ON CONFLICT(ns, key) DO UPDATE SET version=version+1, data=excluded.data, expires=excluded.expires '
+                'WHERE expires IS NOT NULL AND expires<=? '
+                'RETURNING version',
+                (ns, key, data, expires, now)
+            ).fetchone()
+            return row[0] if row else None
+        if data is None:
+            c = conn.execute('DELETE FROM live_games WHERE ns=? AND key=? AND version=?', (ns, key, version))
+            return version + 1 if c.rowcount else None
+        row = conn.execute(
+            'UPDATE live_games SET data=?, version=version+1, expires=? WHERE ns=? AND key=? AND version=? RETURNING version',
+            (data, expires, ns, key, version)
+        ).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _expire(conn, ns, now):
+        return conn.execute(
+            'DELETE FROM live_games WHERE ns=? AND expires IS NOT NULL AND expires<=? RETURNING key, data',
+            (ns, now)
+        ).fetchall()
+
+    @staticmethod
+    def _items(conn, ns, now):
+        return conn.execute(
+            'SELECT key, data FROM live_games WHERE ns=? AND (expires IS NULL OR expires>?)',
+            (ns, now)
+        ).fetchall()
+
+    def _expires(self, ttl):
+        return self._clock() + ttl if ttl is not None else None
+
+    async def get(self, ns, key):
+        row = await self.db.read(self._get, ns, str(key), self._clock())
+        if row is None:
+            return None, 0
+        return self._decode(ns, row[0]), row[1]
+
+    async def put(self, ns, key, value, ttl=None):
+        if value is None:
+            value, version = await self.get(ns, key)
+            return await self.cas(ns, key, version, None) if value is not None else 0
+        return await self.db.write(self._put, ns, str(key), self._encode(ns, value), self._expires(ttl))
+
+    async def cas(self, ns, key, version, value, ttl=None):
+        if value is None and version == 0:
+            return None
+        data = None if value is None else self._encode(ns, value)
+        return await self.db.write(self._cas, ns, str(key), version, data, self._expires(ttl), self._clock())
+
+    async def expire(self, ns, now=None):
+        now = self._clock() if now is None else now
+        rows = await self.db.write(self._expire, ns, now)
+        return [(key, self._decode(ns, data)) for key, data in rows]
+
+    async def items(self, ns):
+        rows = await self.db.read(self._items, ns, self._clock())
+        return [(key, self._decode(ns, data)) for key, data in rows]
+
+    def close(self):
+        self.db.close()
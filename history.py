@@ -0,0 +1,61 @@
+# Сжатая запись сыгранных партий для game_history. Ходы всегда чередуются
+# X, O, X, ..., так что партию целиком задаёт последовательность клеток:
+# на 3×3 клетка 0..8 — полбайта (два хода в байте, нечётный хвост добит
+# 0xF), на полях больше — байт на ход (клеток не больше 15×15 = 225).
+# Победитель по таймауту не хранится: это тот, чей ход был не следующим.
+from engine import Game
+
+# result в таблице — маленькое целое: одна цифра в записи SQLite вместо строки
+RESULTS = ('draw', 'X', 'O', 'timeout')
+RESULT_CODES = {name: code for code, name in enumerate(RESULTS)}
+PAD = 0xF
+
+
+def pack_moves(moves, size=3):
+    if size != 3:
+        return bytes(moves)
+    out = bytearray()
+    for i in range(0, len(moves), 2):
+        low = moves[i]
+        high = moves[i + 1] if i + 1 < len(moves) else PAD
+        out.append(low | high << 4)
+    return bytes(out)
+
+
+def unpack_moves(blob, size=3):
+    if size != 3:
+        return tuple(blob)
+    moves = []
+    for byte in blob:
+        moves.append(byte & 0xF)
+        if byte >> 4 != PAD:
+            moves.append(byte >> 4)
+    return tuple(moves)
+
+
+def winner(result, moves):
+    # 'X' / 'O' / None для ничьей; при таймауте проиграл тот, чья была очередь
+    if result == 'timeout':
+        return 'O' if len(moves) % 2 == 0 else 'X'
+    return result if result in ('X', 'O') else None
+
+
+def history_row(game, result, finished):
+    # параметры для storage.HISTORY_SQL; id игры — 8 hex-символов, в базе как число.
+    # Начало и длительность — от входа второго игрока, ожидание в лобби не в счёт
+    return (
+        int(game.id, 16), game.x, game.o, game.price, RESULT_CODES[result], game.size, game.k,
+        int(game.started_at), int(finished - game.started_at), pack_moves(game.moves, game.size)
+    )
+
+
+def replay(record, upto=None):
+    # позиция после первых upto ходов партии из storage.get_history
+    game = Game(f"{record['game_id']:08x}", record['x'], record['price'], 0, size=record['size'], k=record['k'])
+    game.o = record['o']
+    symbol = 'X'
+    for idx in unpack_moves(record['moves'], record['size'])[:upto]:
+        game.place(idx, symbol)
+        symbol = 'O' if symbol == 'X' else 'X'
+    game.turn = symbol
+    return game
@@ -0,0 +1,77 @@
+import json
+import time
+
+from engine import Game
+
+
+JOURNAL_SQL = 'INSERT INTO game_journal (game_id, event, data, ts) VALUES (?, ?, ?, ?)'
+
+
+class GameJournal:
+    # Журнал событий живых игр (create/join/move/finish). Записи не коммитятся
+    # по одной: они уходят в очередь write-behind и попадают в ту же
+    # транзакцию, что и изменения балансов (например, эскроу при join).
+
+    def __init__(self, writes):
+        self.writes = writes
+
+    def record(self, game_id, event, **data):
+        self.writes.queue(*entry(game_id, event, **data))
+
+
+def entry(game_id, event, **data):
+    # (sql, params) записи журнала — для транзакций, идущих мимо write-behind
+    return JOURNAL_SQL, (game_id, event, json.dumps(data, separators=(',', ':')), time.time())
+
+
+def load_open_games(conn):
+    c = conn.execute(
+        "SELECT game_id, event, data, ts FROM game_journal "
+        "WHERE game_id NOT IN (SELECT game_id FROM game_journal WHERE event='finish') "
+        "ORDER BY seq"
+    )
+    return c.fetchall()
+
+
+def compact(conn):
+    # завершённые игры больше не нужны для восстановления
+    c = conn.execute("DELETE FROM game_journal WHERE game_id IN (SELECT game_id FROM game_journal WHERE event='finish')")
+    return c.rowcount
+
+
+def replay(events, default_timeout):
+    games = {}
+    for game_id, event, data, ts in events:
+        data = json.loads(data) if data else {}
+        if event == 'create':
+            game = Game(
+                game_id, data['x'], data['price'], data.get('timeout') or default_timeout,
+                type=data.get('type', 'inline'), created_at=ts, size=data.get('size', 3), k=data.get('k', 3)
+            )
+            if data.get('chat_id'):
+                game.chat_id = data['chat_id']
+                game.message_id = data['message_id']
+            game.messages = data.get('messages')
+            game.bot = data.get('bot')
+            games[game_id] = game
+            continue
+        game = games.get(game_id)
+        if game is None:
+            continue
+        if event == 'join':
+            game.o = data['o']
+            game.started = True
+            game.started_at = game.last_move_time = ts
+            game.inline_message_id = data.get('inline_message_id')
+        elif event == 'move':
+            game.place(data['idx'], data['symbol'])
+            game.turn = 'O' if data['symbol'] == 'X' else 'X'
+            game.last_move_time = ts
+    return games
+
+
+def can_resume(game, now=None):
+    # игру можно продолжить, если известно, где её сообщение, и ход ещё не просрочен
+    now = time.time() if now is None else now
+    has_message = game.inline_message_id or (game.chat_id and game.message_id) or game.messages
+    return bool(has_message) and now - game.last_move_time < game.timeout
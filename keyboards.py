@@ -0,0 +1,97 @@
+import json
+from collections import OrderedDict
+
+
+_GID = '{gid}'
+
+
+# Telegram: не больше 8 кнопок в ряду и 100 на клавиатуру. Поле шире
+# показывается окном SPAN×SPAN плюс ряд стрелок — 68 кнопок.
+SPAN = 8
+
+
+class BoardKeyboardCache:
+    # Кэш готовых inline-клавиатур доски. Ключ — состояние доски (маски X и O),
+    # размер поля и окно на нём, значение — JSON разметки, разрезанный по
+    # месту game_id. На ход остаётся только склеить части с id игры: ни
+    # InlineKeyboardButton, ни json.dumps. aiogram передаёт строку
+    # reply_markup в API как есть.
+    #
+    # Кэшируются только поля до cached_size: позиции больших полей почти не
+    # повторяются и только вытесняли бы горячие позиции 3×3.
+
+    def __init__(self, maxsize=8192, span=SPAN, cached_size=3):
+        self.maxsize = maxsize
+        self.span = span
+        self.cached_size = cached_size
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def origin(self, size, around=None):
+        # левый верхний угол окна: вокруг клетки around (или центра поля), в пределах поля
+        if size <= self.span:
+            return 0, 0
+        row, col = divmod(around, size) if around is not None else (size // 2, size // 2)
+        top = min(max(row - self.span // 2, 0), size - self.span)
+        left = min(max(col - self.span // 2, 0), size - self.span)
+        return top, left
+
+    def get(self, game_id, x_bits, o_bits, size=3, top=0, left=0):
+        if size > self.cached_size:
+            self.uncached += 1
+            return game_id.join(self._build(x_bits, o_bits, size, top, left))
+        key = (x_bits, o_bits, size, top, left)
+        parts = self._data.get(key)
+        if parts is None:
+            self.misses += 1
+            parts = self._build(x_bits, o_bits, size, top, left)
+            self._data[key] = parts
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return game_id.join(parts)
+
+    def _build(self, x_bits, o_bits, size, top, left):
+        span = min(size, self.span)
+        rows = []
+        for r in range(top, top + span):
+            rows.append([])
+            for c in range(left, left + span):
+                i = r * size + c
+                bit = 1 << i
+                text = 'X' if x_bits & bit else 'O' if o_bits & bit else '·'
+                rows[-1].append({'text': text, 'callback_data': f'move:{_GID}:{i}'})
+        if size > span:
+            rows.append(self._arrows(size, top, left))
+        return tuple(json.dumps({'inline_keyboard': rows}, ensure_ascii=False, separators=(',', ':')).split(_GID))
+
+    def _arrows(self, size, top, left):
+        # сдвиг окна на полшага; стрелки в край поля не показываем
+        step, last = self.span // 2, size - self.span
+        moves = (
+            ('◀️', top, max(left - step, 0)),
+            ('🔼', max(top - step, 0), left),
+            ('🔽', min(top + step, last), left),
+            ('▶️', top, min(left + step, last)),
+        )
+        return [
+            {'text': text, 'callback_data': f'view:{_GID}:{t}:{l}'}
+            for text, t, l in moves if (t, l) != (top, left)
+        ]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncached': self.uncached,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
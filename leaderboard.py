@@ -0,0 +1,107 @@
+import bisect
+
+
+class Leaderboard:
+    # Топ-K по одному полю пользователя, обновляемый на месте.
+    # Держим отсортированный список ключей (-score, uid) длиной до capacity
+    # (с запасом над K) и карту uid -> score. Инвариант: у всех, кого нет
+    # в списке, значение поля не больше floor, поэтому поднявшийся выше floor
+    # игрок вставляется без похода в БД. Если из-за падений в списке осталось
+    # меньше K записей, выставляется needs_reseed.
+
+    def __init__(self, field, k=10, capacity=50):
+        self.field = field
+        self.k = k
+        self.capacity = capacity
+        self.floor = None  # None — в списке все пользователи
+        self.version = 0
+        self.needs_reseed = False
+        self._keys = []
+        self._scores = {}
+        self._rows = {}
+        self._rendered = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    @staticmethod
+    def _row(u):
+        return (u['id'], u.get('name') or '', u.get('username') or '', u.get('wins', 0), u.get('coins', 0), u.get('rating', 1200))
+
+    def seed(self, records, complete):
+        # records — первые capacity пользователей из БД по убыванию поля
+        self._keys = []
+        self._scores = {}
+        self._rows = {}
+        for u in records:
+            score = u.get(self.field) or 0
+            self._scores[u['id']] = score
+            self._rows[u['id']] = self._row(u)
+            self._keys.append((-score, u['id']))
+        self._keys.sort()
+        if complete or not self._keys:
+            self.floor = None
+        else:
+            self.floor = -self._keys[-1][0]
+        self.needs_reseed = False
+        self.version += 1
+
+    def update(self, u):
+        uid = u['id']
+        score = u.get(self.field) or 0
+        row = self._row(u)
+        old = self._scores.get(uid)
+        if old is None:
+            if self.floor is not None and score <= self.floor:
+                return
+            pos = self._insert(uid, score, row)
+            self._trim()
+            if pos < self.k:
+                self.version += 1
+            return
+
+        old_pos = bisect.bisect_left(self._keys, (-old, uid))
+        old_row = self._rows[uid]
+        del self._keys[old_pos]
+        if self.floor is not None and score < self.floor:
+            # опустился ниже границы — где он теперь, без БД не узнать
+            del self._scores[uid]
+            del self._rows[uid]
+            if len(self._keys) < self.k:
+                self.needs_reseed = True
+            if old_pos < self.k:
+                self.version += 1
+            return
+        pos = self._insert(uid, score, row)
+        if (old_pos < self.k or pos < self.k) and (pos != old_pos or row != old_row):
+            self.version += 1
+
+    def _insert(self, uid, score, row):
+        key = (-score, uid)
+        pos = bisect.bisect_left(self._keys, key)
+        self._keys.insert(pos, key)
+        self._scores[uid] = score
+        self._rows[uid] = row
+        return pos
+
+    def _trim(self):
+        while len(self._keys) > self.capacity:
+            neg_score, uid = self._keys.pop()
+            del self._scores[uid]
+            del self._rows[uid]
+            self.floor = -neg_score
+
+    def top(self):
+        return [self._rows[uid] for _, uid in self._keys[:self.k]]
+
+    def render(self, key, build):
+        # build(rows) вызывается только если топ поменялся с прошлого рендера
+        hit = self._rendered.get(key)
+        if hit is not None and hit[0] == self.version:
+            return hit[1]
+        value = build(self.top())
+        self._rendered[key] = (self.version, value)
+        return value
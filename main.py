@@ -1,4 +1,5 @@
 from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.types import (
     InlineQuery,
     InlineQueryResultArticle,
@@ -6,25 +7,130 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton
 )
+import argparse
+import asyncio
+import csv
+import html
+import logging
+import re
+import tempfile
 import uuid
-import sqlite3
 import os
 import time
-import asyncio
 import config
+import storage
+from cache import UserCache
+from leaderboard import Leaderboard
+import history
+import journal
+import metrics
+from catalog import BUY, EQUIP, EQUIP_FIELDS, UNEQUIP, Catalog
+from engine import MAX_SIZE, Game
+from gamestore import ADMIN, GAMES, SEATS, MemoryGameStore, SqliteGameStore
+from keyboards import BoardKeyboardCache
+from matchmaking import MatchQueue
+from outbox import EditQueue
+from ratings import draw_deltas, elo_delta
+from router import CallbackRouter
+from scheduler import TimerWheel
+from solver import MoveTable
 
 MOVE_TIMEOUT = 30
-
-bot = Bot(config.TOKEN, parse_mode=types.ParseMode.HTML)
+# шаг колеса таймеров, сек: точность срабатывания авто-поражения
+TIMER_TICK = 0.5
+# лобби старше этого при восстановлении после рестарта не поднимаем
+LOBBY_TTL = 24 * 3600
+# write-behind: как часто и при каком размере очереди сбрасывать пользователей в БД
+USER_FLUSH_INTERVAL = 1.0
+USER_FLUSH_BATCH = 200
+# кэш пользователей: максимум записей и время жизни незакреплённой записи (сек)
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 600
+# сколько строк показываем в топе и сколько держим в памяти с запасом
+TOP_SIZE = 10
+TOP_CAPACITY = 50
+# готовые клавиатуры доски по состояниям (всего состояний меньше 3^9)
+KEYBOARD_CACHE_SIZE = 8192
+# как часто чистить просроченные лобби и ввод админа, и сколько ждать ввода (сек)
+STORE_SWEEP_INTERVAL = 60
+ADMIN_INPUT_TTL = 600
+# пользователей на странице в админке; поиск — по первым ADMIN_QUERY_MAX символам
+ADMIN_PAGE_SIZE = 20
+ADMIN_QUERY_MAX = 24
+HISTORY_PAGE_SIZE = 8
+# подбор соперника: ставки на выбор, как часто расширять допуски и сколько ждать (сек)
+MATCH_STAKES = (100, 500, 1000, 5000)
+MATCH_TICK = 1.0
+MATCH_MAX_WAIT = 120
+
+# соперник-бот сидит в Game.o под этим id — у пользователей Telegram такого нет
+BOT_ID = 0
+# уровень -> (подпись, рейтинг бота); рейтинг нужен, только если BOT_RATED
+BOT_LEVELS = {
+    'easy': ('🟢 Лёгкий', 1000),
+    'medium': ('🟡 Средний', 1300),
+    'hard': ('🔴 Непобедимый', 1700),
+}
+BOT_TABLE_PATH = getattr(config, 'BOT_TABLE_PATH', None)
+BOT_RATED = getattr(config, 'BOT_RATED', False)
+# массовые начисления: пользователей на транзакцию
+BULK_CHUNK = 1000
+# журнал коинов: строки старше LEDGER_KEEP сворачиваются раз в LEDGER_COMPACT_INTERVAL
+LEDGER_KEEP = 30 * 24 * 3600
+LEDGER_COMPACT_INTERVAL = 24 * 3600
+# метрики: HTTP в формате Prometheus (порт None — выключен) и/или строка в лог раз в N сек
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', None)
+METRICS_LOG_INTERVAL = getattr(config, 'METRICS_LOG_INTERVAL', 0)
+
+log = logging.getLogger(__name__)
+
+API_SERVER = getattr(config, 'TELEGRAM_API_SERVER', None)
+if API_SERVER:
+    bot = metrics.MeteredBot(config.TOKEN, parse_mode=types.ParseMode.HTML, server=TelegramAPIServer.from_base(API_SERVER))
+else:
+    bot = metrics.MeteredBot(config.TOKEN, parse_mode=types.ParseMode.HTML)
 dp = Dispatcher(bot)
+dp.middleware.setup(metrics.HandlerMetrics())
+outbox = EditQueue(bot)
+# все callback-кнопки идут через один хендлер и дерево маршрутов
+router = CallbackRouter(observe=metrics.observe_route)
+# включается админом из панели, пока выключен — ничего не стоит
+profiler = metrics.SamplingProfiler()
 
-users = {}
-admin_pending = {}  
 
-games = {}
-DEFAULT_GAME_PRICE = 1000
-DB_PATH = os.path.join(os.path.dirname(__file__), "data.db")
+@dp.callback_query_handler()
+async def route_callback(call: types.CallbackQuery):
+    await router.dispatch(call)
+
 
+@dp.errors_handler()
+async def count_errors(update, error):
+    metrics.HANDLER_ERRORS.inc(error=type(error).__name__)
+    # None — aiogram залогирует исключение как обычно
+
+
+users = UserCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# живые игры и ожидающий ввод админа; SQLite-стор общий для нескольких процессов
+GAME_STORE_PATH = getattr(config, 'GAME_STORE_PATH', None)
+if GAME_STORE_PATH:
+    game_store = SqliteGameStore(GAME_STORE_PATH, codecs={GAMES: (Game.to_dict, Game.from_dict)})
+else:
+    game_store = MemoryGameStore()
+board_keyboards = BoardKeyboardCache(maxsize=KEYBOARD_CACHE_SIZE)
+# очередь подбора — в памяти процесса, как и кэш пользователей
+match_queue = MatchQueue(max_wait=MATCH_MAX_WAIT)
+boards = {mode: Leaderboard(mode, k=TOP_SIZE, capacity=TOP_CAPACITY) for mode in ('wins', 'coins', 'rating')}
+DEFAULT_GAME_PRICE = 1000
+# что предлагает инлайн без явного поля: (размер, сколько в ряд)
+BOARD_PRESETS = ((3, 3), (5, 4), (15, 5))
+# поле в запросе: "5x5", "15x15/5" (x, х или ×)
+BOARD_RE = re.compile(r'^(\d+)[xх×](\d+)(?:/(\d+))?$')
+# XO_DB_PATH — например, временная база для бенчмарков
+DB_PATH = os.environ.get('XO_DB_PATH') or getattr(config, 'DB_PATH', None) or os.path.join(os.path.dirname(__file__), "data.db")
+
+# встроенный каталог; CATALOG_PATH в config — JSON, который его заменяет и перечитывается из админки
 ITEMS = {
     'symbol_stars': {'id':'symbol_stars','category':'symbol','name':'Звёздочки','price':500,'preview':{'x':'⭐','o':'✴️'},'desc':'X→⭐, O→✴️'},
     'symbol_fox': {'id':'symbol_fox','category':'symbol','name':'Лисички','price':700,'preview':{'x':'🦊','o':'🌕'},'desc':'Лисички вместо X/O'},
@@ -43,226 +149,292 @@ ITEMS = {
 }
 
 
+CATALOG_PATH = getattr(config, 'CATALOG_PATH', None)
+catalog = Catalog(list(ITEMS.values()))
+
+
+def reload_catalog():
+    # новый снимок строится целиком и подменяет ссылку одним присваиванием;
+    # позиции битов старых предметов сохраняются, маски в кэше остаются верными
+    global catalog
+    catalog = Catalog.from_json(CATALOG_PATH, previous=catalog)
+    return catalog
+
+
 def find_item(item_id):
-    return ITEMS.get(item_id)
-
-
-def items_by_category(cat):
-    return [it for it in ITEMS.values() if it['category'] == cat]
-
-
-def owns_item(user_id, item_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT 1 FROM purchases WHERE user_id=? AND item_id=?', (user_id, item_id))
-    res = c.fetchone()
-    conn.close()
-    return bool(res)
-
-
-def grant_item(user_id, item_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('INSERT OR IGNORE INTO purchases (user_id, item_id, bought_at) VALUES (?, ?, ?)', (user_id, item_id, int(time.time())))
-    conn.commit()
-    conn.close()
-
-
-def get_user_items(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT item_id FROM purchases WHERE user_id=?', (user_id,))
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT,
-            name TEXT DEFAULT '',
-            coins INTEGER,
-            wins INTEGER DEFAULT 0,
-            losses INTEGER DEFAULT 0,
-            draws INTEGER DEFAULT 0,
-            rating INTEGER DEFAULT 1200,
-            equipped_symbol TEXT DEFAULT '',
-            equipped_bg TEXT DEFAULT '',
-            equipped_emoji_pack TEXT DEFAULT '',
-            equipped_animation TEXT DEFAULT ''
-        )
-        """
-    )
-    conn.commit()
-
-    c.execute("PRAGMA table_info(users)")
-    cols = [r[1] for r in c.fetchall()]
-    if 'wins' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN wins INTEGER DEFAULT 0")
-    if 'losses' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN losses INTEGER DEFAULT 0")
-    if 'draws' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN draws INTEGER DEFAULT 0")
-    if 'rating' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN rating INTEGER DEFAULT 1200")
-    if 'name' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN name TEXT DEFAULT ''")
-    if 'equipped_symbol' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN equipped_symbol TEXT DEFAULT ''")
-    if 'equipped_bg' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN equipped_bg TEXT DEFAULT ''")
-    if 'equipped_emoji_pack' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN equipped_emoji_pack TEXT DEFAULT ''")
-    if 'equipped_animation' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN equipped_animation TEXT DEFAULT ''")
-
-    # purchases table: records owned items per user
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS purchases (user_id INTEGER, item_id TEXT, bought_at INTEGER, PRIMARY KEY(user_id, item_id))"
-    )
+    return catalog.get(item_id)
+
+
+# купленное хранится в кэшированной записи пользователя битовой маской:
+# бит предмета — его позиция в каталоге
+async def owned_items(user):
+    # purchases читается один раз на жизнь записи в кэше, дальше — только бит в памяти
+    if user.get('owned') is None:
+        mask = catalog.mask(await get_user_items(user['id']))
+        # предметы только добавляются, так что параллельная загрузка ничего не потеряет
+        user['owned'] = (user.get('owned') or 0) | mask
+    return user['owned']
+
+
+async def owns_item(user, item_id):
+    return bool(await owned_items(user) & catalog.bits.get(item_id, 0))
+
 
-    conn.commit()
-    conn.close()
+def mark_owned(user, item_id):
+    # маска ещё не загружена — её и так прочитают из purchases
+    if user.get('owned') is not None:
+        user['owned'] |= catalog.bits.get(item_id, 0)
 
-init_db()
 
+async def get_user_items(user_id):
+    return await db.read(storage.get_user_items, user_id)
 
-def ensure_user_record(user):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id FROM users WHERE id=?', (user.id,))
+
+storage.init_db(DB_PATH)
+db = storage.Database(DB_PATH, observe=metrics.observe_db)
+user_writes = storage.WriteBehind(db, interval=USER_FLUSH_INTERVAL, max_pending=USER_FLUSH_BATCH)
+game_log = journal.GameJournal(user_writes)
+
+
+def user_names(user):
     display_name = ' '.join(filter(None, [getattr(user, 'first_name', ''), getattr(user, 'last_name', '')])).strip() or (user.username or 'no_username')
-    if not c.fetchone():
-        c.execute('INSERT INTO users (id, username, name, coins, wins, losses, draws, rating, equipped_symbol, equipped_bg, equipped_emoji_pack, equipped_animation) VALUES (?, ?, ?, ?, 0, 0, 0, 1200, ?, ?, ?, ?)', (user.id, user.username or 'no_username', display_name, 5000, '', '', '', ''))
-    else:
-        c.execute('UPDATE users SET username=?, name=? WHERE id=?', (user.username or 'no_username', display_name, user.id))
-    conn.commit()
-    conn.close()
-
-
-def load_user(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, username, name, coins, wins, losses, draws, rating, equipped_symbol, equipped_bg, equipped_emoji_pack, equipped_animation FROM users WHERE id=?', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return {
-            "id": row[0],
-            "username": row[1],
-            "name": row[2] or row[1],
-            "coins": row[3],
-            "wins": row[4] or 0,
-            "losses": row[5] or 0,
-            "draws": row[6] or 0,
-            "rating": row[7] or 1200,
-            "equipped_symbol": row[8] or '',
-            "equipped_bg": row[9] or '',
-            "equipped_emoji_pack": row[10] or '',
-            "equipped_animation": row[11] or ''
-        }
-    return None
-
-
-def save_user(user):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('UPDATE users SET username=?, name=?, coins=?, wins=?, losses=?, draws=?, rating=?, equipped_symbol=?, equipped_bg=?, equipped_emoji_pack=?, equipped_animation=? WHERE id=?', (
-        user['username'],
-        user.get('name', user['username']),
-        user['coins'],
-        user.get('wins', 0),
-        user.get('losses', 0),
-        user.get('draws', 0),
-        user.get('rating', 1200),
-        user.get('equipped_symbol', ''),
-        user.get('equipped_bg', ''),
-        user.get('equipped_emoji_pack', ''),
-        user.get('equipped_animation', ''),
-        user['id']
-    ))
-    conn.commit()
-    conn.close()
-
-
-def get_all_user_ids():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id FROM users')
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    return user.username or 'no_username', display_name
+
+
+@metrics.timed()
+async def load_user(user_id):
+    return await db.read(storage.load_user, user_id)
+
+
+def update_boards(user):
+    for board in boards.values():
+        board.update(user)
+
+
+def touch_user(user):
+    # горячие пути (ходы, таймауты): запись уйдёт в БД пачкой
+    user_writes.mark(user)
+    update_boards(user)
+
+
+def record_result(user, wins=0, losses=0, draws=0, rating=0):
+    # итог партии: в кэше — сразу, в БД — дельтами через write-behind, так что
+    # процессы, у которых игрок закэширован по-разному, не затирают друг друга
+    user['wins'] = user.get('wins', 0) + wins
+    user['losses'] = user.get('losses', 0) + losses
+    user['draws'] = user.get('draws', 0) + draws
+    user['rating'] = user.get('rating', 1200) + rating
+    user_writes.result(user['id'], wins, losses, draws, rating)
+    update_boards(user)
+
+
+def credit(user, amount, reason, ref=None):
+    # начисление безусловно, поэтому может подождать сброса write-behind
+    user['coins'] += amount
+    user_writes.credit(user['id'], amount, reason, ref)
+
+
+async def settle_credits(user_ids):
+    # списание проверяется по балансу в БД — отложенные начисления должны быть там
+    if any(user_writes.pending_credit(uid) for uid in user_ids):
+        await user_writes.flush()
+
+
+async def sync_coins(balances):
+    for uid, coins in balances.items():
+        u = await get_user(uid)
+        if u is not None:
+            u['coins'] = coins + user_writes.pending_credit(uid)
+            update_boards(u)
+
+
+async def transfer(legs, reason, ref=None, statements=()):
+    # legs — [(user_id, delta)]; всё или ничего, при нехватке — storage.InsufficientFunds
+    await settle_credits([uid for uid, delta in legs if delta < 0])
+    balances = await db.write(storage.transfer, legs, reason, ref, list(statements))
+    await sync_coins(balances)
+    return balances
+
+
+async def adjust_coins(user_id, amount):
+    await settle_credits([user_id])
+    coins = await db.write(storage.adjust_coins, user_id, amount, 'admin')
+    if coins is not None:
+        await sync_coins({user_id: coins})
+    return coins
 
 
+@metrics.timed()
+async def get_user(user_id):
+    u = users.get(user_id) or user_writes.pending(user_id)
+    if u is None:
+        u = await load_user(user_id)
+        if u is not None:
+            user_writes.overlay(u)
+    if u and user_id not in users:
+        users[user_id] = u
+    return u
+
+
+async def browse_users(order, cursor=None, backward=False, query=None):
+    if query and query.isdigit():
+        return await db.read(storage.browse_users_by_id_prefix, query, cursor, backward, ADMIN_PAGE_SIZE)
+    return await db.read(storage.browse_users, order, cursor, backward, ADMIN_PAGE_SIZE, query)
+
+
+async def get_top_users(column, limit=10):
+    # иначе только что сыгранные партии ещё не видны в таблице
+    await user_writes.flush()
+    return await db.read(storage.top_users, column, limit)
+
+
+async def seed_board(mode):
+    board = boards[mode]
+    rows = await get_top_users(mode, board.capacity)
+    board.seed(rows, complete=len(rows) < board.capacity)
+    # то, что успело измениться, пока шёл запрос
+    for u in user_writes.records():
+        board.update(u)
+
+
+def human_players(game):
+    return (game.x,) if game.bot else (game.x, game.o)
+
+
+async def seat_players(game):
+    # игроки активной игры не должны вытесняться из кэша до её конца; место
+    # в сторе видно и другим процессам — по нему подбор не берёт занятых
+    for uid in human_players(game):
+        users.pin(uid)
+        await game_store.put(SEATS, uid, game.id)
+
+
+async def seated_game(user_id):
+    # id живой игры игрока или None; место от уже закончившейся игры не в счёт
+    game_id, _ = await game_store.get(SEATS, user_id)
+    if game_id is None:
+        return None
+    game, _ = await game_store.get(GAMES, game_id)
+    if game is None or not game.started or user_id not in (game.x, game.o):
+        return None
+    return game_id
+
+
+async def end_game(game, version, result):
+    # игру завершает тот, чей cas удалил её из стора; остальные ничего не платят
+    if await game_store.cas(GAMES, game.id, version, None) is None:
+        return False
+    game_log.record(game.id, 'finish', result=result)
+    if game.started:
+        for uid in human_players(game):
+            users.unpin(uid)
+            # игрок мог уже сесть за другую игру — тогда место не наше
+            seat, seat_version = await game_store.get(SEATS, uid)
+            if seat == game.id:
+                await game_store.cas(SEATS, uid, seat_version, None)
+        if result in history.RESULT_CODES:
+            # строка истории уходит той же пачкой write-behind, что и finish
+            user_writes.queue(storage.HISTORY_SQL, history.history_row(game, result, time.time()))
+    return True
+
+
+def display_name(user):
+    return user.get('name') or user['username']
+
+
+async def pay_win(game, winner_id, loser_id):
+    # -> (победитель, проигравший, рейтинг победителю) или None. Игроков
+    # берём через get_user: в этом процессе их может не быть в кэше
+    winner, loser = await get_user(winner_id), await get_user(loser_id)
+    if winner is None or loser is None:
+        return None
+    credit(winner, game.price * 2, 'payout', game.id)
+    delta = elo_delta(winner.get('rating', 1200), loser.get('rating', 1200))
+    record_result(winner, wins=1, rating=delta)
+    record_result(loser, losses=1, rating=-delta)
+    return winner, loser, delta
+
+
+async def pay_draw(game):
+    # ставки назад обоим; False — кого-то из игроков нет в БД
+    x, o = await get_user(game.x), await get_user(game.o)
+    if x is None or o is None:
+        return False
+    credit(x, game.price, 'draw', game.id)
+    credit(o, game.price, 'draw', game.id)
+    dx, do = draw_deltas(x.get('rating', 1200), o.get('rating', 1200))
+    record_result(x, draws=1, rating=dx)
+    record_result(o, draws=1, rating=do)
+    return True
+
+
+def arm_game_timer(game, delay=None):
+    timers.arm(game.id, game.timeout if delay is None else delay)
+
 
 def cancel_game_timer(game_id):
-    t = games.get(game_id, {}).get('timer_task')
-    if t and not t.done():
-        t.cancel()
+    timers.cancel(game_id)
 
 
-async def move_timer(game_id, inline_message_id):
+async def move_timer(game_id):
     try:
-        await asyncio.sleep(MOVE_TIMEOUT)
-        game = games.get(game_id)
-        if not game or not game.get('started'):
+        game, version = await game_store.get(GAMES, game_id)
+        if not game or not game.started:
             return
-        if time.time() - game.get('last_move_time', 0) >= MOVE_TIMEOUT:
-            turn = game['turn']
-            winner_symbol = 'O' if turn == 'X' else 'X'
-            winner_id = game['x'] if winner_symbol == 'X' else game['o']
-            loser_id = game['o'] if winner_id == game['x'] else game['x']
-            price = game.get('price', DEFAULT_GAME_PRICE)
-            # payout
-            if winner_id in users:
-                users[winner_id]['coins'] += price * 2
-                users[winner_id]['wins'] = users[winner_id].get('wins', 0) + 1
-                users[loser_id]['losses'] = users[loser_id].get('losses', 0) + 1
-                # rating change
-                ra = users[winner_id].get('rating', 1200)
-                rb = users[loser_id].get('rating', 1200)
-                delta = elo_delta(ra, rb, k=32)
-                users[winner_id]['rating'] = ra + delta
-                users[loser_id]['rating'] = rb - delta
-                save_user(users[winner_id])
-                save_user(users[loser_id])
-                text = (
-                    f"<b>🎮 Игра #{game_id}</b>\n\n"
-                    f"⏱ Авто-поражение — игрок пропустил ход (>{MOVE_TIMEOUT}s)\n"
-                    f"🏆 Победил <b>{users[winner_id].get('name') or users[winner_id]['username']}</b> (+{delta} рейтинга)\n"
-                    f"💰 Выигрыш: <b>{price*2}</b> коинов"
-                )
-                # edit where the game message lives (chat or inline)
-                if game.get('type') == 'chat' and game.get('chat_id') and game.get('message_id'):
-                    try:
-                        await bot.edit_message_text(text, chat_id=game['chat_id'], message_id=game['message_id'], parse_mode=types.ParseMode.HTML)
-                    except Exception:
-                        pass
-                else:
-                    try:
-                        if inline_message_id:
-                            await safe_edit_message_text(inline_message_id=inline_message_id, text=text, parse_mode=types.ParseMode.HTML)
-                    except Exception:
-                        pass
-            games.pop(game_id, None)
-    except asyncio.CancelledError:
-        return
+        timeout = game.timeout
+        elapsed = time.time() - game.last_move_time
+        if elapsed < timeout:
+            # часы колеса и time.time() могут немного разойтись — ждём остаток
+            arm_game_timer(game, timeout - elapsed)
+            return
+        turn = game.turn
+        winner_symbol = 'O' if turn == 'X' else 'X'
+        winner_id = game.x if winner_symbol == 'X' else game.o
+        loser_id = game.o if winner_id == game.x else game.x
+        price = game.price
+        # ход мог прийти, пока читали игру, — тогда cas не пройдёт
+        if not await end_game(game, version, 'timeout'):
+            return
+        if game.bot:
+            if await get_user(game.x):
+                await show_game(game, await finish_bot_game(game, 'O', f"⏱ Время на ход вышло (>{timeout}s)"))
+            return
+        # payout
+        paid = await pay_win(game, winner_id, loser_id)
+        if paid:
+            winner, _, delta = paid
+            text = (
+                f"<b>🎮 Игра #{game_id}</b>\n\n"
+                f"⏱ Авто-поражение — игрок пропустил ход (>{timeout}s)\n"
+                f"🏆 Победил <b>{display_name(winner)}</b> (+{delta} рейтинга)\n"
+                f"💰 Выигрыш: <b>{price*2}</b> коинов"
+            )
+            await show_game(game, text)
     except Exception:
-        return
+        log.exception('move timer for %s failed', game_id)
 
 
-def reg_user(user):
-    ensure_user_record(user)
-    u = load_user(user.id)
-    users[user.id] = u
+# один обходчик на все таймеры ходов вместо задачи на каждую игру
+timers = TimerWheel(move_timer, tick=TIMER_TICK)
 
 
-def new_board():
-    return [" "] * 9
+@metrics.timed()
+async def reg_user(user):
+    username, display_name = user_names(user)
+    # запись, ожидающая write-behind, новее той, что лежит в БД
+    u = users.get(user.id) or user_writes.pending(user.id)
+    if u is None:
+        u = user_writes.overlay(await db.write(storage.upsert_user, user.id, username, display_name))
+        users[user.id] = u
+        # новичок может попасть в топ, пока пользователей мало
+        for board in boards.values():
+            board.update(u)
+        return
+    if u['username'] != username or u['name'] != display_name:
+        u['username'], u['name'] = username, display_name
+        touch_user(u)
+    if user.id not in users:
+        users[user.id] = u
 
 
 def kb_join(game_id):
@@ -276,34 +448,30 @@ def kb_join(game_id):
     return kb
 
 
-def kb_board(game_id):
-    kb = InlineKeyboardMarkup(row_width=3)
-    for i in range(9):
-        text = games[game_id]["board"][i]
-        kb.insert(
-            InlineKeyboardButton(
-                text=text if text != " " else "·",
-                callback_data=f"move:{game_id}:{i}"
-            )
-        )
-    return kb
+def kb_board(game, around=None):
+    # поле шире клавиатуры показываем окном вокруг последнего хода
+    top, left = board_keyboards.origin(game.size, around)
+    return board_keyboards.get(game.id, game.x_bits, game.o_bits, game.size, top, left)
 
 
-def check_winner(board):
-    win_lines = [
-        (0,1,2),(3,4,5),(6,7,8),
-        (0,3,6),(1,4,7),(2,5,8),
-        (0,4,8),(2,4,6)
-    ]
+def default_k(size):
+    return 3 if size == 3 else 4 if size < 7 else 5
+
 
-    for a, b, c in win_lines:
-        if board[a] != " " and board[a] == board[b] == board[c]:
-            return board[a]  # X или O
+def parse_board(spec):
+    # -> (size, k) или None
+    m = BOARD_RE.match(spec.lower())
+    if not m or m.group(1) != m.group(2):
+        return None
+    size = int(m.group(1))
+    k = int(m.group(3)) if m.group(3) else default_k(size)
+    if not 3 <= k <= size <= MAX_SIZE:
+        return None
+    return size, k
 
-    if " " not in board:
-        return "draw"
 
-    return None
+def board_label(size, k):
+    return "классика 3×3" if (size, k) == (3, 3) else f"поле {size}×{size}, {k} в ряд"
 
 
 def get_rank_name(rating):
@@ -316,12 +484,6 @@ def get_rank_name(rating):
     return "🟢 Новичок"
 
 
-def elo_delta(r_a, r_b, k=32):
-    ea = 1 / (1 + 10 ** ((r_b - r_a) / 400))
-    delta = int(round(k * (1 - ea)))
-    return delta
-
-
 def format_user_info(u):
     rank = get_rank_name(u.get('rating', 1200))
     name = u.get('name') or ''
@@ -339,42 +501,56 @@ def format_user_info(u):
 
 @dp.inline_handler()
 async def inline_handler(query: InlineQuery):
-    reg_user(query.from_user)
+    await reg_user(query.from_user)
 
-    q = (query.query or "").strip()
+    # "500", "500 5x5", "15x15/5 1000" — ставка и поле в любом порядке
     price = DEFAULT_GAME_PRICE
-    if q:
+    boards = BOARD_PRESETS
+    for token in (query.query or "").split():
+        board = parse_board(token)
+        if board:
+            boards = (board,)
+            continue
         try:
-            p = int(q)
+            p = int(token)
             if p > 0:
                 price = p
         except Exception:
-            price = DEFAULT_GAME_PRICE
+            pass
 
-    result = InlineQueryResultArticle(
-        id=str(uuid.uuid4()),
-        title=f"🎮 Создать игру — {price} коинов",
-        description="Классические крестики-нолики — смело приглашайте игроков",
-        input_message_content=InputTextMessageContent(
-            f"🎮 Создание игры…|{price}"
-        ),
-    )
+    results = [
+        InlineQueryResultArticle(
+            id=str(uuid.uuid4()),
+            title=f"🎮 Создать игру — {price} коинов" + ("" if (size, k) == (3, 3) else f" · {size}×{size}"),
+            description=f"Крестики-нолики, {board_label(size, k)} — смело приглашайте игроков",
+            input_message_content=InputTextMessageContent(
+                f"🎮 Создание игры…|{price}|{size}|{k}"
+            ),
+        )
+        for size, k in boards
+    ]
 
-    await query.answer([result], cache_time=1)
+    await query.answer(results, cache_time=1)
 
 @dp.message_handler(lambda m: m.text and m.text.startswith("🎮 Создание игры"))
 async def create_game(message: types.Message):
-    reg_user(message.from_user)
+    await reg_user(message.from_user)
 
     user = users[message.from_user.id]
 
+    # "🎮 Создание игры…|цена|размер|k"; старые сообщения — только с ценой
+    parts = message.text.split("|")
     try:
-        parts = message.text.split("|")
-        price = int(parts[-1]) if len(parts) > 1 else DEFAULT_GAME_PRICE
+        price = int(parts[1]) if len(parts) > 1 else DEFAULT_GAME_PRICE
         if price <= 0:
             price = DEFAULT_GAME_PRICE
     except Exception:
         price = DEFAULT_GAME_PRICE
+    size, k = 3, 3
+    if len(parts) > 3 and parts[2].isdigit() and parts[3].isdigit():
+        size, k = int(parts[2]), int(parts[3])
+        if not 3 <= k <= size <= MAX_SIZE:
+            size, k = 3, 3
 
     if user["coins"] < price:
         # reply instead of editing to be safe in all contexts
@@ -382,18 +558,11 @@ async def create_game(message: types.Message):
         return
 
     game_id = str(uuid.uuid4())[:8]
-    games[game_id] = {
-        "type": "inline",
-        "x": message.from_user.id,
-        "o": None,
-        "board": new_board(),
-        "turn": "X",
-        "started": False,
-        "price": price
-    }
+    game = Game(game_id, message.from_user.id, price, MOVE_TIMEOUT, created_at=time.time(), size=size, k=k)
 
     text = (
-        f"<b>🎮 Игра #{game_id}</b> — <i>Ставка:</i> <b>{price}</b> коинов\n\n"
+        f"<b>🎮 Игра #{game_id}</b> — <i>Ставка:</i> <b>{price}</b> коинов\n"
+        f"📐 {board_label(size, k).capitalize()}\n\n"
         f"👑 Игрок: <b>{user.get('name') or user.get('username')}</b>\n"
         f"⏳ <i>Ожидание соперника…</i>"
     )
@@ -401,205 +570,422 @@ async def create_game(message: types.Message):
     # Try editing user's message (works for some inline contexts), otherwise send bot message in chat
     try:
         await message.edit_text(text, reply_markup=kb_join(game_id), parse_mode=types.ParseMode.HTML)
-        games[game_id]['type'] = 'inline'
+        game.type = 'inline'
     except Exception:
         m = await bot.send_message(message.chat.id, text, reply_markup=kb_join(game_id), parse_mode=types.ParseMode.HTML)
-        games[game_id]['type'] = 'chat'
-        games[game_id]['chat_id'] = m.chat.id
-        games[game_id]['message_id'] = m.message_id
+        game.type = 'chat'
+        game.chat_id = m.chat.id
+        game.message_id = m.message_id
+    await game_store.put(GAMES, game_id, game, ttl=LOBBY_TTL)
+    game_log.record(game_id, 'create', x=game.x, price=price, type=game.type, chat_id=game.chat_id, message_id=game.message_id, timeout=game.timeout, size=size, k=k)
+
+
+
+
+
+def game_targets(game):
+    # где живёт сообщение игры: инлайн, сообщение в чате или по одному у каждого игрока (подбор)
+    if game.messages:
+        return [{'chat_id': chat_id, 'message_id': message_id} for chat_id, message_id in game.messages]
+    if game.type == 'chat' and game.chat_id and game.message_id:
+        return [{'chat_id': game.chat_id, 'message_id': game.message_id}]
+    if game.inline_message_id:
+        return [{'inline_message_id': game.inline_message_id}]
+    return []
+
+
+async def show_game(game, text, kb=None):
+    for target in game_targets(game):
+        if kb is not None:
+            target['reply_markup'] = kb
+        await safe_edit_message_text(text, parse_mode=types.ParseMode.HTML, **target)
 
 
+async def board_text(game):
+    # игроки могли выпасть из кэша или быть закэшированы в другом процессе
+    x = await get_user(game.x)
+    if game.bot:
+        o_name = f"🤖 Бот — {BOT_LEVELS[game.bot][0]}"
+    else:
+        o_name = display_name(await get_user(game.o))
+    text = (
+        f"<b>🎮 Игра #{game.id}</b>\n\n"
+        f"❌ X: <b>{display_name(x)}</b>\n"
+        f"⭕ O: <b>{o_name}</b>\n\n"
+        f"<b>Ход:</b> {'❌' if game.turn=='X' else '⭕'}"
+    )
+    if game.size != 3 or game.k != 3:
+        text += f"\n📐 {board_label(game.size, game.k).capitalize()}"
+    if game.size > board_keyboards.span:
+        # кнопки — только окно поля, целиком оно в тексте
+        text += "\n\n<pre>" + grid_text(game) + "</pre>"
+    return text
+
+
+def grid_text(game):
+    size = game.size
+    cols = 'abcdefghijklmnopqrstuvwxyz'[:size]
+    lines = ['   ' + ' '.join(cols)]
+    for r in range(size):
+        row = []
+        for c in range(size):
+            bit = 1 << (r * size + c)
+            row.append('X' if game.x_bits & bit else 'O' if game.o_bits & bit else '·')
+        lines.append(f'{r + 1:>2} ' + ' '.join(row))
+    return '\n'.join(lines)
+
+
+async def start_game(lobby, version, o_id, inline_message_id=None):
+    # Общий вход в игру для join и подбора: cas лобби -> эскроу с обоих ->
+    # таймер и доска. None — игра недоступна; при нехватке коинов лобби
+    # возвращается в стор как было и летит storage.InsufficientFunds.
+    # создатель лобби мог уже выпасть из кэша
+    if await get_user(lobby.x) is None or await get_user(o_id) is None:
+        return None
+    game = lobby.copy()
+    game.o = o_id
+    game.started = True
+    if game.type == 'inline' and inline_message_id:
+        game.inline_message_id = inline_message_id
+    # Инициализируем время последнего хода; с него же считается длительность партии
+    game.started_at = game.last_move_time = time.time()
+    # второй игрок мог успеть раньше (в том числе в другом процессе)
+    version = await game_store.cas(GAMES, game.id, version, game)
+    if version is None:
+        return None
+    # эскроу с обоих и запись о входе — одна транзакция; create из журнала
+    # должен лечь в БД раньше неё, иначе после рестарта join не к чему применить
+    await user_writes.flush()
+    try:
+        await transfer(
+            [(game.x, -game.price), (game.o, -game.price)], 'escrow', game.id,
+            [journal.entry(game.id, 'join', o=game.o, inline_message_id=game.inline_message_id)]
+        )
+    except storage.InsufficientFunds:
+        # возвращаем лобби как было
+        await game_store.cas(GAMES, game.id, version, lobby, ttl=LOBBY_TTL - (time.time() - lobby.created_at))
+        raise
+    await seat_players(game)
 
+    # запускаем наблюдатель таймаута
+    arm_game_timer(game)
+    await show_game(game, await board_text(game), kb_board(game))
+    return game
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("join:"))
-async def join_game(call: types.CallbackQuery):
-    reg_user(call.from_user)
+@router.route("join:{game_id}")
+async def join_game(call: types.CallbackQuery, game_id):
+    await reg_user(call.from_user)
 
-    game_id = call.data.split(":")[1]
-    game = games.get(game_id)
+    game, version = await game_store.get(GAMES, game_id)
 
-    if not game or game["started"]:
+    if not game or game.started or game.type == 'match':
         await call.answer("Игра недоступна", show_alert=True)
         return
 
-    if call.from_user.id == game["x"]:
+    if call.from_user.id == game.x:
         await call.answer("Нельзя играть с собой", show_alert=True)
         return
 
     user = users[call.from_user.id]
-    price = game.get('price', DEFAULT_GAME_PRICE)
-    if user["coins"] < price:
+    if user["coins"] < game.price:
         await call.answer("Недостаточно коинов", show_alert=True)
         return
 
-    game["o"] = call.from_user.id
-    game["started"] = True
-
-    users[game["x"]]["coins"] -= price
-    users[game["o"]]["coins"] -= price
-    save_user(users[game["x"]])
-    save_user(users[game["o"]])
-
-    # Инициализируем время последнего хода и запускаем наблюдатель таймаута
-    game['last_move_time'] = time.time()
-    game['timer_task'] = asyncio.create_task(move_timer(game_id, call.inline_message_id if game.get('type')=='inline' else None))
-
-    text = (
-        f"<b>🎮 Игра #{game_id}</b>\n\n"
-        f"❌ X: <b>{users[game['x']].get('name') or users[game['x']]['username']}</b>\n"
-        f"⭕ O: <b>{users[game['o']].get('name') or users[game['o']]['username']}</b>\n\n"
-        f"<b>Ход:</b> ❌"
-    )
-    kb = kb_board(game_id)
-
-    # Edit depending on where the game message lives
-    if game.get('type') == 'chat' and game.get('chat_id') and game.get('message_id'):
-        try:
-            await bot.edit_message_text(text, chat_id=game['chat_id'], message_id=game['message_id'], reply_markup=kb, parse_mode=types.ParseMode.HTML)
-        except Exception:
-            pass
-    else:
-        try:
-            await safe_edit_message_text(inline_message_id=call.inline_message_id, text=text, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-        except Exception:
-            pass
-
+    try:
+        started = await start_game(game, version, call.from_user.id, call.inline_message_id)
+    except storage.InsufficientFunds as e:
+        who = "Недостаточно коинов" if e.user_id == call.from_user.id else "У создателя игры недостаточно коинов"
+        await call.answer(who, show_alert=True)
+        return
+    if started is None:
+        await call.answer("Игра недоступна", show_alert=True)
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("move:"))
-async def move(call: types.CallbackQuery):
-    reg_user(call.from_user)
 
-    _, game_id, idx = call.data.split(":")
-    idx = int(idx)
+@router.route("move:{game_id}:{idx:int}")
+async def move(call: types.CallbackQuery, game_id, idx):
+    await reg_user(call.from_user)
 
-    game = games.get(game_id)
+    game, version = await game_store.get(GAMES, game_id)
 
-    if not game or not game["started"]:
+    if not game or not game.started:
         return
 
-    if call.from_user.id not in (game["x"], game["o"]):
+    if call.from_user.id not in (game.x, game.o):
         await call.answer("Вы не игрок", show_alert=True)
         return
 
-    symbol = "X" if call.from_user.id == game["x"] else "O"
+    symbol = "X" if call.from_user.id == game.x else "O"
 
-    if symbol != game["turn"]:
+    if symbol != game.turn:
         await call.answer("Не ваш ход", show_alert=True)
         return
 
-    if game["board"][idx] != " ":
+    if not game.is_free(idx):
         return
 
-    game["board"][idx] = symbol
-    # обновляем время последнего хода и сбрасываем таймер
-    game["last_move_time"] = time.time()
+    game = game.copy()
+    result = game.place(idx, symbol)
+    # обновляем время последнего хода
+    game.last_move_time = time.time()
+    if not result:
+        game.turn = "O" if symbol == "X" else "X"
+    bot_idx = None
+    if game.bot and not result:
+        # ответ бота уходит в стор той же записью, таймер на его ход не нужен
+        bot_idx = (move_table or load_move_table()).choose(game.x_bits, game.o_bits, game.bot)
+        result = game.place(bot_idx, 'O')
+        if not result:
+            game.turn = 'X'
+    # двойной клик или ход в другом процессе: записывает только первый
+    version = await game_store.cas(GAMES, game_id, version, game)
+    if version is None:
+        return
+    game_log.record(game_id, 'move', idx=idx, symbol=symbol)
+    if bot_idx is not None:
+        game_log.record(game_id, 'move', idx=bot_idx, symbol='O')
     cancel_game_timer(game_id)
 
-    result = check_winner(game["board"])
 
-    def _render_result_text_for_end(game_id, result, price, winner_id=None, loser_id=None):
-        if result == 'draw':
-            return (
+    if result:
+        if not await end_game(game, version, result):
+            return
+        if game.bot:
+            await show_game(game, await finish_bot_game(game, result))
+            return
+        price = game.price
+        if result == "draw":
+            if not await pay_draw(game):
+                return
+            text = (
                 f"<b>🎮 Игра #{game_id}</b>\n\n"
                 f"🤝 Ничья\n"
                 f"💰 Ставки возвращены: <b>{price}</b> коинов каждому"
             )
         else:
-            return (
-                f"<b>🎮 Игра #{game_id}</b>\n\n"
-                f"🏆 Победил <b>{users[winner_id].get('name') or users[winner_id]['username']}</b>\n"
-                f"💰 Выигрыш: <b>{price*2}</b> коинов"
-            )
-
-    if result:
-        cancel_game_timer(game_id)
-        price = game.get('price', DEFAULT_GAME_PRICE)
-        if result == "draw":
-            users[game['x']]['coins'] += price
-            users[game['o']]['coins'] += price
-            users[game['x']]['draws'] = users[game['x']].get('draws', 0) + 1
-            users[game['o']]['draws'] = users[game['o']].get('draws', 0) + 1
-            ra = users[game['x']].get('rating', 1200)
-            rb = users[game['o']].get('rating', 1200)
-            ea = 1 / (1 + 10 ** ((rb - ra) / 400))
-            eb = 1 / (1 + 10 ** ((ra - rb) / 400))
-            k = 24
-            dra = int(round(k * (0.5 - ea)))
-            drb = int(round(k * (0.5 - eb)))
-            users[game['x']]['rating'] = users[game['x']].get('rating', 1200) + dra
-            users[game['o']]['rating'] = users[game['o']].get('rating', 1200) + drb
-
-            save_user(users[game['x']])
-            save_user(users[game['o']])
-
-            text = _render_result_text_for_end(game_id, result, price)
-        else:
-            winner_id = game["x"] if result == "X" else game["o"]
-            loser_id = game['o'] if winner_id == game['x'] else game['x']
-            users[winner_id]["coins"] += price * 2
-            # обновляем статистику
-            users[winner_id]['wins'] = users[winner_id].get('wins', 0) + 1
-            users[loser_id]['losses'] = users[loser_id].get('losses', 0) + 1
-
-            # ELO change
-            ra = users[winner_id].get('rating', 1200)
-            rb = users[loser_id].get('rating', 1200)
-            delta = elo_delta(ra, rb, k=32)
-            users[winner_id]['rating'] = ra + delta
-            users[loser_id]['rating'] = rb - delta
-
-            save_user(users[winner_id])
-            save_user(users[loser_id])
-
+            winner_id = game.x if result == "X" else game.o
+            loser_id = game.o if winner_id == game.x else game.x
+            paid = await pay_win(game, winner_id, loser_id)
+            if not paid:
+                return
+            winner, loser, delta = paid
             text = (
                 f"<b>🎮 Игра #{game_id}</b>\n\n"
-                f"🏆 Победил <b>{users[winner_id].get('name') or users[winner_id]['username']}</b> (+{delta} рейтинга)\n"
+                f"🏆 Победил <b>{display_name(winner)}</b> (+{delta} рейтинга)\n"
                 f"💰 Выигрыш: <b>{price*2}</b> коинов\n\n"
-                f"{users[winner_id].get('name') or users[winner_id]['username']} — {users[winner_id]['rating']} ({get_rank_name(users[winner_id]['rating'])})\n"
-                f"{users[loser_id].get('name') or users[loser_id]['username']} — {users[loser_id]['rating']} ({get_rank_name(users[loser_id]['rating'])})"
+                f"{display_name(winner)} — {winner['rating']} ({get_rank_name(winner['rating'])})\n"
+                f"{display_name(loser)} — {loser['rating']} ({get_rank_name(loser['rating'])})"
             )
 
-        # edit where the game message lives
-        if game.get('type') == 'chat' and game.get('chat_id') and game.get('message_id'):
-            try:
-                await safe_edit_message_text(text, chat_id=game['chat_id'], message_id=game['message_id'], parse_mode=types.ParseMode.HTML)
-            except Exception:
-                pass
-        else:
-            try:
-                await safe_edit_message_text(inline_message_id=call.inline_message_id, text=text, parse_mode=types.ParseMode.HTML)
-            except Exception:
-                pass
+        await show_game(game, text)
+        return
+
+    # продолжаем игру — ход уже переключён, запускаем новый таймер
+    arm_game_timer(game)
+    await show_game(game, await board_text(game), kb_board(game, idx))
+
 
-        # удаляем игру и завершаем таймер
-        games.pop(game_id, None)
+@router.route("view:{game_id}:{top:int}:{left:int}")
+async def view_board(call: types.CallbackQuery, game_id, top, left):
+    # стрелки под большим полем: двигаем окно только в этом сообщении, игра не меняется
+    game, _ = await game_store.get(GAMES, game_id)
+    if not game or not game.started:
+        await call.answer("Игра недоступна")
         return
+    if call.from_user.id not in (game.x, game.o):
+        await call.answer("Вы не игрок", show_alert=True)
+        return
+    last = max(game.size - board_keyboards.span, 0)
+    top, left = min(max(top, 0), last), min(max(left, 0), last)
+    kb = board_keyboards.get(game.id, game.x_bits, game.o_bits, game.size, top, left)
+    if call.inline_message_id:
+        target = {'inline_message_id': call.inline_message_id}
+    else:
+        target = {'chat_id': call.message.chat.id, 'message_id': call.message.message_id}
+    await call.answer()
+    await safe_edit_message_text(await board_text(game), reply_markup=kb, parse_mode=types.ParseMode.HTML, **target)
 
-    # продолжаем игру — переключаем ход и запускаем новый таймер
-    game["turn"] = "O" if symbol == "X" else "X"
-    game['timer_task'] = asyncio.create_task(move_timer(game_id, call.inline_message_id))
+def kb_match_menu():
+    kb = InlineKeyboardMarkup(row_width=2)
+    kb.add(*[InlineKeyboardButton(f"{stake} 💰", callback_data=f"mm:find:{stake}") for stake in MATCH_STAKES])
+    kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
+    return kb
 
-    # update board display in the chat where the game message exists
-    text = (
-        f"<b>🎮 Игра #{game_id}</b>\n\n"
-        f"❌ X: <b>{users[game['x']].get('name') or users[game['x']]['username']}</b>\n"
-        f"⭕ O: <b>{users[game['o']].get('name') or users[game['o']]['username']}</b>\n\n"
-        f"<b>Ход:</b> {'❌' if game['turn']=='X' else '⭕'}"
+
+MATCH_MENU_KB = kb_match_menu()
+MATCH_CANCEL_KB = InlineKeyboardMarkup().add(InlineKeyboardButton("✖️ Отменить поиск", callback_data="mm:cancel"))
+
+
+@router.route("mm:menu")
+async def match_menu(call: types.CallbackQuery):
+    text = "<b>🎯 Подбор соперника</b>\n\nВыберите ставку — найдём игрока с близким рейтингом и той же ставкой."
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=MATCH_MENU_KB, parse_mode=types.ParseMode.HTML)
+
+
+@router.route("mm:find:{stake:int}")
+async def match_find(call: types.CallbackQuery, stake):
+    await reg_user(call.from_user)
+    user = users[call.from_user.id]
+    if stake not in MATCH_STAKES:
+        await call.answer("Нет такой ставки", show_alert=True)
+        return
+    if user['coins'] < stake:
+        await call.answer("Недостаточно коинов", show_alert=True)
+        return
+    if await seated_game(user['id']) is not None:
+        await call.answer("Сначала доиграйте текущую партию", show_alert=True)
+        return
+    # data билета — сообщение, в котором игроку потом покажем доску
+    target = [call.message.chat.id, call.message.message_id]
+    ticket, pair = match_queue.enqueue(user['id'], user.get('rating', 1200), stake, time.time(), target)
+    await call.answer()
+    await safe_edit_message_text(
+        f"<b>🔎 Ищем соперника…</b>\n\nСтавка: <b>{stake}</b> коинов, ваш рейтинг: <b>{ticket.rating}</b>",
+        chat_id=target[0], message_id=target[1], reply_markup=MATCH_CANCEL_KB, parse_mode=types.ParseMode.HTML
     )
-    kb = kb_board(game_id)
-    if game.get('type') == 'chat' and game.get('chat_id') and game.get('message_id'):
-        try:
-            await bot.edit_message_text(text, chat_id=game['chat_id'], message_id=game['message_id'], reply_markup=kb, parse_mode=types.ParseMode.HTML)
-        except Exception:
-            pass
+    if pair is not None:
+        await start_match(*pair)
+
+
+@router.route("mm:cancel")
+async def match_cancel(call: types.CallbackQuery):
+    if match_queue.cancel(call.from_user.id) is None:
+        await call.answer("Поиск уже завершён")
+        return
+    await call.answer("Поиск отменён")
+    await match_menu(call)
+
+
+async def start_match(a, b):
+    # a и b — билеты из очереди, a ждал дольше и ходит первым. Игра идёт через
+    # то же лобби и эскроу, что и join, только сообщений у неё два
+    game_id = str(uuid.uuid4())[:8]
+    game = Game(game_id, a.user_id, a.stake, MOVE_TIMEOUT, type='match', created_at=time.time())
+    game.messages = [a.data, b.data]
+    version = await game_store.put(GAMES, game_id, game, ttl=LOBBY_TTL)
+    game_log.record(game_id, 'create', x=game.x, price=game.price, type=game.type, messages=game.messages, timeout=game.timeout)
+    try:
+        started = await start_game(game, version, b.user_id)
+    except storage.InsufficientFunds as e:
+        started, broke = None, e.user_id
+    else:
+        broke = None
+    if started is not None:
+        return
+    lobby, version = await game_store.get(GAMES, game_id)
+    if lobby is not None:
+        await end_game(lobby, version, 'expired')
+    # кому хватает коинов — обратно в очередь со своим местом в ней
+    for t in (a, b):
+        if broke is None or t.user_id == broke:
+            text = "❌ <b>Недостаточно коинов</b> для этой ставки" if broke else "⚠️ Не удалось начать игру, попробуйте ещё раз"
+            await safe_edit_message_text(text, chat_id=t.data[0], message_id=t.data[1], reply_markup=MATCH_MENU_KB, parse_mode=types.ParseMode.HTML)
+            continue
+        ticket, pair = match_queue.enqueue(t.user_id, t.rating, t.stake, t.since, t.data)
+        if pair is not None:
+            await start_match(*pair)
+
+
+move_table = None
+
+
+def load_move_table():
+    # упакованная таблица из BOT_TABLE_PATH; нет файла — считаем (десятки мс) и сохраняем
+    global move_table
+    if BOT_TABLE_PATH and os.path.exists(BOT_TABLE_PATH):
+        move_table = MoveTable.load(BOT_TABLE_PATH)
     else:
+        move_table = MoveTable.build()
+        if BOT_TABLE_PATH:
+            move_table.save(BOT_TABLE_PATH)
+    return move_table
+
+
+def kb_bot_menu():
+    kb = InlineKeyboardMarkup()
+    for level, (label, _) in BOT_LEVELS.items():
+        kb.add(InlineKeyboardButton(label, callback_data=f"bot:start:{level}"))
+    kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
+    return kb
+
+
+BOT_MENU_KB = kb_bot_menu()
+BOT_RESULTS = {'X': "🏆 Вы победили бота", 'O': "🤖 Бот победил", 'draw': "🤝 Ничья"}
+
+
+@router.route("bot:menu")
+async def bot_menu(call: types.CallbackQuery):
+    text = (
+        "<b>🤖 Игра с ботом</b>\n\n"
+        "Выберите сложность. Ставок нет, вы играете за ❌.\n"
+        + ("Рейтинг считается против рейтинга бота." if BOT_RATED else "Рейтинг не меняется.")
+    )
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=BOT_MENU_KB, parse_mode=types.ParseMode.HTML)
+
+
+@router.route("bot:start:{level}")
+async def bot_start(call: types.CallbackQuery, level):
+    await reg_user(call.from_user)
+    if level not in BOT_LEVELS:
+        await call.answer("Нет такого уровня", show_alert=True)
+        return
+    game_id = str(uuid.uuid4())[:8]
+    game = Game(game_id, call.from_user.id, 0, MOVE_TIMEOUT, type='bot', created_at=time.time())
+    game.o = BOT_ID
+    game.bot = level
+    game.started = True
+    game.started_at = game.last_move_time = game.created_at
+    game.messages = [[call.message.chat.id, call.message.message_id]]
+    await game_store.put(GAMES, game_id, game)
+    game_log.record(game_id, 'create', x=game.x, price=0, type=game.type, messages=game.messages, timeout=game.timeout, bot=level)
+    game_log.record(game_id, 'join', o=BOT_ID)
+    await seat_players(game)
+    # таймер только на ходы человека: бот отвечает сразу в move
+    arm_game_timer(game)
+    await call.answer()
+    await show_game(game, await board_text(game), kb_board(game))
+
+
+async def finish_bot_game(game, result, note=None):
+    # без ставок и без побед/поражений в профиле; рейтинг — только если BOT_RATED
+    user = await get_user(game.x)
+    label, bot_rating = BOT_LEVELS[game.bot]
+    lines = [f"<b>🎮 Игра #{game.id}</b> — 🤖 {label}", ""]
+    if note:
+        lines.append(note)
+    lines.append(BOT_RESULTS[result])
+    if BOT_RATED:
+        ra = user.get('rating', 1200)
+        if result == 'draw':
+            delta = draw_deltas(ra, bot_rating)[0]
+        elif result == 'X':
+            delta = elo_delta(ra, bot_rating)
+        else:
+            delta = -elo_delta(bot_rating, ra)
+        record_result(user, rating=delta)
+        lines.append(f"📊 Рейтинг: <b>{user['rating']}</b> ({delta:+d}) — {get_rank_name(user['rating'])}")
+    return '\n'.join(lines)
+
+
+async def matchmaker():
+    # допуски ждущих расширяются по времени — раз в MATCH_TICK забираем тех,
+    # у кого они сменились, и тех, кто ждёт слишком долго
+    while True:
+        await asyncio.sleep(MATCH_TICK)
         try:
-            await bot.edit_message_text(inline_message_id=call.inline_message_id, text=text, reply_markup=kb_board(game_id), parse_mode=types.ParseMode.HTML)
+            pairs, expired = match_queue.match(time.time())
+            for a, b in pairs:
+                await start_match(a, b)
+            for t in expired:
+                await safe_edit_message_text(
+                    "😔 <b>Соперник не найден</b>\n\nПопробуйте другую ставку или позже.",
+                    chat_id=t.data[0], message_id=t.data[1], reply_markup=MATCH_MENU_KB, parse_mode=types.ParseMode.HTML
+                )
         except Exception:
-            pass
+            log.exception('matchmaker failed')
+
 
-@dp.callback_query_handler(lambda c: c.data and c.data == "show:ranks")
+@router.route("show:ranks")
 async def show_ranks(call: types.CallbackQuery):
     text = (
         "❝ <b>Рейтинговая система (ELO / Rank)</b> ❞\n\n"
@@ -613,16 +999,13 @@ async def show_ranks(call: types.CallbackQuery):
     )
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
-    try:
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-    except Exception:
-        await call.answer()
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data == "show:profile")
+@router.route("show:profile")
 async def show_profile(call: types.CallbackQuery):
-    reg_user(call.from_user)
-    u = load_user(call.from_user.id)
+    await reg_user(call.from_user)
+    u = await get_user(call.from_user.id)
     if not u:
         await call.answer("Пользователь не найден", show_alert=True)
         return
@@ -634,16 +1017,112 @@ async def show_profile(call: types.CallbackQuery):
         f"{format_user_info(u)}\n"
     )
     kb = InlineKeyboardMarkup()
+    kb.add(InlineKeyboardButton("📜 История партий", callback_data="hist:list"))
     kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
-    try:
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-    except Exception:
-        await call.answer()
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
+
+
+def history_button_text(rec, user_id):
+    moves = history.unpack_moves(rec['moves'], rec['size'])
+    win = history.winner(history.RESULTS[rec['result']], moves)
+    me = 'X' if rec['x'] == user_id else 'O'
+    icon = '🤝' if win is None else '🏆' if win == me else '❌'
+    if rec['opponent'] == BOT_ID:
+        opponent = "🤖 Бот"
+    else:
+        opponent = rec['opponent_name'] or f"@{rec['opponent_username'] or rec['opponent']}"
+    when = time.strftime('%d.%m %H:%M', time.localtime(rec['started']))
+    board = '' if rec['size'] == 3 else f" · {rec['size']}×{rec['size']}"
+    stake = f" · {rec['price']} 💰" if rec['price'] else ''
+    return f"{icon} {when} — {opponent}{board}{stake}"
+
+
+async def history_page(user_id, cursor=None, backward=False):
+    # keyset по id партии, как список пользователей в админке
+    rows, more = await db.read(storage.user_history, user_id, cursor, backward, HISTORY_PAGE_SIZE)
+    has_newer = more if backward else cursor is not None
+    has_older = more if not backward else cursor is not None
+    kb = InlineKeyboardMarkup()
+    for rec in rows:
+        kb.add(InlineKeyboardButton(history_button_text(rec, user_id), callback_data=f"hist:game:{rec['id']}:-1"))
+    nav = []
+    if rows and has_newer:
+        nav.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"hist:p:{rows[0]['id']}"))
+    if rows and has_older:
+        nav.append(InlineKeyboardButton("Старее ➡️", callback_data=f"hist:n:{rows[-1]['id']}"))
+    if nav:
+        kb.row(*nav)
+    kb.add(InlineKeyboardButton("◀️ Назад", callback_data="show:profile"))
+    if not rows:
+        return "<b>📜 История партий</b>\n\nСыгранных партий пока нет", kb
+    return "<b>📜 История партий</b>\nНажмите на партию, чтобы пересмотреть её по ходам", kb
+
+
+@dp.message_handler(commands=['history'])
+async def cmd_history(message: types.Message):
+    await reg_user(message.from_user)
+    text, kb = await history_page(message.from_user.id)
+    await message.reply(text, reply_markup=kb)
+
+
+@router.route("hist:list")
+async def history_list(call: types.CallbackQuery):
+    text, kb = await history_page(call.from_user.id)
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
+
+
+@router.route("hist:n:{cursor:int}")
+async def history_older(call: types.CallbackQuery, cursor):
+    text, kb = await history_page(call.from_user.id, cursor)
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
+
+
+@router.route("hist:p:{cursor:int}")
+async def history_newer(call: types.CallbackQuery, cursor):
+    text, kb = await history_page(call.from_user.id, cursor, backward=True)
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
+
+
+@router.route("hist:game:{history_id:int}:{step:int}")
+async def history_replay(call: types.CallbackQuery, history_id, step):
+    rec = await db.read(storage.get_history, history_id)
+    if rec is None or call.from_user.id not in (rec['x'], rec['o'], config.ADMIN_ID):
+        await call.answer("Партия не найдена", show_alert=True)
+        return
+    total = len(history.unpack_moves(rec['moves'], rec['size']))
+    # -1 — конечная позиция: из списка партий число ходов ещё не известно
+    step = total if step < 0 else min(step, total)
+    game = history.replay(rec, step)
+    names = []
+    for uid in (rec['x'], rec['o']):
+        u = await get_user(uid) if uid != BOT_ID else None
+        names.append("🤖 Бот" if uid == BOT_ID else html.escape(u and (u.get('name') or u['username']) or str(uid)))
+    text = (
+        f"<b>📜 Партия #{game.id}</b> — {board_label(rec['size'], rec['k'])}\n"
+        f"❌ {names[0]}  ⭕ {names[1]}\n"
+        f"Ход {step} из {total}\n\n"
+        f"<pre>{grid_text(game)}</pre>"
+    )
+    if step == total:
+        result = history.RESULTS[rec['result']]
+        win = history.winner(result, game.moves)
+        outcome = "🤝 Ничья" if win is None else f"🏆 Победил {names[0] if win == 'X' else names[1]}"
+        text += f"\n{outcome}" + (" (таймаут)" if result == 'timeout' else '')
+    base = f"hist:game:{history_id}"
+    steps = (("⏮", 0), ("◀️", step - 1), ("▶️", step + 1), ("⏭", total))
+    kb = InlineKeyboardMarkup()
+    kb.row(*[
+        InlineKeyboardButton(label, callback_data=f"{base}:{target}")
+        for label, target in steps if 0 <= target <= total and target != step
+    ])
+    kb.add(InlineKeyboardButton("◀️ К списку", callback_data="hist:list"))
+    await call.answer()
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
 
 
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message):
-    reg_user(message.from_user)
+    await reg_user(message.from_user)
     user = users[message.from_user.id]
 
     text = (
@@ -654,6 +1133,8 @@ async def cmd_start(message: types.Message):
 
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("▶️ Создать игру (инлайн)", switch_inline_query=""))
+    kb.add(InlineKeyboardButton("🎯 Найти соперника", callback_data="mm:menu"))
+    kb.add(InlineKeyboardButton("🤖 Играть с ботом", callback_data="bot:menu"))
     kb.add(InlineKeyboardButton("👤 Профиль", callback_data="show:profile"))
     kb.add(InlineKeyboardButton("📊 Ранги", callback_data="show:ranks"))
     kb.add(InlineKeyboardButton("🏆 Топ игроков", callback_data="show:top"))
@@ -671,19 +1152,14 @@ def _compute_winrate(u):
     return u.get('wins',0) / games
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("show:top"))
-async def show_top(call: types.CallbackQuery):
-    ids = get_all_user_ids()
-    users_list = [load_user(uid) for uid in ids if load_user(uid)]
-    if not users_list:
-        await call.answer("Нет игроков", show_alert=True)
-        return
-    sorted_by_wins = sorted(users_list, key=lambda u: u.get('wins',0), reverse=True)
-    text = "<b>🏆 Топ игроков (по победам)</b>\n\n"
-    for i, u in enumerate(sorted_by_wins[:10], 1):
-        display = u.get('name') or ('@' + u.get('username','?'))
-        text += f"{i}. {display} — {u.get('wins',0)} побед — {u.get('rating',1200)} ({get_rank_name(u.get('rating',1200))})\n"
+TOP_HEADERS = {
+    'wins': "<b>🏆 Топ по победам</b>",
+    'coins': "<b>💰 Топ по коинам</b>",
+    'rating': "<b>🏆 Топ по рейтингу</b>",
+}
 
+
+def kb_top():
     kb = InlineKeyboardMarkup(row_width=3)
     kb.add(
         InlineKeyboardButton("По победам", callback_data="top:wins"),
@@ -691,46 +1167,66 @@ async def show_top(call: types.CallbackQuery):
         InlineKeyboardButton("По рейтингу", callback_data="top:rating")
     )
     kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
-    await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-
-
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("top:"))
-async def top_callback(call: types.CallbackQuery):
-    _, mode = call.data.split(":", 1)
-    ids = get_all_user_ids()
-    users_list = [load_user(uid) for uid in ids if load_user(uid)]
-    if mode == 'wins':
-        users_sorted = sorted(users_list, key=lambda u: u.get('wins',0), reverse=True)
-        header = "<b>🏆 Топ по победам</b>"
-    elif mode == 'coins':
-        users_sorted = sorted(users_list, key=lambda u: u.get('coins',0), reverse=True)
-        header = "<b>💰 Топ по коинам</b>"
-    elif mode == 'rating':
-        users_sorted = sorted(users_list, key=lambda u: u.get('rating',1200), reverse=True)
-        header = "<b>🏆 Топ по рейтингу</b>"
-    else:
-        await call.answer("Неподдерживаемый режим", show_alert=True)
+    return kb
+
+
+TOP_KB = kb_top()
+
+
+def _top_display(row):
+    _, name, username, _, _, _ = row
+    return name or ('@' + (username or '?'))
+
+
+def render_top_summary(rows):
+    text = "<b>🏆 Топ игроков (по победам)</b>\n\n"
+    for i, row in enumerate(rows, 1):
+        wins, rating = row[3], row[5]
+        text += f"{i}. {_top_display(row)} — {wins} побед — {rating} ({get_rank_name(rating)})\n"
+    return text
+
+
+def render_top(mode):
+    def build(rows):
+        text = TOP_HEADERS[mode] + "\n\n"
+        for i, row in enumerate(rows, 1):
+            _, _, _, wins, coins, rating = row
+            text += f"{i}. {_top_display(row)} — {wins} побед, {coins} 💰, рейтинг: {rating} ({get_rank_name(rating)})\n"
+        return text
+    return boards[mode].render('full', build)
+
+
+async def get_board(mode):
+    board = boards[mode]
+    if board.needs_reseed:
+        await seed_board(mode)
+    return board
+
+
+@router.route("show:top")
+async def show_top(call: types.CallbackQuery):
+    board = await get_board('wins')
+    if not len(board):
+        await call.answer("Нет игроков", show_alert=True)
         return
+    text = board.render('summary', render_top_summary)
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=TOP_KB, parse_mode=types.ParseMode.HTML)
 
-    text = header + "\n\n"
-    for i, u in enumerate(users_sorted[:10], 1):
-        display = u.get('name') or ('@' + u.get('username','?'))
-        text += f"{i}. {display} — {u.get('wins',0)} побед, {u.get('coins',0)} 💰, рейтинг: {u.get('rating',1200)} ({get_rank_name(u.get('rating',1200))})\n"
 
-    kb = InlineKeyboardMarkup(row_width=3)
-    kb.add(
-        InlineKeyboardButton("По победам", callback_data="top:wins"),
-        InlineKeyboardButton("По коинам", callback_data="top:coins"),
-        InlineKeyboardButton("По рейтингу", callback_data="top:rating")
-    )
-    kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
-    await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
+@router.route("top:{mode}")
+async def top_callback(call: types.CallbackQuery, mode):
+    if mode not in TOP_HEADERS:
+        await call.answer("Неподдерживаемый режим", show_alert=True)
+        return
+    await get_board(mode)
+    text = render_top(mode)
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=TOP_KB, parse_mode=types.ParseMode.HTML)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'back:start')
+@router.route('back:start')
 async def back_to_start(call: types.CallbackQuery):
     # Восстанавливаем основное меню
-    reg_user(call.from_user)
+    await reg_user(call.from_user)
     user = users[call.from_user.id]
     text = (
         f"<b>🎮 Крестики-Нолики</b>\n\n"
@@ -740,166 +1236,118 @@ async def back_to_start(call: types.CallbackQuery):
 
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("▶️ Создать игру (инлайн)", switch_inline_query=""))
+    kb.add(InlineKeyboardButton("🎯 Найти соперника", callback_data="mm:menu"))
+    kb.add(InlineKeyboardButton("🤖 Играть с ботом", callback_data="bot:menu"))
     kb.add(InlineKeyboardButton("👤 Профиль", callback_data="show:profile"))
     kb.add(InlineKeyboardButton("📊 Ранги", callback_data="show:ranks"))
     kb.add(InlineKeyboardButton("🏆 Топ игроков", callback_data="show:top"))
     if call.from_user.id == config.ADMIN_ID:
         kb.add(InlineKeyboardButton("🔧 Админ панель", callback_data="admin:menu"))
 
-    try:
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-    except Exception:
-        await call.answer()
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'show:shop')
+@router.route('show:shop')
 async def show_shop(call: types.CallbackQuery):
-    # show categories
-    text = "<b>🛍️ Магазин — трать коины, прокачай стиль!</b>\n\nВыбирай категорию: символы, фоны, эмодзи или анимации. Всё четко, красиво и ахуенно."
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(
-        InlineKeyboardButton("Символы", callback_data="shop:cat:symbol"),
-        InlineKeyboardButton("Фоны", callback_data="shop:cat:background"),
-        InlineKeyboardButton("Эмодзи", callback_data="shop:cat:emoji_pack"),
-        InlineKeyboardButton("Анимации", callback_data="shop:cat:animation")
-    )
-    kb.add(InlineKeyboardButton("◀️ Назад", callback_data="back:start"))
-    try:
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-    except Exception:
-        await call.answer()
+    text, kb = catalog.shop_page
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith('shop:cat:'))
-async def shop_category(call: types.CallbackQuery):
-    _, _, cat = call.data.split(':', 2)
-    items = items_by_category(cat)
-    if not items:
+@router.route('shop:cat:{cat}')
+async def shop_category(call: types.CallbackQuery, cat):
+    page = catalog.category_pages.get(cat)
+    if page is None:
         await call.answer("Нет предметов в этой категории", show_alert=True)
         return
-    text = f"<b>🛍️ Магазин — {cat.title()}</b>\n\n"
-    kb = InlineKeyboardMarkup()
-    for it in items:
-        text += f"{it['name']} — {it['price']} 💰\n{it.get('desc','')}\n\n"
-        kb.add(InlineKeyboardButton(f"Просмотр: {it['name']}", callback_data=f"shop:item:{it['id']}"))
-    kb.add(InlineKeyboardButton("◀️ Назад", callback_data="show:shop"))
-    try:
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-    except Exception:
-        await call.answer()
+    text, kb = page
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith('shop:item:'))
-async def shop_item(call: types.CallbackQuery):
-    _, _, item_id = call.data.split(':', 2)
+@router.route('shop:item:{item_id}')
+async def shop_item(call: types.CallbackQuery, item_id):
     it = find_item(item_id)
     if not it:
         await call.answer("Предмет не найден", show_alert=True)
         return
-    user = load_user(call.from_user.id)
-    owned = owns_item(call.from_user.id, item_id)
-    equipped = False
-    eq_field = ''
-    if it['category'] == 'symbol':
-        current = user.get('equipped_symbol','')
-        eq_field = 'equipped_symbol'
-    elif it['category'] == 'background':
-        current = user.get('equipped_bg','')
-        eq_field = 'equipped_bg'
-    elif it['category'] == 'emoji_pack':
-        current = user.get('equipped_emoji_pack','')
-        eq_field = 'equipped_emoji_pack'
-    elif it['category'] == 'animation':
-        current = user.get('equipped_animation','')
-        eq_field = 'equipped_animation'
+    user = await get_user(call.from_user.id)
+    # от пользователя зависит только кнопка: купить / надеть / снять
+    if not await owns_item(user, item_id):
+        state = BUY
+    elif user.get(EQUIP_FIELDS[it['category']], '') == item_id:
+        state = UNEQUIP
     else:
-        current = ''
-    if current == item_id:
-        equipped = True
-
-    text = f"<b>{it['name']}</b> — {it['price']} 💰\n\n{it.get('desc','')}\n\nПревью: {it.get('preview','')}."
-    kb = InlineKeyboardMarkup(row_width=2)
-    if not owned:
-        kb.add(InlineKeyboardButton(f"Купить — {it['price']} 💰", callback_data=f"shop:buy:{item_id}"))
-    else:
-        if equipped:
-            kb.add(InlineKeyboardButton(f"Снять", callback_data=f"shop:unequip:{item_id}"))
-        else:
-            kb.add(InlineKeyboardButton(f"Надеть", callback_data=f"shop:equip:{item_id}"))
-    kb.add(InlineKeyboardButton("◀️ Назад", callback_data=f"shop:cat:{it['category']}"))
-    try:
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
-    except Exception:
-        await call.answer()
+        state = EQUIP
+    text, kb = catalog.item_page(item_id, state)
+    await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb, parse_mode=types.ParseMode.HTML)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith('shop:buy:'))
-async def shop_buy(call: types.CallbackQuery):
-    _, _, item_id = call.data.split(':', 2)
+@router.route('shop:buy:{item_id}')
+async def shop_buy(call: types.CallbackQuery, item_id):
     it = find_item(item_id)
     if not it:
         await call.answer("Предмет не найден", show_alert=True)
         return
-    u = load_user(call.from_user.id)
+    u = await get_user(call.from_user.id)
+    # маска грузится до покупки, чтобы mark_owned ниже было куда ставить бит
+    if await owns_item(u, item_id):
+        await call.answer("Уже куплено", show_alert=True)
+        await shop_item(call, item_id)
+        return
     if u['coins'] < it['price']:
         await call.answer("Недостаточно коинов", show_alert=True)
         return
-    # charge and grant
-    u['coins'] -= it['price']
-    save_user(u)
-    grant_item(call.from_user.id, item_id)
+    # charge and grant: одна транзакция, списание с проверкой баланса в БД
+    await settle_credits([u['id']])
+    try:
+        coins = await db.write(storage.buy_item, u['id'], item_id, it['price'])
+    except storage.InsufficientFunds:
+        await call.answer("Недостаточно коинов", show_alert=True)
+        return
+    mark_owned(u, item_id)
+    if coins is None:
+        # гонка двух нажатий: второе увидело покупку уже в БД
+        await call.answer("Уже куплено", show_alert=True)
+        await shop_item(call, item_id)
+        return
+    await sync_coins({u['id']: coins})
     await call.answer(f"Куплено: {it['name']} — {it['price']} 💰", show_alert=True)
     # refresh item view
-    await shop_item(call)
+    await shop_item(call, item_id)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith('shop:equip:'))
-async def shop_equip(call: types.CallbackQuery):
-    _, _, item_id = call.data.split(':', 2)
+@router.route('shop:equip:{item_id}')
+async def shop_equip(call: types.CallbackQuery, item_id):
     it = find_item(item_id)
     if not it:
         await call.answer("Предмет не найден", show_alert=True)
         return
-    if not owns_item(call.from_user.id, item_id):
+    u = await get_user(call.from_user.id)
+    if not await owns_item(u, item_id):
         await call.answer("Сначала купите предмет", show_alert=True)
         return
-    u = load_user(call.from_user.id)
-    # set equipped field
-    if it['category'] == 'symbol':
-        u['equipped_symbol'] = item_id
-    elif it['category'] == 'background':
-        u['equipped_bg'] = item_id
-    elif it['category'] == 'emoji_pack':
-        u['equipped_emoji_pack'] = item_id
-    elif it['category'] == 'animation':
-        u['equipped_animation'] = item_id
-    save_user(u)
+    field = EQUIP_FIELDS[it['category']]
+    u[field] = item_id
+    # экипировка не про деньги — уходит пачкой через write-behind, только своё поле
+    user_writes.equip(u['id'], field, item_id)
     await call.answer(f"Экипировано: {it['name']}", show_alert=True)
-    await shop_item(call)
+    await shop_item(call, item_id)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith('shop:unequip:'))
-async def shop_unequip(call: types.CallbackQuery):
-    _, _, item_id = call.data.split(':', 2)
+@router.route('shop:unequip:{item_id}')
+async def shop_unequip(call: types.CallbackQuery, item_id):
     it = find_item(item_id)
     if not it:
         await call.answer("Предмет не найден", show_alert=True)
         return
-    u = load_user(call.from_user.id)
-    if it['category'] == 'symbol' and u.get('equipped_symbol','') == item_id:
-        u['equipped_symbol'] = ''
-    elif it['category'] == 'background' and u.get('equipped_bg','') == item_id:
-        u['equipped_bg'] = ''
-    elif it['category'] == 'emoji_pack' and u.get('equipped_emoji_pack','') == item_id:
-        u['equipped_emoji_pack'] = ''
-    elif it['category'] == 'animation' and u.get('equipped_animation','') == item_id:
-        u['equipped_animation'] = ''
-    else:
+    u = await get_user(call.from_user.id)
+    field = EQUIP_FIELDS[it['category']]
+    if u.get(field, '') != item_id:
         await call.answer("Предмет не экипирован", show_alert=True)
         return
-    save_user(u)
+    u[field] = ''
+    user_writes.equip(u['id'], field, '')
     await call.answer(f"Снято: {it['name']}", show_alert=True)
-    await shop_item(call)
+    await shop_item(call, item_id)
     # Вернуться в главное меню
     await back_to_start(call)
 
@@ -912,12 +1360,233 @@ async def cmd_admin(message: types.Message):
     await show_admin_menu(message)
 
 
+@dp.message_handler(commands=['find'])
+async def cmd_find(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        await message.reply("❌ Доступ запрещен.")
+        return
+    # ники в Telegram — только [A-Za-z0-9_], так что запрос безопасно кладётся в callback_data
+    query = re.sub(r'[^A-Za-z0-9_]', '', message.get_args().lstrip('@'))[:ADMIN_QUERY_MAX].lower()
+    if not query:
+        await message.reply("Использование: <code>/find ник</code> или <code>/find начало_id</code>")
+        return
+    text, kb = await admin_users_page('name', query=query)
+    await message.reply(text, reply_markup=kb)
+
+
+BULK_HELP = (
+    "<b>📦 Массовые операции</b>\n\n"
+    "<code>/grant 500 rating>=1600</code> — начислить всем, кто подходит под условия "
+    "(id, coins, rating, wins, losses, draws; операторы &gt;= &lt;= &gt; &lt; = !=)\n"
+    "<code>/grant -100 coins>10000 dry</code> — только посчитать, ничего не менять\n"
+    "CSV-файл с подписью <code>/import</code> (или <code>/import dry</code>) — строки <code>user_id,delta</code>\n"
+    "<code>/export</code> — выгрузка пользователей в CSV"
+)
+FILTER_RE = re.compile(r'^(\w+)(>=|<=|!=|>|<|=)(-?\d+)$')
+
+
+def parse_filters(args):
+    # "rating>=1600 wins>10" -> [('rating', '>=', 1600), ...]; None, если что-то не разобрано
+    filters = []
+    for arg in args:
+        m = FILTER_RE.match(arg)
+        if not m or m.group(1) not in storage.FILTER_COLUMNS:
+            return None
+        filters.append((m.group(1), m.group(2), int(m.group(3))))
+    return filters
+
+
+def refresh_cached_coins(balances):
+    # после массовой операции правим только тех, кто уже в памяти;
+    # остальные прочитаются из БД при следующем обращении
+    for uid, coins in balances.items():
+        u = users.get(uid) if uid in users else user_writes.pending(uid)
+        if u is not None:
+            u['coins'] = coins + user_writes.pending_credit(uid)
+            update_boards(u)
+
+
+async def bulk_progress(message, text):
+    # прогресс — правкой одного сообщения, outbox склеит частые правки
+    await safe_edit_message_text(text, chat_id=message.chat.id, message_id=message.message_id)
+
+
+@dp.message_handler(commands=['grant'])
+async def cmd_grant(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        await message.reply("❌ Доступ запрещен.")
+        return
+    args = message.get_args().split()
+    dry = 'dry' in args
+    args = [a for a in args if a != 'dry']
+    try:
+        amount = int(args[0])
+    except (IndexError, ValueError):
+        amount = 0
+    filters = parse_filters(args[1:])
+    if not amount or filters is None:
+        await message.reply(BULK_HELP)
+        return
+
+    # отложенные начисления должны быть в БД до того, как считать по балансам
+    await user_writes.flush()
+    count, total = await db.read(storage.grant_preview, amount, filters)
+    condition = html.escape(' '.join(args[1:])) or 'все'
+    if dry or not count:
+        await message.reply(f"🧪 Проверка: {condition}\nИзменится пользователей: <b>{count}</b>, сумма: <b>{total}</b> 💰")
+        return
+
+    ref = f"grant:{int(time.time())}"
+    status = await message.reply(f"⏳ Начисление {amount} 💰 ({condition}): 0/{count}")
+    after, changed, total_done = 0, 0, 0
+    while True:
+        after, balances = await db.write(storage.grant_chunk, amount, filters, after, BULK_CHUNK, 'bulk', ref)
+        if after is None:
+            break
+        refresh_cached_coins(balances)
+        changed += len(balances)
+        await bulk_progress(status, f"⏳ Начисление {amount} 💰 ({condition}): {changed}/{count}")
+    await seed_board('coins')
+    await bulk_progress(status, f"✅ Начислено {amount} 💰 ({condition}): {changed} польз.\nМетка в журнале: <code>{ref}</code>")
+
+
+def read_deltas(path, chunk):
+    # CSV читается построчно, наружу — пачки [(user_id, delta)] и число битых строк
+    bad = 0
+    rows = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line in csv.reader(f):
+            try:
+                rows.append((int(line[0]), int(line[1])))
+            except (IndexError, ValueError):
+                bad += 1  # заголовок тоже сюда
+                continue
+            if len(rows) >= chunk:
+                yield rows, bad
+                rows = []
+    yield rows, bad
+
+
+@dp.message_handler(content_types=types.ContentType.DOCUMENT)
+async def cmd_import(message: types.Message):
+    caption = (message.caption or '').split()
+    if message.from_user.id != config.ADMIN_ID or not caption or caption[0] != '/import':
+        return
+    dry = 'dry' in caption[1:]
+    ref = f"import:{int(time.time())}"
+    status = await message.reply("⏳ Загружаю файл…")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'import.csv')
+        await message.document.download(destination_file=path)
+        await user_writes.flush()
+        rows_done = total = bad = 0
+        missing = []
+        # один id может встретиться в нескольких пачках — считаем людей, не пачки
+        changed = set()
+        coins = {}  # проверка: балансы после уже просмотренных пачек
+        for rows, bad in read_deltas(path, BULK_CHUNK):
+            if rows:
+                if dry:
+                    balances, miss, delta = await db.read(storage.deltas_preview, rows, coins)
+                    total += delta
+                else:
+                    balances, miss = await db.write(storage.apply_deltas, rows, 'bulk', ref)
+                    refresh_cached_coins(balances)
+                changed.update(balances)
+                missing += miss
+                rows_done += len(rows)
+            await bulk_progress(status, f"⏳ {'Проверка' if dry else 'Импорт'}: {rows_done} строк")
+    if not dry:
+        await seed_board('coins')
+    text = (
+        f"{'🧪 Проверка' if dry else '✅ Импорт'}: строк {rows_done}, "
+        f"{'изменится' if dry else 'изменено'} польз. {len(changed)}"
+        + (f", сумма {total} 💰" if dry else f"\nМетка в журнале: <code>{ref}</code>")
+        + (f"\nНет в базе: {len(missing)} ({', '.join(map(str, missing[:10]))}{'…' if len(missing) > 10 else ''})" if missing else "")
+        + (f"\nПропущено строк: {bad}" if bad else "")
+    )
+    await bulk_progress(status, text)
+
+
+@dp.message_handler(commands=['export'])
+async def cmd_export(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        await message.reply("❌ Доступ запрещен.")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'users.csv')
+        await user_writes.flush()
+        n = await db.read(storage.export_users, path)
+        await message.reply_document(types.InputFile(path, filename=f"users-{time.strftime('%Y%m%d')}.csv"), caption=f"Пользователей: {n}")
+
+
+ADMIN_ORDER_LABELS = {'id': '🆔 По id', 'coins': '💰 По коинам', 'rating': '📊 По рейтингу'}
+
+
+async def admin_users_page(order, cursor=None, backward=False, query=None):
+    # одна страница списка: запрос по индексу от курсора, без подсчёта всех строк
+    rows, more = await browse_users(order, cursor, backward, query)
+    # курсоры назад/вперёд — id крайних строк; при обходе назад «ещё» относится к началу
+    has_prev = more if backward else cursor is not None
+    has_next = more if not backward else cursor is not None
+    base = f"admin:find:{query}" if query else f"admin:users:{order}"
+
+    kb = InlineKeyboardMarkup(row_width=1)
+    if not query:
+        kb.row(*[
+            InlineKeyboardButton(("✅ " if o == order else "") + label, callback_data=f"admin:users:{o}")
+            for o, label in ADMIN_ORDER_LABELS.items()
+        ])
+    for u in rows:
+        value = f"{u['rating']} 📊" if order == 'rating' else f"{u['coins']} 💰"
+        kb.add(InlineKeyboardButton(f"@{u['username']} — {value}", callback_data=f"admin:user:{u['id']}"))
+    nav = []
+    if rows and has_prev:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{base}:p:{rows[0]['id']}"))
+    if rows and has_next:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{base}:n:{rows[-1]['id']}"))
+    if nav:
+        kb.row(*nav)
+    kb.row(
+        InlineKeyboardButton("🔎 Поиск", callback_data="admin:search"),
+        InlineKeyboardButton("◀️ Назад", callback_data="admin:menu")
+    )
+
+    if query:
+        title = f"<b>🔎 Поиск: {html.escape(query)}</b>"
+    else:
+        title = "<b>🧾 Список пользователей</b>"
+    if not rows:
+        return title + "\n\nНикого не найдено", kb
+    return title + "\nНажмите на пользователя для управления", kb
+
+
 async def show_admin_menu(source):
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("🧑‍💼 Управление пользователями", callback_data="admin:users"))
+    kb.add(InlineKeyboardButton("📦 Массовые операции", callback_data="admin:bulk"))
+    if CATALOG_PATH:
+        kb.add(InlineKeyboardButton("🛍️ Перечитать каталог", callback_data="admin:catalog"))
+    kb.add(InlineKeyboardButton("🔬 Остановить профайлер" if profiler.running else "🔬 Профайлер", callback_data="admin:profile"))
     kb.add(InlineKeyboardButton("✖️ Закрыть", callback_data="admin:close"))
 
-    text = "<b>🔧 Админ панель</b>\nВыберите действие"
+    st = users.stats()
+    kst = board_keyboards.stats()
+    ost = outbox.stats()
+    hot = sorted(router.stats().items(), key=lambda kv: -kv[1]['calls'])[:3]
+    routes = ', '.join(f"{pattern.split(':')[0]} {r['calls']}× {r['avg_ms']:.1f}/{r['max_ms']:.0f} мс" for pattern, r in hot if r['calls'])
+    text = (
+        "<b>🔧 Админ панель</b>\nВыберите действие\n\n"
+        f"<i>Кэш: {st['size']} польз., попаданий {st['hit_rate']:.0%}, "
+        f"вытеснено {st['evictions']}, истекло {st['expirations']}\n"
+        f"Клавиатуры доски: {kst['size']}, попаданий {kst['hit_rate']:.0%}\n"
+        f"Очередь правок: {ost['depth']}, склеено {ost['coalesced']}, повторов {ost['retries']}, потеряно {ost['failed']}\n"
+        f"Кнопки (ср./макс.): {routes or '—'}\n"
+        f"БД: {html.escape(metrics.REGISTRY.summary('xo_db_seconds', top=3)) or '—'}\n"
+        f"Bot API: {html.escape(metrics.REGISTRY.summary('xo_api_seconds', top=3)) or '—'}</i>"
+    )
+    if profiler.running:
+        text += f"\n\n🔬 Профайлер пишет: {profiler.samples} семплов"
 
     if isinstance(source, types.Message):
         await source.reply(text, reply_markup=kb)
@@ -925,38 +1594,70 @@ async def show_admin_menu(source):
         await safe_edit_message_text(text, chat_id=source.message.chat.id, message_id=source.message.message_id, reply_markup=kb)
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith('admin:'))
-async def admin_callback(call: types.CallbackQuery):
+@router.route('admin:{parts*}')
+async def admin_callback(call: types.CallbackQuery, parts):
     if call.from_user.id != config.ADMIN_ID:
         await call.answer("Доступно только админу", show_alert=True)
         return
 
-    parts = call.data.split(":")
-    action = parts[1]
+    action = parts[0]
 
     if action == 'menu':
         await show_admin_menu(call)
     elif action == 'close':
-        await bot.edit_message_text("<i>Панель закрыта</i>", chat_id=call.message.chat.id, message_id=call.message.message_id)
-    elif action == 'users':
-        # Список пользователей
-        ids = get_all_user_ids()
-        kb = InlineKeyboardMarkup(row_width=1)
-        if not ids:
-            kb.add(InlineKeyboardButton("◀️ Назад", callback_data="admin:menu"))
-            await bot.edit_message_text("<b>Пользователей нет</b>", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
+        await safe_edit_message_text("<i>Панель закрыта</i>", chat_id=call.message.chat.id, message_id=call.message.message_id)
+    elif action == 'profile':
+        if not profiler.running:
+            profiler.start()
+            await call.answer("Профайлер включён")
+            await show_admin_menu(call)
             return
-        for uid in ids:
-            u = load_user(uid)
-            if u:
-                label = f"@{u['username']} — {u['coins']} 💰"
-                kb.add(InlineKeyboardButton(label, callback_data=f"admin:user:{uid}"))
-        kb.add(InlineKeyboardButton("◀️ Назад", callback_data="admin:menu"))
-        await bot.edit_message_text("<b>🧾 Список пользователей</b>\nНажмите на пользователя для управления", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
-
-    elif action == 'user' and len(parts) >= 3:
-        uid = int(parts[2])
-        u = load_user(uid)
+        profiler.stop()
+        # свёрнутые стеки — для flamegraph.pl / speedscope
+        path = os.path.join(os.path.dirname(DB_PATH), f'profile-{int(time.time())}.folded')
+        with open(path, 'w') as f:
+            f.write(profiler.collapsed())
+        kb = InlineKeyboardMarkup().add(InlineKeyboardButton("◀️ Назад", callback_data="admin:menu"))
+        report = html.escape(profiler.report(top=15))[:3500]
+        await safe_edit_message_text(
+            f"<b>🔬 Профайлер</b>\n<pre>{report}</pre>\n<i>Стеки: {html.escape(path)}</i>",
+            chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb
+        )
+    elif action in ('users', 'find'):
+        # admin:users[:order[:n|p:cursor]] и admin:find:query[:n|p:cursor]
+        if action == 'users':
+            order = parts[1] if len(parts) > 1 and parts[1] in ADMIN_ORDER_LABELS else 'id'
+            query = None
+        else:
+            order = 'name'
+            query = parts[1] if len(parts) > 1 else ''
+            if not query:
+                await call.answer("Пустой запрос", show_alert=True)
+                return
+        cursor = int(parts[3]) if len(parts) > 3 else None
+        backward = len(parts) > 3 and parts[2] == 'p'
+        text, kb = await admin_users_page(order, cursor, backward, query)
+        await call.answer()
+        await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
+
+    elif action == 'catalog':
+        try:
+            fresh = await asyncio.get_running_loop().run_in_executor(None, reload_catalog)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            await call.answer(f"Каталог не загружен: {e}"[:200], show_alert=True)
+            return
+        await call.answer(f"Каталог обновлён: {len(fresh)} предметов", show_alert=True)
+
+    elif action == 'bulk':
+        kb = InlineKeyboardMarkup().add(InlineKeyboardButton("◀️ Назад", callback_data="admin:menu"))
+        await safe_edit_message_text(BULK_HELP, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
+
+    elif action == 'search':
+        await call.answer("Отправьте /find ник или /find начало_id", show_alert=True)
+
+    elif action == 'user' and len(parts) >= 2:
+        uid = int(parts[1])
+        u = await get_user(uid)
         if not u:
             await call.answer("Пользователь не найден", show_alert=True)
             return
@@ -976,36 +1677,34 @@ async def admin_callback(call: types.CallbackQuery):
             InlineKeyboardButton("✍️ Ввести сумму", callback_data=f"admin:input:{uid}"),
             InlineKeyboardButton("◀️ Назад", callback_data="admin:users")
         )
-        await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
+        await safe_edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
 
-    elif action == 'input' and len(parts) >= 3:
-        uid = int(parts[2])
-        admin_pending[call.from_user.id] = uid
+    elif action == 'input' and len(parts) >= 2:
+        uid = int(parts[1])
+        await game_store.put(ADMIN, call.from_user.id, uid, ttl=ADMIN_INPUT_TTL)
+        target = await get_user(uid)
         kb = InlineKeyboardMarkup()
         kb.add(InlineKeyboardButton("❌ Отмена", callback_data=f"admin:cancel_input:{uid}"))
-        await bot.edit_message_text(
-            f"<b>Ввод суммы</b>\nОтправьте сообщение с целым числом (например: 500 или -200) — это будет добавлено к балансу пользователя @{load_user(uid)['username']}.\nДля отмены нажмите кнопку ❌ Отмена или отправьте 'отмена'.",
+        await safe_edit_message_text(
+            f"<b>Ввод суммы</b>\nОтправьте сообщение с целым числом (например: 500 или -200) — это будет добавлено к балансу пользователя @{target['username']}.\nДля отмены нажмите кнопку ❌ Отмена или отправьте 'отмена'.",
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             reply_markup=kb
         )
 
-    elif action == 'cancel_input' and len(parts) >= 3:
-        uid = int(parts[2])
-        admin_pending.pop(call.from_user.id, None)
-        await bot.edit_message_text(f"<i>Ввод суммы отменён</i>", chat_id=call.message.chat.id, message_id=call.message.message_id)
+    elif action == 'cancel_input' and len(parts) >= 2:
+        uid = int(parts[1])
+        await game_store.pop(ADMIN, call.from_user.id)
+        await safe_edit_message_text(f"<i>Ввод суммы отменён</i>", chat_id=call.message.chat.id, message_id=call.message.message_id)
 
-    elif action == 'modify' and len(parts) >= 4:
-        uid = int(parts[2])
-        amt = int(parts[3])
-        u = load_user(uid)
+    elif action == 'modify' and len(parts) >= 3:
+        uid = int(parts[1])
+        amt = int(parts[2])
+        u = await get_user(uid)
         if not u:
             await call.answer("Пользователь не найден", show_alert=True)
             return
-        u['coins'] += amt
-        if u['coins'] < 0:
-            u['coins'] = 0
-        save_user(u)
+        await adjust_coins(uid, amt)
         text = format_user_info(u)
         kb = InlineKeyboardMarkup()
         kb.row(
@@ -1019,26 +1718,24 @@ async def admin_callback(call: types.CallbackQuery):
             InlineKeyboardButton("-1000 ⚠️", callback_data=f"admin:modify:{uid}:-1000")
         )
         kb.add(InlineKeyboardButton("◀️ Назад", callback_data="admin:users"))
-        await bot.edit_message_text(f"✅ Изменено на <b>{amt}</b> коинов.\n\n" + text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
+        await safe_edit_message_text(f"✅ Изменено на <b>{amt}</b> коинов.\n\n" + text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=kb)
 
-from aiogram.utils.exceptions import MessageNotModified
 async def safe_edit_message_text(*args, **kwargs):
-    try:
-        return await bot.edit_message_text(*args, **kwargs)
-    except MessageNotModified:
-        return None
-    except Exception:
-        return None
+    # правка уходит в outbox: склейка по сообщению, лимиты Telegram и RetryAfter там
+    if args:
+        kwargs['text'] = args[0]
+    outbox.edit(**kwargs)
 
 @dp.message_handler(lambda m: m.text and m.from_user.id == config.ADMIN_ID)
 async def admin_amount_input(message: types.Message):
-    if message.from_user.id not in admin_pending:
+    uid, version = await game_store.get(ADMIN, message.from_user.id)
+    if uid is None:
         return
     text = message.text.strip()
     if text.lower() in ("отмена", "cancel"):
-        uid = admin_pending.pop(message.from_user.id)
+        await game_store.cas(ADMIN, message.from_user.id, version, None)
         await message.reply("❌ Ввод суммы отменён.")
-        u = load_user(uid)
+        u = await get_user(uid)
         if u:
             kb = InlineKeyboardMarkup()
             kb.row(
@@ -1062,16 +1759,159 @@ async def admin_amount_input(message: types.Message):
     except ValueError:
         await message.reply("❌ Неверный формат. Введите целое число, например 500 или -200.")
         return
-    uid = admin_pending.pop(message.from_user.id)
-    u = load_user(uid)
+    # одна и та же сумма не должна примениться дважды
+    if await game_store.cas(ADMIN, message.from_user.id, version, None) is None:
+        return
+    u = await get_user(uid)
     if not u:
         await message.reply("Пользователь не найден")
         return
-    u['coins'] += amt
-    if u['coins'] < 0:
-        u['coins'] = 0
-    save_user(u)
+    await adjust_coins(uid, amt)
     await message.reply(f"✅ Изменено на <b>{amt}</b> коинов.\n\n" + format_user_info(u), parse_mode=types.ParseMode.HTML)
 
+async def refund_game(game_id, game):
+    price = game.price
+    text = f"<b>🎮 Игра #{game_id}</b>\n\n⚠️ Игра прервана перезапуском бота"
+    if price:
+        for uid in human_players(game):
+            u = await get_user(uid)
+            if u:
+                credit(u, price, 'refund', game_id)
+                update_boards(u)
+        text += f"\n💰 Ставки возвращены: <b>{price}</b> коинов каждому"
+    await show_game(game, text)
+
+
+async def restore_games():
+    # поднимаем незавершённые игры из журнала: живые продолжаются с
+    # перевзведённым таймером, просроченные за время простоя — возвращают ставки
+    now = time.time()
+    restored = journal.replay(await db.read(journal.load_open_games), MOVE_TIMEOUT)
+    for game_id, game in restored.items():
+        live, version = await game_store.get(GAMES, game_id)
+        if live is not None:
+            # общий стор пережил рестарт, или игру ведёт другой процесс
+            game = live
+        else:
+            ttl = LOBBY_TTL - (now - game.created_at) if not game.started else None
+            version = await game_store.cas(GAMES, game_id, 0, game, ttl=ttl)
+            if version is None:
+                continue
+        if not game.started:
+            if now - game.created_at >= LOBBY_TTL:
+                await end_game(game, version, 'expired')
+            continue
+        missing = [uid for uid in human_players(game) if await get_user(uid) is None]
+        if not journal.can_resume(game, now) or missing:
+            if await end_game(game, version, 'refund'):
+                await refund_game(game_id, game)
+            continue
+        await seat_players(game)
+        arm_game_timer(game, game.timeout - (now - game.last_move_time))
+    await user_writes.flush()
+    await db.write(journal.compact)
+
+
+async def sweep_store():
+    # лобби без соперника и забытый ввод админа живут с ttl; ставки в лобби
+    # ещё не списаны, так что достаточно закрыть их в журнале. Заодно из
+    # журнала уходят завершённые игры — иначе он растёт на строку за ход до рестарта
+    while True:
+        await asyncio.sleep(STORE_SWEEP_INTERVAL)
+        try:
+            for game_id, game in await game_store.expire(GAMES):
+                game_log.record(game_id, 'finish', result='expired')
+            await game_store.expire(ADMIN)
+            await db.write(journal.compact)
+        except Exception:
+            log.exception('store sweep failed')
+
+
+async def compact_ledger():
+    while True:
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+        try:
+            await db.write(storage.compact_ledger, time.time() - LEDGER_KEEP)
+        except Exception:
+            log.exception('ledger compaction failed')
+
+
+background = []
+metrics_server = []
+
+
+def register_gauges():
+    gauge = metrics.REGISTRY.gauge
+    gauge('xo_games_active', 'Таймеров ходов (идущих партий)', lambda: len(timers))
+    gauge('xo_outbox_depth', 'Правок в очереди', lambda: len(outbox))
+    gauge('xo_write_behind_pending', 'Пользователей ждут записи', lambda: len(user_writes))
+    gauge('xo_user_cache_size', 'Пользователей в кэше', lambda: len(users))
+    gauge('xo_db_statements_total', 'Выполнено SQL-операторов', lambda: db.statements)
+    gauge('xo_callbacks_unmatched_total', 'Кнопки без маршрута', lambda: router.unmatched)
+    gauge('xo_match_waiting', 'Игроков в очереди подбора', lambda: len(match_queue))
+
+
+async def on_startup(dp):
+    if CATALOG_PATH:
+        reload_catalog()
+    load_move_table()
+    for mode in boards:
+        await seed_board(mode)
+    await restore_games()
+    user_writes.start()
+    timers.start()
+    outbox.start()
+    background.append(asyncio.ensure_future(sweep_store()))
+    background.append(asyncio.ensure_future(compact_ledger()))
+    background.append(asyncio.ensure_future(matchmaker()))
+    register_gauges()
+    if METRICS_PORT:
+        metrics_server.append(await metrics.serve(METRICS_HOST, METRICS_PORT))
+    if METRICS_LOG_INTERVAL:
+        background.append(asyncio.ensure_future(metrics.log_loop(METRICS_LOG_INTERVAL)))
+
+
+async def on_shutdown(dp):
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    background.clear()
+    for runner in metrics_server:
+        await runner.cleanup()
+    metrics_server.clear()
+    profiler.stop()
+    await timers.stop()
+    await outbox.close()
+    await user_writes.close()
+    db.close()
+    game_store.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='XO bot')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default=getattr(config, 'MODE', 'polling'))
+    parser.add_argument('--host', default=getattr(config, 'WEBAPP_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=getattr(config, 'WEBAPP_PORT', 8080))
+    parser.add_argument('--path', default=getattr(config, 'WEBHOOK_PATH', '/webhook'))
+    parser.add_argument('--webhook-url', default=getattr(config, 'WEBHOOK_URL', ''),
+                        help='публичный адрес для setWebhook; пустой — вебхук уже настроен')
+    parser.add_argument('--max-concurrency', type=int, default=getattr(config, 'WEBHOOK_MAX_CONCURRENCY', 64))
+    return parser.parse_args(argv)
+
+
+def run_webhook(args):
+    from webhook import WebhookServer
+    server = WebhookServer(
+        dp, path=args.path, url=args.webhook_url, max_concurrency=args.max_concurrency,
+        secret=getattr(config, 'WEBHOOK_SECRET', None),
+        on_startup=on_startup, on_shutdown=on_shutdown
+    )
+    server.run(host=args.host, port=args.port)
+
+
 if __name__ == "__main__":
-    executor.start_polling(dp)
+    args = parse_args()
+    if args.mode == 'webhook':
+        run_webhook(args)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
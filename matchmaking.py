@@ -0,0 +1,169 @@
+import heapq
+from bisect import bisect_left, insort
+
+
+# допуск по рейтингу растёт ступенями: (сколько ждёт игрок, сек -> допуск)
+TOLERANCE_STEPS = ((0, 50), (5, 100), (15, 200), (30, 400), (60, 100000))
+
+
+class Ticket:
+    __slots__ = ('user_id', 'rating', 'stake', 'since', 'seq', 'step', 'data')
+
+    def __init__(self, user_id, rating, stake, since, seq, data=None):
+        self.user_id = user_id
+        self.rating = rating
+        self.stake = stake
+        self.since = since
+        self.seq = seq
+        self.step = 0
+        self.data = data  # что угодно от вызывающего: куда потом писать об игре
+
+    @property
+    def key(self):
+        return (self.rating, self.seq)
+
+
+class MatchQueue:
+    # Очередь подбора соперника. Пары — только с одинаковой ставкой, поэтому на
+    # каждую ставку свой пул: список ключей (rating, seq), отсортированный
+    # через bisect. Кандидаты идут от позиции игрока в пуле наружу, по
+    # возрастанию разницы рейтингов, и только пока разница не больше самого
+    # широкого допуска в пуле: дальше согласиться не может никто.
+    #
+    # Пара подходит, если разница не больше допуска хотя бы одного из двоих.
+    # Каждый новый билет и каждый, чей допуск вырос, проверяется сразу, так
+    # что в пуле не остаётся двух билетов, согласных друг на друга: уход пары
+    # новых согласных пар не создаёт, соседей после него не перепроверяем.
+    # Поэтому же обход короткий — оставшиеся билеты дальше друг от друга,
+    # чем самый узкий допуск.
+    #
+    # Допуск игрока расширяется ступенями TOLERANCE_STEPS. Перепроверять
+    # нужно только тех, у кого сейчас сменилась ступень: моменты смены лежат
+    # в куче, match(now) достаёт из неё наступившие. Последняя ступень —
+    # ожидание истекло, игрок возвращается в expired.
+
+    def __init__(self, steps=TOLERANCE_STEPS, max_wait=120):
+        self.steps = steps
+        self.max_wait = max_wait
+        self._pools = {}    # stake -> [(rating, seq)]
+        self._widths = {}   # stake -> сколько билетов пула на каждой ступени
+        self._tickets = {}  # seq -> Ticket
+        self._by_user = {}  # user_id -> Ticket
+        self._due = []      # куча (when, seq, step)
+        self._seq = 0
+        self.matched = 0
+
+    def __len__(self):
+        return len(self._by_user)
+
+    def __contains__(self, user_id):
+        return user_id in self._by_user
+
+    def get(self, user_id):
+        return self._by_user.get(user_id)
+
+    def tolerance(self, ticket):
+        return self.steps[ticket.step][1]
+
+    def enqueue(self, user_id, rating, stake, now, data=None):
+        # -> (ticket, пара или None): сначала пробуем сразу найти соперника
+        self.cancel(user_id)
+        self._seq += 1
+        ticket = Ticket(user_id, rating, stake, now, self._seq, data)
+        pool = self._pools.setdefault(stake, [])
+        insort(pool, ticket.key)
+        self._widths.setdefault(stake, [0] * len(self.steps))[0] += 1
+        self._tickets[ticket.seq] = ticket
+        self._by_user[user_id] = ticket
+        self._schedule(ticket)
+        return ticket, self._try_match(ticket)
+
+    def cancel(self, user_id):
+        ticket = self._by_user.pop(user_id, None)
+        if ticket is None:
+            return None
+        self._remove(ticket)
+        return ticket
+
+    def match(self, now):
+        # -> (пары, истёкшие билеты); обрабатывает только наступившие смены ступеней
+        pairs, expired = [], []
+        due = self._due
+        while due and due[0][0] <= now:
+            when, seq, step = heapq.heappop(due)
+            ticket = self._tickets.get(seq)
+            if ticket is None or ticket.step + 1 != step:
+                continue  # уже в игре или отменён
+            if now - ticket.since >= self.max_wait:
+                self.cancel(ticket.user_id)
+                expired.append(ticket)
+                continue
+            widths = self._widths[ticket.stake]
+            widths[ticket.step] -= 1
+            widths[step] += 1
+            ticket.step = step
+            self._schedule(ticket)
+            pair = self._try_match(ticket)
+            if pair is not None:
+                pairs.append(pair)
+        return pairs, expired
+
+    def _schedule(self, ticket):
+        step = ticket.step + 1
+        if step < len(self.steps):
+            when = ticket.since + self.steps[step][0]
+        else:
+            step, when = len(self.steps), ticket.since + self.max_wait
+        heapq.heappush(self._due, (min(when, ticket.since + self.max_wait), ticket.seq, step))
+
+    def _widest(self, stake):
+        widths = self._widths[stake]
+        step = len(widths) - 1
+        while not widths[step]:
+            step -= 1
+        return self.steps[step][1]
+
+    def _try_match(self, ticket):
+        pool = self._pools[ticket.stake]
+        widest = self._widest(ticket.stake)
+        i = bisect_left(pool, ticket.key)
+        lo, hi = i - 1, i + 1
+        while True:
+            left = ticket.rating - pool[lo][0] if lo >= 0 else None
+            right = pool[hi][0] - ticket.rating if hi < len(pool) else None
+            if right is None or (left is not None and left <= right):
+                if left is None:
+                    return None
+                diff, j = left, lo
+                lo -= 1
+            else:
+                diff, j = right, hi
+                hi += 1
+            if diff > widest:
+                return None
+            other = self._tickets[pool[j][1]]
+            # ждать дольше — значит соглашаться на более широкий разброс
+            if diff <= max(self.tolerance(ticket), self.tolerance(other)):
+                break
+        self.cancel(ticket.user_id)
+        self.cancel(other.user_id)
+        self.matched += 1
+        # крестики — тому, кто ждал дольше
+        return (other, ticket) if other.seq < ticket.seq else (ticket, other)
+
+    def _remove(self, ticket):
+        pool = self._pools[ticket.stake]
+        i = bisect_left(pool, ticket.key)
+        del pool[i]
+        self._widths[ticket.stake][ticket.step] -= 1
+        if not pool:
+            del self._pools[ticket.stake]
+            del self._widths[ticket.stake]
+        del self._tickets[ticket.seq]
+
+    def stats(self):
+        return {
+            'waiting': len(self._by_user),
+            'pools': len(self._pools),
+            'matched': self.matched,
+        }
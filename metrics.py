@@ -0,0 +1,378 @@
+import asyncio
+import bisect
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+
+log = logging.getLogger(__name__)
+
+# границы корзин гистограмм латентности, сек
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _fmt_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class _CounterSeries:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self._series = {}
+
+    def labels(self, **labels):
+        key = _key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _CounterSeries()
+        return series
+
+    def inc(self, n=1, **labels):
+        self.labels(**labels).inc(n)
+
+    def render(self):
+        for key, s in self._series.items():
+            yield f'{self.name}{_fmt_labels(key)} {s.value}'
+
+
+class _HistogramSeries:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # оценка по корзинам: верхняя граница корзины, где набралась доля q
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help='', buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def labels(self, **labels):
+        key = _key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(self.buckets)
+        return series
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def series(self):
+        return self._series.items()
+
+    def render(self):
+        for key, s in self._series.items():
+            total = 0
+            for bound, n in zip(self.buckets, s.counts):
+                total += n
+                yield f'{self.name}_bucket{_fmt_labels(key, [("le", bound)])} {total}'
+            yield f'{self.name}_bucket{_fmt_labels(key, [("le", "+Inf")])} {s.count}'
+            yield f'{self.name}_sum{_fmt_labels(key)} {s.sum:.6f}'
+            yield f'{self.name}_count{_fmt_labels(key)} {s.count}'
+
+
+class Gauge:
+    # значение читается вызовом fn() в момент выдачи метрик
+    kind = 'gauge'
+
+    def __init__(self, name, help='', fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if value is not None:
+            yield f'{self.name} {value}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help=''):
+        return self._add(Counter(name, help))
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def gauge(self, name, help='', fn=None):
+        metric = self._add(Gauge(name, help, fn))
+        metric.fn = fn
+        return metric
+
+    def render(self):
+        # текстовый формат Prometheus 0.0.4
+        lines = []
+        for m in self._metrics.values():
+            if m.help:
+                lines.append(f'# HELP {m.name} {m.help}')
+            lines.append(f'# TYPE {m.name} {m.kind}')
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, name, top=5):
+        # самые нагруженные серии гистограммы одной строкой: для лога и админки
+        m = self._metrics.get(name)
+        if not isinstance(m, Histogram):
+            return ''
+        rows = sorted(m.series(), key=lambda kv: -kv[1].count)[:top]
+        return ', '.join(
+            f"{'/'.join(str(v) for _, v in key) or m.name} {s.count}× p50≤{s.quantile(0.5) * 1000:g} p99≤{s.quantile(0.99) * 1000:g} мс"
+            for key, s in rows if s.count
+        )
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram('xo_handler_seconds', 'Время обработки апдейта хендлером')
+HANDLER_ERRORS = REGISTRY.counter('xo_handler_errors_total', 'Исключения в хендлерах')
+CALL_SECONDS = REGISTRY.histogram('xo_call_seconds', 'Время внутренних вызовов (reg_user, get_user, ...)')
+DB_SECONDS = REGISTRY.histogram('xo_db_seconds', 'Время запросов к SQLite, включая ожидание потока')
+API_SECONDS = REGISTRY.histogram('xo_api_seconds', 'Время запросов к Bot API')
+API_ERRORS = REGISTRY.counter('xo_api_errors_total', 'Ошибки запросов к Bot API')
+
+
+class timer:
+    # with timer(HISTOGRAM, label=...): — работает и вокруг await
+    __slots__ = ('series', 'started')
+
+    def __init__(self, histogram, **labels):
+        self.series = histogram.labels(**labels)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.series.observe(time.perf_counter() - self.started)
+        return False
+
+
+def timed(histogram=CALL_SECONDS, **labels):
+    # декоратор для корутин и обычных функций; метка fn — имя функции
+    def decorator(fn):
+        series = histogram.labels(**{'fn': fn.__name__, **labels})
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    series.observe(time.perf_counter() - started)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    series.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class HandlerMetrics(BaseMiddleware):
+    # латентность каждого хендлера сообщений и инлайн-запросов без декораторов
+    # на них; callback-кнопки меряет CallbackRouter через observe_route
+
+    def _start(self, data):
+        handler = current_handler.get(None)
+        data['_metrics'] = (getattr(handler, '__name__', 'unknown'), time.perf_counter())
+
+    def _stop(self, data):
+        name, started = data.pop('_metrics', (None, 0))
+        if name is not None:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    async def on_process_message(self, message, data):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        self._stop(data)
+
+    async def on_process_inline_query(self, query, data):
+        self._start(data)
+
+    async def on_post_process_inline_query(self, query, results, data):
+        self._stop(data)
+
+
+def observe_route(pattern, elapsed):
+    HANDLER_SECONDS.observe(elapsed, handler=pattern)
+
+
+def observe_db(op, fn_name, elapsed):
+    DB_SECONDS.observe(elapsed, op=op, fn=fn_name)
+
+
+class MeteredBot(Bot):
+    # каждый запрос к Bot API — в гистограмму по методу
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await super().request(method, data, files, **kwargs)
+            failed = False
+            return result
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=method)
+            if failed:
+                API_ERRORS.inc(method=method)
+
+
+async def serve(host, port, path='/metrics', registry=REGISTRY):
+    # отдельный HTTP на внутреннем адресе в обоих режимах: публичный порт вебхука метрики не отдаёт
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get(path, handler(registry))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def handler(registry=REGISTRY):
+    from aiohttp import web
+
+    async def metrics_handler(request):
+        return web.Response(text=registry.render(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+    return metrics_handler
+
+
+async def log_loop(interval, names=('xo_handler_seconds', 'xo_db_seconds', 'xo_api_seconds'), registry=REGISTRY):
+    while True:
+        await asyncio.sleep(interval)
+        for name in names:
+            line = registry.summary(name)
+            if line:
+                log.info('%s: %s', name, line)
+
+
+class SamplingProfiler:
+    # Семплирующий профайлер: отдельный поток раз в interval снимает стек
+    # потока event loop через sys._current_frames() и копит свёрнутые стеки.
+    # Пока выключен, ничего не стоит; включается админом на живой нагрузке.
+
+    def __init__(self, interval=0.005, depth=30):
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        self.stacks = _Tally()
+        self.leaves = _Tally()
+        self.started_at = None
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, thread_id=None):
+        if self._thread is not None:
+            return
+        self._target = thread_id or threading.get_ident()
+        self.samples = 0
+        self.stacks.clear()
+        self.leaves.clear()
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.depth:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.samples += 1
+            self.leaves[stack[0]] += 1
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def report(self, top=10):
+        if not self.samples:
+            return 'нет семплов'
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        lines = [f'{self.samples} семплов за {elapsed:.0f} с']
+        for leaf, n in self.leaves.most_common(top):
+            lines.append(f'{n / self.samples:6.1%}  {leaf}')
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        # формат flamegraph.pl / speedscope: "a;b;c count"
+        return '\n'.join(f'{stack} {n}' for stack, n in self.stacks.most_common())
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.utils.exceptions import MessageNotModified, NetworkError, RetryAfter, TelegramAPIError
+
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self):
+        # через сколько секунд появится жетон
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+def edit_target(kwargs):
+    if kwargs.get('inline_message_id'):
+        return ('inline', kwargs['inline_message_id'])
+    return ('chat', kwargs.get('chat_id'), kwargs.get('message_id'))
+
+
+class EditQueue:
+    # Очередь исходящих editMessageText. На каждое сообщение (chat_id/message_id
+    # или inline_message_id) хранится только последняя правка: промежуточные
+    # состояния доски склеиваются и не тратят запросы. Отправка ограничена
+    # общим token bucket'ом и отдельным на каждый чат; RetryAfter откладывает
+    # сообщение (и весь его чат) на указанное Telegram время.
+
+    # раз в столько секунд выкидываем bucket'ы и паузы, которые уже ничего не ограничивают
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, workers=4, max_retries=5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.enqueued = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.not_modified = 0
+        self.retries = 0
+        self.failed = 0
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        self._not_before = {}
+        self._pending = {}
+        self._attempts = {}
+        self._ready = deque()
+        self._queued = set()
+        self._inflight = set()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._pruned_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def edit(self, **kwargs):
+        key = edit_target(kwargs)
+        self.enqueued += 1
+        if key in self._pending:
+            # более старая правка так и не ушла — её заменяет свежая
+            self.coalesced += 1
+        self._pending[key] = kwargs
+        self._attempts.pop(key, None)
+        self._schedule(key)
+
+    def _schedule(self, key):
+        if key in self._queued or key in self._inflight:
+            return
+        self._queued.add(key)
+        self._ready.append(key)
+        self._wakeup.set()
+
+    def _bucket_key(self, key):
+        # inline-сообщения не привязаны к чату — ограничиваем каждое отдельно
+        return key[:2]
+
+    def _bucket(self, bkey):
+        bucket = self._buckets.get(bkey)
+        if bucket is None:
+            bucket = self._buckets[bkey] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _next(self):
+        while True:
+            now = time.monotonic()
+            soonest = None
+            for _ in range(len(self._ready)):
+                key = self._ready.popleft()
+                bkey = self._bucket_key(key)
+                wait = max(self._not_before.get(bkey, 0) - now, self._bucket(bkey).delay())
+                if wait <= 0:
+                    self._queued.discard(key)
+                    return key
+                self._ready.append(key)
+                soonest = wait if soonest is None else min(soonest, wait)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), soonest)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            try:
+                await self._step()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('edit worker step failed')
+
+    async def _step(self):
+        key = await self._next()
+        # до первого await: пока ждём общий bucket, новая правка того же
+        # сообщения не должна достаться второму воркеру
+        kwargs = self._pending.pop(key)
+        self._inflight.add(key)
+        try:
+            while self._global.delay() > 0:
+                await asyncio.sleep(self._global.delay())
+            # за время ожидания могла прийти правка новее
+            kwargs = self._pending.pop(key, kwargs)
+            self._global.take()
+            bkey = self._bucket_key(key)
+            self._bucket(bkey).take()
+            await self._send(key, bkey, kwargs)
+        finally:
+            self._inflight.discard(key)
+            if key in self._pending:
+                self._schedule(key)
+        if time.monotonic() - self._pruned_at >= self.PRUNE_INTERVAL:
+            self._prune()
+
+    def _prune(self):
+        # полный bucket ничем не отличается от нового, истёкшая пауза — от
+        # отсутствующей; без этого на каждое inline-сообщение копилось бы по записи
+        now = self._pruned_at = time.monotonic()
+        for bkey in [b for b, until in self._not_before.items() if until <= now]:
+            del self._not_before[bkey]
+        for bkey in [b for b, bucket in self._buckets.items() if bucket.full()]:
+            del self._buckets[bkey]
+
+    async def _send(self, key, bkey, kwargs):
+        try:
+            await self.bot.edit_message_text(**kwargs)
+            self.sent += 1
+            self._attempts.pop(key, None)
+        except MessageNotModified:
+            self.not_modified += 1
+        except RetryAfter as e:
+            self.retries += 1
+            self._not_before[bkey] = time.monotonic() + e.timeout
+            self._retry(key, kwargs)
+        except NetworkError:
+            attempt = self._attempts.get(key, 0) + 1
+            if attempt > self.max_retries:
+                self.failed += 1
+                self._attempts.pop(key, None)
+                return
+            self.retries += 1
+            self._attempts[key] = attempt
+            self._not_before[bkey] = time.monotonic() + min(2 ** attempt * 0.5, 30)
+            self._retry(key, kwargs)
+        except TelegramAPIError as e:
+            self.failed += 1
+            log.warning('edit dropped: %s', e)
+        except Exception:
+            self.failed += 1
+            log.exception('edit dropped')
+
+    def _retry(self, key, kwargs):
+        # если за время запроса пришла правка новее — отправим её, а не эту
+        self._pending.setdefault(key, kwargs)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout=5.0):
+        # даём очереди дослать последние состояния, потом гасим воркеров
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._inflight) and self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {
+            'depth': len(self._pending),
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'sent': self.sent,
+            'not_modified': self.not_modified,
+            'retries': self.retries,
+            'failed': self.failed,
+        }
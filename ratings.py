@@ -0,0 +1,301 @@
+# Формулы рейтинга и офлайн-пересчёт рейтингов всех игроков по game_history.
+#
+# Бот меняет рейтинг по одной партии (elo_delta / draw_deltas ниже). Здесь
+# же вся история прогоняется заново: партии читаются по порядку окончания,
+# и каждый кусок разбивается на слои — слой партии на 1 больше последнего
+# слоя любого из её игроков. Внутри слоя у партий нет общих игроков, так что
+# слой считается целиком векторно на NumPy-массивах, индексированных по
+# игроку, а результат совпадает с последовательным проходом.
+#
+# Если у кого-то из игроков партий на порядки больше, чем у остальных,
+# слоёв почти столько же, сколько его партий, и большинство слоёв — пара
+# партий. На таких вызов NumPy дороже самой арифметики, поэтому слои уже
+# NARROW считаются по одной партии обычным Python.
+#
+# Формулы подключаемые: объект с start(n) -> состояние, update(состояние,
+# x, o, очки X) на массивах, update_one(...) на одной партии; ratings(состояние)
+# отдаёт целые рейтинги.
+#
+# История читается и раскладывается по слоям один раз (load), дальше любое
+# число вариантов формулы считается по готовым массивам (recompute).
+#
+#   python ratings.py                      — отчёт: сколько и как изменится
+#   python ratings.py --k 24 32 40         — несколько вариантов K за раз
+#   python ratings.py --formula glicko     — другая формула
+#   python ratings.py --k 40 --apply       — записать одной транзакцией
+#
+# Записывать — при остановленном боте. Итоги партий бот пишет дельтами и
+# записанное не затрёт, но у закэшированных игроков останется старый
+# рейтинг: его бот показывает, по нему подбирает соперников и от него
+# считает Elo следующих партий.
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import time
+
+import config
+import storage
+
+try:
+    import numpy as np
+except ImportError:  # нужен только для пересчёта, бот работает и без него
+    np = None
+
+K_WIN = 32
+K_DRAW = 24
+START_RATING = 1200
+# соперник-бот в game_history (BOT_ID в main.py): такие партии в пересчёт не идут
+BOT_ID = 0
+NARROW = 24
+
+
+def expected(r_a, r_b):
+    return 1 / (1 + 10 ** ((r_b - r_a) / 400))
+
+
+def elo_delta(r_a, r_b, k=K_WIN):
+    # сколько победитель r_a забирает у проигравшего r_b
+    return int(round(k * (1 - expected(r_a, r_b))))
+
+
+def draw_deltas(r_a, r_b, k=K_DRAW):
+    return int(round(k * (0.5 - expected(r_a, r_b)))), int(round(k * (0.5 - expected(r_b, r_a))))
+
+
+class Elo:
+    # то же, что делает бот: победа — ±elo_delta с K_WIN, ничья — draw_deltas с K_DRAW
+    def __init__(self, k=K_WIN, k_draw=K_DRAW, start=START_RATING):
+        self.k = k
+        self.k_draw = k_draw
+        self.start_rating = start
+
+    def start(self, n):
+        return {'rating': np.full(n, self.start_rating, dtype=np.int64)}
+
+    def update(self, state, x, o, score):
+        r = state['rating']
+        ra, rb = r[x], r[o]
+        ea = 1 / (1 + 10.0 ** ((rb - ra) / 400))
+        eb = 1 / (1 + 10.0 ** ((ra - rb) / 400))
+        win = np.rint(self.k * (1 - np.where(score == 2, ea, eb))).astype(np.int64)
+        dx = np.where(score == 2, win, -win)
+        do = -dx
+        draw = score == 1
+        if draw.any():
+            dx[draw] = np.rint(self.k_draw * (0.5 - ea[draw]))
+            do[draw] = np.rint(self.k_draw * (0.5 - eb[draw]))
+        r[x] = ra + dx
+        r[o] = rb + do
+
+    def update_one(self, state, x, o, score):
+        r = state['rating']
+        ra, rb = int(r[x]), int(r[o])
+        if score == 1:
+            dx, do = draw_deltas(ra, rb, self.k_draw)
+        elif score == 2:
+            dx = elo_delta(ra, rb, self.k)
+            do = -dx
+        else:
+            do = elo_delta(rb, ra, self.k)
+            dx = -do
+        r[x] = ra + dx
+        r[o] = rb + do
+
+    def ratings(self, state):
+        return state['rating']
+
+
+class Glicko:
+    # Glicko-1, каждая партия — свой рейтинговый период: у игрока есть
+    # отклонение rd, оно растёт на c за партию и сжимается с каждой игрой
+    Q = math.log(10) / 400
+
+    def __init__(self, start=START_RATING, rd=350.0, c=15.0, min_rd=30.0):
+        self.start_rating = start
+        self.rd = rd
+        self.c = c
+        self.min_rd = min_rd
+
+    def start(self, n):
+        return {'rating': np.full(n, float(self.start_rating)), 'rd': np.full(n, self.rd)}
+
+    def _g(self, rd):
+        return 1 / np.sqrt(1 + 3 * self.Q ** 2 * rd ** 2 / math.pi ** 2)
+
+    def _one_side(self, r, rd, r_opp, rd_opp, s):
+        g = self._g(rd_opp)
+        e = 1 / (1 + 10 ** (-g * (r - r_opp) / 400))
+        d2 = 1 / (self.Q ** 2 * g ** 2 * e * (1 - e))
+        denom = 1 / rd ** 2 + 1 / d2
+        return r + self.Q / denom * g * (s - e), np.sqrt(1 / denom)
+
+    def update(self, state, x, o, score):
+        r, rd = state['rating'], state['rd']
+        rd_x = np.minimum(np.sqrt(rd[x] ** 2 + self.c ** 2), self.rd)
+        rd_o = np.minimum(np.sqrt(rd[o] ** 2 + self.c ** 2), self.rd)
+        s = score / 2
+        rx, new_rd_x = self._one_side(r[x], rd_x, r[o], rd_o, s)
+        ro, new_rd_o = self._one_side(r[o], rd_o, r[x], rd_x, 1 - s)
+        r[x], r[o] = rx, ro
+        rd[x], rd[o] = np.maximum(new_rd_x, self.min_rd), np.maximum(new_rd_o, self.min_rd)
+
+    def update_one(self, state, x, o, score):
+        # то же на числах: NumPy на скалярах в разы медленнее math
+        r, rd = state['rating'], state['rd']
+        rx, ro = float(r[x]), float(r[o])
+        rd_x = min(math.sqrt(rd[x] ** 2 + self.c ** 2), self.rd)
+        rd_o = min(math.sqrt(rd[o] ** 2 + self.c ** 2), self.rd)
+        s = score / 2
+        for me, r_me, rd_me, r_opp, rd_opp, s_me in ((x, rx, rd_x, ro, rd_o, s), (o, ro, rd_o, rx, rd_x, 1 - s)):
+            g = 1 / math.sqrt(1 + 3 * self.Q ** 2 * rd_opp ** 2 / math.pi ** 2)
+            e = 1 / (1 + 10 ** (-g * (r_me - r_opp) / 400))
+            denom = 1 / rd_me ** 2 + self.Q ** 2 * g ** 2 * e * (1 - e)
+            r[me] = r_me + self.Q / denom * g * (s_me - e)
+            rd[me] = max(math.sqrt(1 / denom), self.min_rd)
+
+    def ratings(self, state):
+        return np.rint(state['rating']).astype(np.int64)
+
+
+FORMULAS = {'elo': Elo, 'glicko': Glicko}
+
+
+def layers(x, o, n_players):
+    # номер слоя каждой партии куска; -> массив той же длины, слои с 1
+    last = [0] * n_players
+    out = []
+    for a, b in zip(x.tolist(), o.tolist()):
+        layer = last[a] if last[a] > last[b] else last[b]
+        layer += 1
+        last[a] = last[b] = layer
+        out.append(layer)
+    return np.array(out, dtype=np.int64)
+
+
+def load(conn, batch=200000, skip=BOT_ID):
+    # история один раз: -> (id игроков по возрастанию, куски). Кусок —
+    # (x, o, очки X, границы слоёв) с партиями, переставленными по слоям,
+    # так что слой — сплошной срез; x и o — номера игроков в players
+    players = np.array(storage.history_players(conn, skip), dtype=np.int64)
+    played = np.zeros(len(players), dtype=bool)
+    chunks = []
+    for rows in storage.history_results(conn, batch, skip):
+        chunk = np.array(rows, dtype=np.int64)
+        x = np.searchsorted(players, chunk[:, 0])
+        o = np.searchsorted(players, chunk[:, 1])
+        played[x] = played[o] = True
+        layer = layers(x, o, len(players))
+        order = np.argsort(layer, kind='stable')
+        chunks.append((x[order], o[order], chunk[order, 2], np.flatnonzero(np.diff(layer[order])) + 1))
+    # у сыгравших только с ботом пересчитывать нечего
+    index = np.cumsum(played) - 1
+    chunks = [(index[x].astype(np.int32), index[o].astype(np.int32), score.astype(np.int8), bounds) for x, o, score, bounds in chunks]
+    return players[played], chunks
+
+
+def recompute(players, chunks, formula, narrow=NARROW):
+    # -> рейтинги в порядке players
+    state = formula.start(len(players))
+    for x, o, score, bounds in chunks:
+        xs, os_, scores = x.tolist(), o.tolist(), score.tolist()
+        start = 0
+        for end in bounds.tolist() + [len(x)]:
+            if end - start < narrow:
+                for i in range(start, end):
+                    formula.update_one(state, xs[i], os_[i], scores[i])
+            else:
+                formula.update(state, x[start:end], o[start:end], score[start:end])
+            start = end
+    return formula.ratings(state)
+
+
+def current_ratings(conn, players):
+    # -> (есть ли игрок в users, его текущий рейтинг) по массиву players
+    rows = np.array(conn.execute('SELECT id, rating FROM users ORDER BY id').fetchall() or [(0, 0)], dtype=np.int64)
+    pos = np.minimum(np.searchsorted(rows[:, 0], players), len(rows) - 1)
+    found = rows[pos, 0] == players
+    return found, np.where(found, rows[pos, 1], 0)
+
+
+def report(conn, players, before, after, top=10):
+    delta = after - before
+    changed = delta != 0
+    lines = [f'игроков: {len(players)}, изменится рейтинг: {int(changed.sum())}']
+    if not len(players):
+        return '\n'.join(lines)
+    lines.append(f'|Δ| в среднем {np.abs(delta).mean():.1f}, больше 50: {int((np.abs(delta) > 50).sum())}')
+    for label, r in (('было', before), ('станет', after)):
+        p10, p50, p90 = np.percentile(r, (10, 50, 90))
+        lines.append(f'{label:>6}: среднее {r.mean():.0f}, p10 {p10:.0f}, медиана {p50:.0f}, p90 {p90:.0f}, max {r.max()}')
+    order = np.argsort(delta, kind='stable')
+    for title, picks, sign in (('сильнее всего вырастут', order[::-1][:top], 1), ('сильнее всего упадут', order[:top], -1)):
+        picks = [i for i in picks.tolist() if delta[i] * sign > 0]
+        if not picks:
+            continue
+        names = dict(conn.execute(
+            f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(picks))})", [int(players[i]) for i in picks]
+        ).fetchall())
+        lines.append(title + ':')
+        for i in picks:
+            uid = int(players[i])
+            lines.append(f'  {uid} @{names.get(uid) or "?"}: {before[i]} → {after[i]} ({delta[i]:+d})')
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    # та же база, что у бота (DB_PATH в main.py)
+    default_db = (
+        os.environ.get('XO_DB_PATH') or getattr(config, 'DB_PATH', None)
+        or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.db')
+    )
+    parser = argparse.ArgumentParser(description='Пересчёт рейтингов по истории партий')
+    parser.add_argument('--db', default=default_db)
+    parser.add_argument('--formula', choices=sorted(FORMULAS), default='elo')
+    parser.add_argument('--k', type=float, nargs='+', help='K за победу (elo), несколько значений — несколько вариантов')
+    parser.add_argument('--k-draw', type=float, help='K за ничью (elo)')
+    parser.add_argument('--start', type=int, default=START_RATING)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=200000)
+    parser.add_argument('--apply', action='store_true', help='записать новые рейтинги одной транзакцией')
+    return parser.parse_args(argv)
+
+
+def variants(args):
+    # -> [(название, формула)] по аргументам командной строки
+    if args.formula == 'glicko':
+        return [('glicko', Glicko(start=args.start))]
+    k_draw = K_DRAW if args.k_draw is None else args.k_draw
+    return [(f'elo K={k:g}, ничья {k_draw:g}', Elo(k, k_draw, args.start)) for k in args.k or [K_WIN]]
+
+
+def main(argv=None):
+    if np is None:
+        sys.exit('для пересчёта нужен numpy: pip install numpy')
+    args = parse_args(argv)
+    todo = variants(args)
+    if args.apply and len(todo) > 1:
+        sys.exit('--apply — только для одного варианта')
+
+    conn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    players, chunks = load(conn, args.batch)
+    games = sum(len(chunk[0]) for chunk in chunks)
+    print(f'история: {games} партий, {len(players)} игроков, {sum(len(chunk[3]) + 1 for chunk in chunks)} слоёв, {time.perf_counter() - started:.2f} с')
+    # в истории могут быть игроки, которых уже нет в users
+    found, before = current_ratings(conn, players)
+    for name, formula in todo:
+        started = time.perf_counter()
+        after = recompute(players, chunks, formula)[found]
+        print(f'\n{name}: {time.perf_counter() - started:.2f} с')
+        print(report(conn, players[found], before[found], after, args.top))
+    if args.apply:
+        with conn:
+            changed = storage.set_ratings(conn, zip(players[found].tolist(), after.tolist()))
+        print(f'записано: {changed}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import time
+
+
+class Route:
+    __slots__ = ('pattern', 'handler', 'params', 'names', 'typed', 'calls', 'errors', 'total', 'max')
+
+    def __init__(self, pattern, handler, params):
+        self.pattern = pattern
+        self.handler = handler
+        self.params = params  # [(name, conv)] в порядке захваченных сегментов
+        self.names = tuple(name for name, _ in params)
+        self.typed = tuple((name, conv) for name, conv in params if conv is not str)
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def bind(self, captured):
+        params = dict(zip(self.names, captured))
+        for name, conv in self.typed:
+            params[name] = conv(params[name])
+        return params
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class _Node:
+    __slots__ = ('literal', 'param', 'rest', 'route')
+
+    def __init__(self):
+        self.literal = {}
+        self.param = None
+        self.rest = None
+        self.route = None
+
+
+CONVERTERS = {'str': str, 'int': int}
+
+
+class CallbackRouter:
+    # Маршрутизация callback_data вместо цепочки фильтров aiogram: строка
+    # режется по ':' один раз, дальше спуск по дереву сегментов. Литерал
+    # ищется в словаре узла, {name} / {name:int} подхватывает любой сегмент,
+    # {name*} — весь остаток списком. Хендлер получает параметры уже
+    # разобранными: handler(call, **params). Для каждого маршрута считаются
+    # вызовы, ошибки и время обработки; observe(pattern, seconds) — внешний хук.
+
+    def __init__(self, sep=':', observe=None):
+        self.sep = sep
+        self.observe = observe
+        self.routes = []
+        self.unmatched = 0
+        self._root = _Node()
+
+    def route(self, pattern):
+        def decorator(handler):
+            self.add(pattern, handler)
+            return handler
+        return decorator
+
+    def add(self, pattern, handler):
+        node = self._root
+        params = []
+        segments = self._segments(pattern)
+        for i, seg in enumerate(segments):
+            if seg.startswith('{') and seg.endswith('}'):
+                name, _, kind = seg[1:-1].partition(':')
+                if name.endswith('*'):
+                    if i != len(segments) - 1:
+                        raise ValueError(f'{pattern}: {seg} must be the last segment')
+                    params.append((name[:-1], list))
+                    node.rest = node.rest or _Node()
+                    node = node.rest
+                    break
+                params.append((name, CONVERTERS[kind or 'str']))
+                node.param = node.param or _Node()
+                node = node.param
+            else:
+                node = node.literal.setdefault(seg, _Node())
+        if node.route is not None:
+            raise ValueError(f'duplicate route {pattern}')
+        route = Route(pattern, handler, params)
+        node.route = route
+        self.routes.append(route)
+        return route
+
+    def _segments(self, pattern):
+        # ':' внутри {name:int} — не разделитель
+        segments = ['']
+        depth = 0
+        for ch in pattern:
+            if ch == self.sep and not depth:
+                segments.append('')
+                continue
+            depth += (ch == '{') - (ch == '}')
+            segments[-1] += ch
+        return segments
+
+    def _match(self, node, parts, i, captured):
+        if i == len(parts):
+            if node.route is not None:
+                return node.route
+            return None
+        seg = parts[i]
+        child = node.literal.get(seg)
+        if child is not None:
+            found = self._match(child, parts, i + 1, captured)
+            if found is not None:
+                return found
+        if node.param is not None:
+            captured.append(seg)
+            found = self._match(node.param, parts, i + 1, captured)
+            if found is not None:
+                return found
+            captured.pop()
+        if node.rest is not None and node.rest.route is not None:
+            captured.append(parts[i:])
+            return node.rest.route
+        return None
+
+    def resolve(self, data):
+        # -> (route, params) или None
+        captured = []
+        route = self._match(self._root, data.split(self.sep), 0, captured)
+        if route is None:
+            return None
+        try:
+            return route, route.bind(captured)
+        except ValueError:
+            return None
+
+    async def dispatch(self, call):
+        hit = self.resolve(call.data or '')
+        if hit is None:
+            self.unmatched += 1
+            return False
+        route, params = hit
+        started = time.perf_counter()
+        try:
+            await route.handler(call, **params)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route.record(elapsed)
+            if self.observe is not None:
+                self.observe(route.pattern, elapsed)
+        return True
+
+    def stats(self):
+        return {
+            r.pattern: {
+                'calls': r.calls,
+                'errors': r.errors,
+                'avg_ms': r.total / r.calls * 1000 if r.calls else 0.0,
+                'max_ms': r.max * 1000,
+            }
+            for r in self.routes
+        }
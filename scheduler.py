@@ -0,0 +1,131 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class Clock:
+    def time(self):
+        return time.monotonic()
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+
+
+class VirtualClock:
+    # Ручные часы для тестов: время двигается только через advance().
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self._sleepers = []
+        self._seq = itertools.count()
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self.now + max(delay, 0), next(self._seq), fut))
+        await fut
+
+    async def advance(self, delta):
+        target = self.now + delta
+        while self._sleepers and self._sleepers[0][0] <= target:
+            wake_at, _, fut = heapq.heappop(self._sleepers)
+            self.now = max(self.now, wake_at)
+            if not fut.done():
+                fut.set_result(None)
+            # даём проснувшимся корутинам отработать до следующего шага
+            for _ in range(3):
+                await asyncio.sleep(0)
+        self.now = target
+        await asyncio.sleep(0)
+
+
+class TimerWheel:
+    # Хешированное колесо таймеров: один корутин-обходчик на все игры.
+    # Таймер с ключом key кладётся в слот ceil(deadline / tick) % slots;
+    # перевзвод — это удаление из одного множества и вставка в другое, O(1).
+    # Таймеры дальше одного оборота колеса лежат в том же слоте и ждут своего
+    # круга. По срабатыванию вызывается callback(key) отдельной задачей.
+
+    def __init__(self, callback, tick=0.5, slots=512, clock=None):
+        self.callback = callback
+        self.tick = tick
+        self.clock = clock or Clock()
+        self.fired = 0
+        self._slots = [set() for _ in range(slots)]
+        self._entries = {}  # key -> номер тика, на котором сработать
+        self._cursor = math.floor(self.clock.time() / tick)
+        self._task = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def arm(self, key, delay):
+        # (пере)взвести таймер; старый дедлайн для key забывается
+        tick_no = math.ceil((self.clock.time() + delay) / self.tick)
+        # до курсора уже не дойдём — срабатываем на ближайшем тике
+        tick_no = max(tick_no, self._cursor)
+        old = self._entries.get(key)
+        if old is not None:
+            self._slots[old % len(self._slots)].discard(key)
+        self._entries[key] = tick_no
+        self._slots[tick_no % len(self._slots)].add(key)
+
+    def cancel(self, key):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._slots[old % len(self._slots)].discard(key)
+
+    def advance(self):
+        # обработать все тики вплоть до текущего времени, вернуть сработавшие ключи
+        due = []
+        target = math.floor(self.clock.time() / self.tick)
+        while self._cursor <= target:
+            slot = self._slots[self._cursor % len(self._slots)]
+            if slot:
+                for key in [k for k in slot if self._entries[k] <= self._cursor]:
+                    slot.discard(key)
+                    del self._entries[key]
+                    due.append(key)
+            self._cursor += 1
+        return due
+
+    def _fire(self, key):
+        self.fired += 1
+        task = asyncio.ensure_future(self.callback(key))
+        task.add_done_callback(_log_failure)
+
+    async def run(self):
+        while True:
+            for key in self.advance():
+                self._fire(key)
+            now = self.clock.time()
+            await self.clock.sleep(self._cursor * self.tick - now)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        log.error('timer callback failed', exc_info=task.exception())
@@ -0,0 +1,109 @@
+# Таблица идеальной игры для бота: negamax один раз по всем достижимым
+# позициям 3×3, дальше выбор хода — чтение из таблицы без перебора.
+#
+# Позиция (x_bits, o_bits) адресуется троичным индексом: клетка i даёт
+# 0 / 1 / 2 * 3**i, так что таблица — плоский массив на 3**9 записей.
+# Запись — 9-битная маска лучших ходов для того, чей сейчас ход (очередь
+# видна по числу фишек: поровну — ходит X). Лучший ход — самая быстрая
+# победа, иначе ничья, иначе самое долгое поражение.
+import random
+import sys
+from array import array
+
+from engine import FULL, WINNING
+
+SIZE = 3 ** 9
+MAGIC = b'XOT1'
+
+# TERNARY[bits] — вклад маски в троичный индекс, если на её клетках единицы
+TERNARY = tuple(sum(3 ** i for i in range(9) if bits >> i & 1) for bits in range(FULL + 1))
+# CELLS[mask] — номера клеток маски, чтобы выбрать случайный ход за O(1)
+CELLS = tuple(tuple(i for i in range(9) if mask >> i & 1) for mask in range(FULL + 1))
+POPCOUNT = tuple(len(cells) for cells in CELLS)
+
+# уровень -> вероятность сыграть лучший ход; иначе любой свободный
+LEVELS = {'easy': 0.3, 'medium': 0.7, 'hard': 1.0}
+
+
+def index(x_bits, o_bits):
+    return TERNARY[x_bits] + 2 * TERNARY[o_bits]
+
+
+def solve():
+    table = array('H', bytes(2 * SIZE))
+    memo = {}
+
+    def negamax(me, opp):
+        # -> оценка для того, кто ходит; заодно пишет маску лучших ходов
+        key = (me, opp)
+        if key in memo:
+            return memo[key]
+        best, best_mask = -100, 0
+        free = FULL & ~(me | opp)
+        for i in CELLS[free]:
+            mine = me | 1 << i
+            if WINNING[mine]:
+                score = 10 - POPCOUNT[mine | opp]  # чем раньше победа, тем лучше
+            elif mine | opp == FULL:
+                score = 0
+            else:
+                score = -negamax(opp, mine)
+            if score > best:
+                best, best_mask = score, 1 << i
+            elif score == best:
+                best_mask |= 1 << i
+        x_turn = POPCOUNT[me] == POPCOUNT[opp]
+        table[index(me, opp) if x_turn else index(opp, me)] = best_mask
+        memo[key] = best
+        return best
+
+    negamax(0, 0)
+    return table
+
+
+class MoveTable:
+    def __init__(self, table):
+        if len(table) != SIZE:
+            raise ValueError(f'move table must have {SIZE} entries, got {len(table)}')
+        self.table = table
+
+    def best(self, x_bits, o_bits):
+        # маска лучших ходов; 0 — позиция конечная или недостижимая
+        return self.table[index(x_bits, o_bits)]
+
+    def choose(self, x_bits, o_bits, level='hard', rng=random):
+        best = self.table[index(x_bits, o_bits)]
+        if best and rng.random() < LEVELS[level]:
+            return rng.choice(CELLS[best])
+        free = FULL & ~(x_bits | o_bits)
+        return rng.choice(CELLS[free]) if free else None
+
+    @classmethod
+    def build(cls):
+        return cls(solve())
+
+    def save(self, path):
+        # MAGIC + 3**9 little-endian uint16, ~39 КБ
+        table = array('H', self.table)
+        if sys.byteorder != 'little':
+            table.byteswap()
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(table.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path}: not a move table')
+        table = array('H')
+        table.frombytes(data[len(MAGIC):])
+        if sys.byteorder != 'little':
+            table.byteswap()
+        return cls(table)
+
+
+if __name__ == '__main__':
+    # python solver.py bot_table.bin — собрать таблицу заранее
+    MoveTable.build().save(sys.argv[1] if len(sys.argv) > 1 else 'bot_table.bin')
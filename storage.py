@@ -0,0 +1,728 @@
+import asyncio
+import csv
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+
+log = logging.getLogger(__name__)
+
+
+USER_COLUMNS = (
+    'id', 'username', 'name', 'coins', 'wins', 'losses', 'draws', 'rating',
+    'equipped_symbol', 'equipped_bg', 'equipped_emoji_pack', 'equipped_animation'
+)
+
+
+class Database:
+    # Долгоживущие соединения: один поток-писатель и небольшой пул читателей.
+    # Все обращения к sqlite выполняются в потоках, поэтому медленный commit
+    # задерживает только тот хендлер, который его ждёт, а не весь event loop.
+
+    def __init__(self, path, readers=4, observe=None):
+        self.path = path
+        self.statements = 0  # выполненных SQL-операторов, для бенчмарков и админки
+        self.observe = observe  # observe(op, fn_name, seconds) — для метрик
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.set_trace_callback(self._count)
+        return conn
+
+    def _count(self, sql):
+        self.statements += 1
+
+    def _conn(self):
+        # каждому потоку пула — своё соединение, живущее до close()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._conn(), *args)
+
+    def _run_write(self, fn, args):
+        conn = self._conn()
+        try:
+            res = fn(conn, *args)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return res
+
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._readers, self._run_read, fn, args)
+        finally:
+            if self.observe is not None:
+                self.observe('read', fn.__name__, time.perf_counter() - started)
+
+    async def write(self, fn, *args):
+        # все записи сериализуются через один поток, одна транзакция на вызов
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._writer, self._run_write, fn, args)
+        finally:
+            if self.observe is not None:
+                self.observe('write', fn.__name__, time.perf_counter() - started)
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+
+def init_db(path):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('PRAGMA journal_mode=WAL')
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            name TEXT DEFAULT '',
+            coins INTEGER,
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            draws INTEGER DEFAULT 0,
+            rating INTEGER DEFAULT 1200,
+            equipped_symbol TEXT DEFAULT '',
+            equipped_bg TEXT DEFAULT '',
+            equipped_emoji_pack TEXT DEFAULT '',
+            equipped_animation TEXT DEFAULT ''
+        )
+        """
+    )
+    conn.commit()
+
+    c.execute("PRAGMA table_info(users)")
+    cols = [r[1] for r in c.fetchall()]
+    if 'wins' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN wins INTEGER DEFAULT 0")
+    if 'losses' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN losses INTEGER DEFAULT 0")
+    if 'draws' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN draws INTEGER DEFAULT 0")
+    if 'rating' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN rating INTEGER DEFAULT 1200")
+    if 'name' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN name TEXT DEFAULT ''")
+    if 'equipped_symbol' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN equipped_symbol TEXT DEFAULT ''")
+    if 'equipped_bg' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN equipped_bg TEXT DEFAULT ''")
+    if 'equipped_emoji_pack' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN equipped_emoji_pack TEXT DEFAULT ''")
+    if 'equipped_animation' not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN equipped_animation TEXT DEFAULT ''")
+
+    # purchases table: records owned items per user
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS purchases (user_id INTEGER, item_id TEXT, bought_at INTEGER, PRIMARY KEY(user_id, item_id))"
+    )
+
+    # журнал живых игр: create/join/move/finish, по нему игры восстанавливаются после рестарта
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS game_journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, game_id TEXT NOT NULL, event TEXT NOT NULL, data TEXT, ts REAL)"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_journal_event ON game_journal(event, game_id)")
+
+    # сыгранные партии: по строке на игру, ходы упакованы (history.pack_moves),
+    # result — код из history.RESULTS, время — целые секунды
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS game_history (id INTEGER PRIMARY KEY, game_id INTEGER NOT NULL, x INTEGER NOT NULL, o INTEGER NOT NULL, "
+        "price INTEGER NOT NULL, result INTEGER NOT NULL, size INTEGER NOT NULL, k INTEGER NOT NULL, started INTEGER NOT NULL, "
+        "seconds INTEGER NOT NULL, moves BLOB NOT NULL)"
+    )
+    # история игрока листается по id от новых к старым — по индексу на каждую сторону
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_x ON game_history(x, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_o ON game_history(o, id)")
+
+    # журнал движения коинов: каждая операция — строки (user_id, delta) в той же
+    # транзакции, что и изменение баланса
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS coin_ledger (seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, delta INTEGER NOT NULL, reason TEXT NOT NULL, ref TEXT, ts REAL)"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON coin_ledger(user_id, seq)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ledger_ts ON coin_ledger(ts)")
+
+    # индексы под таблицы лидеров: ORDER BY <col> DESC LIMIT k читает k строк индекса
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_wins ON users(wins)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_coins ON users(coins)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_rating ON users(rating)")
+    # поиск в админке по началу ника, без учёта регистра
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)")
+
+    conn.commit()
+    conn.close()
+
+
+# --- запросы; первым аргументом всегда идёт соединение из Database ---
+
+def get_user_items(conn, user_id):
+    c = conn.execute('SELECT item_id FROM purchases WHERE user_id=?', (user_id,))
+    return [r[0] for r in c.fetchall()]
+
+
+def ensure_user_record(conn, user_id, username, display_name):
+    c = conn.execute('SELECT id FROM users WHERE id=?', (user_id,))
+    if not c.fetchone():
+        conn.execute('INSERT INTO users (id, username, name, coins, wins, losses, draws, rating, equipped_symbol, equipped_bg, equipped_emoji_pack, equipped_animation) VALUES (?, ?, ?, ?, 0, 0, 0, 1200, ?, ?, ?, ?)', (user_id, username, display_name, 5000, '', '', '', ''))
+    else:
+        conn.execute('UPDATE users SET username=?, name=? WHERE id=?', (username, display_name, user_id))
+
+
+def upsert_user(conn, user_id, username, display_name):
+    # регистрация + чтение за один поход в поток-писатель
+    ensure_user_record(conn, user_id, username, display_name)
+    return load_user(conn, user_id)
+
+
+def row_to_user(row):
+    return {
+        "id": row[0],
+        "username": row[1],
+        "name": row[2] or row[1],
+        "coins": row[3],
+        "wins": row[4] or 0,
+        "losses": row[5] or 0,
+        "draws": row[6] or 0,
+        "rating": row[7] or 1200,
+        "equipped_symbol": row[8] or '',
+        "equipped_bg": row[9] or '',
+        "equipped_emoji_pack": row[10] or '',
+        "equipped_animation": row[11] or ''
+    }
+
+
+def load_user(conn, user_id):
+    c = conn.execute('SELECT ' + ', '.join(USER_COLUMNS) + ' FROM users WHERE id=?', (user_id,))
+    row = c.fetchone()
+    if row:
+        return row_to_user(row)
+    return None
+
+
+def user_params(user):
+    # только то, что пользователь меняет сам (имя из Telegram). Баланс,
+    # статистика и рейтинг меняются дельтами (transfer / credit / result),
+    # экипировка — своим полем (equip): иначе процесс с устаревшим кэшем
+    # затирал бы то, что записал другой
+    return (user['username'], user.get('name', user['username']), user['id'])
+
+
+SAVE_USER_SQL = 'UPDATE users SET username=?, name=? WHERE id=?'
+RESULT_SQL = 'UPDATE users SET wins=wins+?, losses=losses+?, draws=draws+?, rating=rating+? WHERE id=?'
+EQUIP_FIELDS_SQL = {
+    field: f'UPDATE users SET {field}=? WHERE id=?'
+    for field in ('equipped_symbol', 'equipped_bg', 'equipped_emoji_pack', 'equipped_animation')
+}
+# поля, которые result() меняет дельтами
+RESULT_FIELDS = ('wins', 'losses', 'draws', 'rating')
+
+
+LEDGER_SQL = 'INSERT INTO coin_ledger (user_id, delta, reason, ref, ts) VALUES (?, ?, ?, ?, ?)'
+CREDIT_SQL = 'UPDATE users SET coins=coins+? WHERE id=?'
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, user_id):
+        super().__init__(user_id)
+        self.user_id = user_id
+
+
+def transfer(conn, legs, reason, ref=None, statements=()):
+    # legs — [(user_id, delta)]. Списание проходит, только если хватает коинов
+    # (проверка и запись — один UPDATE); иначе InsufficientFunds, и Database
+    # откатывает всю транзакцию вместе с уже сделанными ногами.
+    balances = {}
+    ts = time.time()
+    for user_id, delta in legs:
+        if delta < 0:
+            row = conn.execute('UPDATE users SET coins=coins+? WHERE id=? AND coins>=? RETURNING coins', (delta, user_id, -delta)).fetchone()
+            if row is None:
+                raise InsufficientFunds(user_id)
+        else:
+            row = conn.execute('UPDATE users SET coins=coins+? WHERE id=? RETURNING coins', (delta, user_id)).fetchone()
+            if row is None:
+                raise KeyError(user_id)
+        balances[user_id] = row[0]
+    conn.executemany(LEDGER_SQL, [(user_id, delta, reason, ref, ts) for user_id, delta in legs])
+    for sql, params in statements:
+        conn.execute(sql, params)
+    return balances
+
+
+def adjust_coins(conn, user_id, amount, reason, ref=None):
+    # ручная правка админом: минус не уводит баланс ниже нуля
+    row = conn.execute('SELECT coins FROM users WHERE id=?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    delta = max(amount, -row[0])
+    return transfer(conn, [(user_id, delta)], reason, ref)[user_id]
+
+
+def buy_item(conn, user_id, item_id, price):
+    # покупка и списание — одна транзакция; повторная покупка не списывает
+    c = conn.execute('INSERT OR IGNORE INTO purchases (user_id, item_id, bought_at) VALUES (?, ?, ?)', (user_id, item_id, int(time.time())))
+    if not c.rowcount:
+        return None
+    return transfer(conn, [(user_id, -price)], 'shop', item_id)[user_id]
+
+
+def compact_ledger(conn, before):
+    # старые строки сворачиваются в одну на пользователя, сумма delta сохраняется
+    last = conn.execute('SELECT MAX(seq) FROM coin_ledger WHERE ts<?', (before,)).fetchone()[0]
+    if last is None:
+        return 0
+    conn.execute(
+        "INSERT INTO coin_ledger (user_id, delta, reason, ref, ts) "
+        "SELECT user_id, SUM(delta), 'compacted', NULL, MAX(ts) FROM coin_ledger WHERE seq<=? AND ts<? GROUP BY user_id",
+        (last, before)
+    )
+    c = conn.execute('DELETE FROM coin_ledger WHERE seq<=? AND ts<?', (last, before))
+    return c.rowcount
+
+
+
+# --- массовые операции с коинами (админка). Каждый вызов — одна транзакция
+# на кусок пользователей, между кусками писатель свободен для остальных. ---
+
+FILTER_COLUMNS = ('id', 'coins', 'rating', 'wins', 'losses', 'draws')
+FILTER_OPS = ('>=', '<=', '!=', '>', '<', '=')
+
+
+def filter_sql(filters):
+    # filters — [(column, op, value)], колонки и операторы только из списков выше
+    parts, params = [], []
+    for column, op, value in filters:
+        if column not in FILTER_COLUMNS or op not in FILTER_OPS:
+            raise ValueError(f'{column}{op}')
+        parts.append(f'{column} {op} ?')
+        params.append(value)
+    return ' AND '.join(parts) or '1', params
+
+
+def grant_preview(conn, amount, filters):
+    # -> (сколько пользователей изменится, итоговая сумма); минус не уводит ниже нуля
+    where, params = filter_sql(filters)
+    return conn.execute(
+        f'SELECT COUNT(*), COALESCE(SUM(max(coins+?, 0)-coins), 0) FROM users WHERE {where} AND max(coins+?, 0)!=coins',
+        [amount] + params + [amount]
+    ).fetchone()
+
+
+def grant_chunk(conn, amount, filters, after, chunk, reason, ref=None):
+    # следующие chunk пользователей по id после after; -> (последний id или None, {id: coins})
+    row = conn.execute('SELECT id FROM users WHERE id>? ORDER BY id LIMIT 1 OFFSET ?', (after, chunk - 1)).fetchone()
+    last = row[0] if row else conn.execute('SELECT MAX(id) FROM users').fetchone()[0]
+    if last is None or last <= after:
+        return None, {}
+    where, params = filter_sql(filters)
+    scope = f'id>? AND id<=? AND {where} AND max(coins+?, 0)!=coins'
+    scope_params = [after, last] + params + [amount]
+    conn.execute(
+        f'INSERT INTO coin_ledger (user_id, delta, reason, ref, ts) SELECT id, max(coins+?, 0)-coins, ?, ?, ? FROM users WHERE {scope}',
+        [amount, reason, ref, time.time()] + scope_params
+    )
+    c = conn.execute(f'UPDATE users SET coins=max(coins+?, 0) WHERE {scope} RETURNING id, coins', [amount] + scope_params)
+    return last, dict(c.fetchall())
+
+
+def deltas_preview(conn, rows, coins):
+    # то же, что apply_deltas, но без записи. coins — {id: баланс} после предыдущих
+    # пачек файла, дополняется на месте: повтор id в другой пачке и упор в ноль
+    # считаются так же, как при импорте пачка за пачкой.
+    # -> ({id: coins} изменившихся, [неизвестные id], итоговая сумма)
+    wanted = {}
+    for user_id, delta in rows:
+        wanted[user_id] = wanted.get(user_id, 0) + delta
+    ids = [uid for uid in wanted if uid not in coins]
+    if ids:
+        coins.update(conn.execute(f"SELECT id, coins FROM users WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall())
+    balances, missing, total = {}, [], 0
+    for uid, delta in wanted.items():
+        if uid not in coins:
+            missing.append(uid)
+            continue
+        new = max(coins[uid] + delta, 0)
+        if new != coins[uid]:
+            total += new - coins[uid]
+            coins[uid] = balances[uid] = new
+    return balances, missing, total
+
+
+def apply_deltas(conn, rows, reason, ref=None):
+    # rows — [(user_id, delta)], повторы id складываются; -> ({id: coins}, [неизвестные id])
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_delta (user_id INTEGER PRIMARY KEY, delta INTEGER NOT NULL)')
+    conn.execute('DELETE FROM bulk_delta')
+    conn.executemany('INSERT INTO bulk_delta VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET delta=delta+excluded.delta', rows)
+    missing = [r[0] for r in conn.execute('SELECT user_id FROM bulk_delta WHERE user_id NOT IN (SELECT id FROM users)')]
+    conn.execute(
+        'INSERT INTO coin_ledger (user_id, delta, reason, ref, ts) '
+        'SELECT u.id, max(u.coins+d.delta, 0)-u.coins, ?, ?, ? FROM users u JOIN bulk_delta d ON d.user_id=u.id '
+        'WHERE max(u.coins+d.delta, 0)!=u.coins',
+        (reason, ref, time.time())
+    )
+    c = conn.execute(
+        'UPDATE users SET coins=max(users.coins+d.delta, 0) FROM bulk_delta d '
+        'WHERE users.id=d.user_id AND max(users.coins+d.delta, 0)!=users.coins RETURNING users.id, users.coins'
+    )
+    balances = dict(c.fetchall())
+    conn.execute('DELETE FROM bulk_delta')
+    return balances, missing
+
+
+EXPORT_COLUMNS = ('id', 'username', 'name', 'coins', 'wins', 'losses', 'draws', 'rating')
+
+
+def export_users(conn, path, batch=1000):
+    # курсор читается кусками прямо в файл: память не растёт с размером таблицы
+    c = conn.execute('SELECT ' + ', '.join(EXPORT_COLUMNS) + ' FROM users ORDER BY id')
+    n = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = c.fetchmany(batch)
+            if not rows:
+                break
+            w.writerows(rows)
+            n += len(rows)
+    return n
+
+# Постраничный обход пользователей для админки. Курсор — id крайней строки
+# предыдущей страницы: страница начинается сразу за ней в порядке (ключ, id),
+# поэтому каждый запрос — спуск по индексу и limit+1 строк, без OFFSET.
+# Результат: (строки в порядке показа, есть ли ещё страница в сторону обхода).
+BROWSE_ORDERS = {
+    # порядок: (ключ сортировки, по убыванию)
+    'id': ('id', False),
+    'coins': ('coins', True),
+    'rating': ('rating', True),
+    'name': ('username COLLATE NOCASE', False),
+}
+
+
+def browse_users(conn, order='id', cursor=None, backward=False, limit=20, prefix=None):
+    key, desc = BROWSE_ORDERS[order]
+    descending = desc != backward
+    where, params = [], []
+    if cursor is not None:
+        column = key.split()[0]
+        where.append(f"({key}, id) {'<' if descending else '>'} (SELECT {column}, id FROM users WHERE id=?)")
+        params.append(cursor)
+    if prefix:
+        # диапазон по индексу idx_users_username: [prefix, следующий префикс)
+        where.append('username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE')
+        params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    direction = 'DESC' if descending else 'ASC'
+    sql = (
+        'SELECT ' + ', '.join(USER_COLUMNS) + ' FROM users'
+        + (' WHERE ' + ' AND '.join(where) if where else '')
+        + f' ORDER BY {key} {direction}, id {direction} LIMIT ?'
+    )
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    return [row_to_user(r) for r in rows], more
+
+
+def id_prefix_ranges(prefix, max_id):
+    # все id, десятичная запись которых начинается с prefix: p, p0..p9, p00..p99, ...
+    lo = hi = int(prefix)
+    while lo and lo <= max_id:
+        yield lo, min(hi, max_id)
+        lo, hi = lo * 10, hi * 10 + 9
+
+
+def browse_users_by_id_prefix(conn, prefix, cursor=None, backward=False, limit=20):
+    # диапазоны не пересекаются и идут по возрастанию id, так что обходим их
+    # по порядку (с конца при backward) и добираем строки по первичному ключу
+    max_id = conn.execute('SELECT max(id) FROM users').fetchone()[0] or 0
+    ranges = list(id_prefix_ranges(prefix, max_id))
+    if backward:
+        ranges.reverse()
+    rows = []
+    for lo, hi in ranges:
+        if cursor is not None:
+            if backward:
+                hi = min(hi, cursor - 1)
+            else:
+                lo = max(lo, cursor + 1)
+            if lo > hi:
+                continue
+        rows += conn.execute(
+            'SELECT ' + ', '.join(USER_COLUMNS) + f" FROM users WHERE id BETWEEN ? AND ? ORDER BY id {'DESC' if backward else 'ASC'} LIMIT ?",
+            (lo, hi, limit + 1 - len(rows))
+        ).fetchall()
+        if len(rows) > limit:
+            break
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    return [row_to_user(r) for r in rows], more
+
+
+HISTORY_SQL = (
+    'INSERT INTO game_history (game_id, x, o, price, result, size, k, started, seconds, moves) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+HISTORY_COLUMNS = ('id', 'game_id', 'x', 'o', 'price', 'result', 'size', 'k', 'started', 'seconds', 'moves')
+
+
+def row_to_history(row):
+    # moves остаётся упакованным: распаковывает history.unpack_moves по размеру поля
+    return dict(zip(HISTORY_COLUMNS, row))
+
+
+def get_history(conn, history_id):
+    row = conn.execute('SELECT ' + ', '.join(HISTORY_COLUMNS) + ' FROM game_history WHERE id=?', (history_id,)).fetchone()
+    return row_to_history(row) if row else None
+
+
+def user_history(conn, user_id, cursor=None, backward=False, limit=10):
+    # Партии игрока от новых к старым, keyset по id. Игрок бывает и X, и O —
+    # две выборки по своим индексам, каждая не больше limit+1 строк, затем
+    # слияние. Имя соперника подтягивается тем же запросом.
+    op, direction = ('>', 'ASC') if backward else ('<', 'DESC')
+    bound = f' AND id {op} ?' if cursor is not None else ''
+    side = (
+        'SELECT * FROM (SELECT ' + ', '.join(HISTORY_COLUMNS) + ', {other} AS opponent FROM game_history '
+        'WHERE {me}=?' + bound + f' ORDER BY id {direction} LIMIT ?)'
+    )
+    params = []
+    for me in ('x', 'o'):
+        params.append(user_id)
+        if cursor is not None:
+            params.append(cursor)
+        params.append(limit + 1)
+    sql = (
+        'SELECT h.*, u.username, u.name FROM (' + side.format(me='x', other='o') + ' UNION ALL ' + side.format(me='o', other='x') + ') h '
+        f'LEFT JOIN users u ON u.id = h.opponent ORDER BY h.id {direction} LIMIT ?'
+    )
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    n = len(HISTORY_COLUMNS)
+    out = []
+    for row in rows:
+        record = row_to_history(row[:n])
+        record['opponent'], record['opponent_username'], record['opponent_name'] = row[n:]
+        out.append(record)
+    return out, more
+
+
+# для пересчёта рейтингов: (x, o, очки X в половинках: 2 — победа, 1 — ничья, 0 — поражение).
+# При таймауте проиграл тот, чья была очередь: ходов нечётно — ходить было O.
+# Число ходов на 3×3 — по два в байте, нечётный хвост добит 0xF (history.PAD).
+HISTORY_RESULTS_SQL = (
+    "SELECT x, o, CASE result WHEN 1 THEN 2 WHEN 2 THEN 0 WHEN 0 THEN 1 "
+    "ELSE (CASE WHEN size = 3 THEN length(moves) * 2 - (substr(hex(moves), -2, 1) = 'F') ELSE length(moves) END) % 2 * 2 END "
+    "FROM game_history WHERE o != ? ORDER BY id"
+)
+
+
+def history_players(conn, skip=0):
+    # все игроки из истории по возрастанию id, skip — соперник-бот; оба
+    # прохода только по индексам, поэтому сюда попадают и те, кто играл лишь с ботом
+    c = conn.execute('SELECT x FROM game_history UNION SELECT o FROM game_history WHERE o != ? ORDER BY 1', (skip,))
+    return [r[0] for r in c]
+
+
+def history_results(conn, batch=200000, skip=0):
+    # партии в порядке окончания кусками по batch строк
+    c = conn.execute(HISTORY_RESULTS_SQL, (skip,))
+    while True:
+        rows = c.fetchmany(batch)
+        if not rows:
+            return
+        yield rows
+
+
+def set_ratings(conn, rows):
+    # rows — [(user_id, rating)]; одним UPDATE ... FROM; -> сколько пользователей изменилось
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_rating (user_id INTEGER PRIMARY KEY, rating INTEGER NOT NULL)')
+    conn.execute('DELETE FROM bulk_rating')
+    conn.executemany('INSERT OR REPLACE INTO bulk_rating VALUES (?, ?)', rows)
+    c = conn.execute(
+        'UPDATE users SET rating=r.rating FROM bulk_rating r '
+        'WHERE users.id=r.user_id AND users.rating!=r.rating'
+    )
+    changed = c.rowcount
+    conn.execute('DELETE FROM bulk_rating')
+    return changed
+
+
+LEADERBOARD_COLUMNS = ('wins', 'coins', 'rating')
+
+
+def top_users(conn, column, limit=10):
+    if column not in LEADERBOARD_COLUMNS:
+        raise ValueError(column)
+    c = conn.execute('SELECT ' + ', '.join(USER_COLUMNS) + f' FROM users ORDER BY {column} DESC LIMIT ?', (limit,))
+    return [row_to_user(r) for r in c.fetchall()]
+
+
+def write_batch(conn, user_rows, statements):
+    if user_rows:
+        conn.executemany(SAVE_USER_SQL, user_rows)
+    # подряд идущие одинаковые операторы (начисления, журнал, история) — одним executemany
+    for sql, group in groupby(statements, key=itemgetter(0)):
+        conn.executemany(sql, [params for _, params in group])
+
+
+class WriteBehind:
+    # Отложенная запись пользователей: хендлеры только помечают запись грязной,
+    # а фоновая задача сбрасывает всё накопленное одной транзакцией — раз в
+    # interval секунд или сразу, как только набралось max_pending записей.
+    # Через queue() в ту же транзакцию можно добавить произвольные INSERT'ы
+    # (журнал игр и т.п.), чтобы они коммитились вместе с балансами.
+    # Начисления (credit) тоже копятся здесь: coins=coins+? и строка журнала
+    # коинов; они безусловны, поэтому их можно отложить, в отличие от списаний.
+
+    def __init__(self, db, interval=1.0, max_pending=200):
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.rows_written = 0
+        self._dirty = {}
+        self._statements = []
+        self._credits = {}
+        self._results = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __contains__(self, user_id):
+        return user_id in self._dirty
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def pending(self, user_id):
+        return self._dirty.get(user_id)
+
+    def records(self):
+        return list(self._dirty.values())
+
+    def pending_credit(self, user_id):
+        return self._credits.get(user_id, 0)
+
+    def mark(self, user):
+        # храним ссылку на сам dict: сброс запишет самое свежее состояние
+        self._dirty[user['id']] = user
+        if len(self._dirty) >= self.max_pending:
+            self._wakeup.set()
+
+    def queue(self, sql, params):
+        self._statements.append((sql, params))
+        if len(self._statements) >= self.max_pending:
+            self._wakeup.set()
+
+    def credit(self, user_id, amount, reason, ref=None):
+        self._credits[user_id] = self._credits.get(user_id, 0) + amount
+        self.queue(CREDIT_SQL, (amount, user_id))
+        self.queue(LEDGER_SQL, (user_id, amount, reason, ref, time.time()))
+
+    def result(self, user_id, wins=0, losses=0, draws=0, rating=0):
+        # итог партии дельтами: процессы с разными кэшами не затирают друг друга
+        deltas = (wins, losses, draws, rating)
+        old = self._results.get(user_id, (0, 0, 0, 0))
+        self._results[user_id] = tuple(a + b for a, b in zip(old, deltas))
+        self.queue(RESULT_SQL, deltas + (user_id,))
+
+    def equip(self, user_id, field, value):
+        self.queue(EQUIP_FIELDS_SQL[field], (value, user_id))
+
+    def overlay(self, user):
+        # запись, только что прочитанная из БД, + ещё не сброшенные дельты
+        user['coins'] += self._credits.get(user['id'], 0)
+        for field, delta in zip(RESULT_FIELDS, self._results.get(user['id'], ())):
+            user[field] += delta
+        return user
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty and not self._statements:
+                return
+            batch = self._dirty
+            statements = self._statements
+            credits = self._credits
+            results = self._results
+            self._dirty = {}
+            self._statements = []
+            self._credits = {}
+            self._results = {}
+            # снимок значений делаем в потоке event loop, до ухода в писатель
+            rows = [user_params(u) for u in batch.values()]
+            try:
+                await self.db.write(write_batch, rows, statements)
+            except BaseException:
+                for uid, u in batch.items():
+                    self._dirty.setdefault(uid, u)
+                self._statements[:0] = statements
+                for uid, amount in credits.items():
+                    self._credits[uid] = self._credits.get(uid, 0) + amount
+                for uid, deltas in results.items():
+                    old = self._results.get(uid, (0, 0, 0, 0))
+                    self._results[uid] = tuple(a + b for a, b in zip(old, deltas))
+                raise
+            self.flushes += 1
+            self.rows_written += len(rows) + len(statements)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('write-behind flush failed, will retry')
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # гарантированный сброс при остановке бота
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,160 @@
+# Битборды против перебора по координатам: WINNING, Game.place и
+# check_winner на 3×3 и на полях N×N с k в ряд, плюс to_dict/from_dict.
+# Запуск: python -m pytest tests или python -m unittest discover tests
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import FULL, WINNING, Game, check_winner, layout
+
+
+def grid(x_bits, o_bits, size):
+    return [['X' if x_bits >> (r * size + c) & 1 else 'O' if o_bits >> (r * size + c) & 1 else ' '
+             for c in range(size)] for r in range(size)]
+
+
+def has_line(cells, symbol, k):
+    # k подряд в любом из четырёх направлений — шагами по клеткам, без масок
+    size = len(cells)
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                n = 0
+                while n < k and 0 <= r + dr * n < size and 0 <= c + dc * n < size and cells[r + dr * n][c + dc * n] == symbol:
+                    n += 1
+                if n == k:
+                    return True
+    return False
+
+
+def brute_result(x_bits, o_bits, size, k):
+    cells = grid(x_bits, o_bits, size)
+    if has_line(cells, 'X', k):
+        return 'X'
+    if has_line(cells, 'O', k):
+        return 'O'
+    if all(cell != ' ' for row in cells for cell in row):
+        return 'draw'
+    return None
+
+
+def expected_place(game, symbol):
+    # чего ждать от place после хода symbol: победа ходившего, ничья или None
+    cells = grid(game.x_bits, game.o_bits, game.size)
+    if has_line(cells, symbol, game.k):
+        return symbol
+    if all(cell != ' ' for row in cells for cell in row):
+        return 'draw'
+    return None
+
+
+class WinningTableTest(unittest.TestCase):
+
+    def test_every_mask(self):
+        for bits in range(FULL + 1):
+            self.assertEqual(bool(WINNING[bits]), has_line(grid(bits, 0, 3), 'X', 3), bin(bits))
+
+
+class ClassicBoardTest(unittest.TestCase):
+
+    def test_every_reachable_position(self):
+        # все позиции, достижимые по правилам (5478 штук), каждый ход из каждой
+        seen = set()
+        stack = [Game('g', 1, 0, 30)]
+        while stack:
+            game = stack.pop()
+            for idx in range(9):
+                if not game.is_free(idx):
+                    continue
+                child = game.copy()
+                symbol = child.turn
+                result = child.place(idx, symbol)
+                self.assertEqual(result, expected_place(child, symbol), (child.x_bits, child.o_bits, idx))
+                self.assertEqual(check_winner(child.x_bits, child.o_bits), result)
+                key = (child.x_bits, child.o_bits)
+                if result is None and key not in seen:
+                    seen.add(key)
+                    child.turn = 'O' if symbol == 'X' else 'X'
+                    stack.append(child)
+        self.assertEqual(len(seen) + 1, 4520)  # незавершённые, вместе с пустым полем
+
+
+class LargeBoardTest(unittest.TestCase):
+    BOARDS = ((4, 3, 300), (5, 4, 200), (7, 5, 60), (15, 5, 8))
+
+    def test_random_games(self):
+        rng = random.Random(23)
+        for size, k, games in self.BOARDS:
+            for _ in range(games):
+                game = Game('g', 1, 0, 30, size=size, k=k)
+                cells = list(range(size * size))
+                rng.shuffle(cells)
+                symbol, result = 'X', None
+                for idx in cells:
+                    result = game.place(idx, symbol)
+                    self.assertEqual(result, expected_place(game, symbol), (size, k, bytes(game.moves).hex()))
+                    if result:
+                        break
+                    symbol = 'O' if symbol == 'X' else 'X'
+                self.assertEqual(check_winner(game.x_bits, game.o_bits, size, k), brute_result(game.x_bits, game.o_bits, size, k))
+
+    def test_edges_do_not_wrap(self):
+        # конец строки и начало следующей — соседние биты, но не соседние клетки
+        game = Game('g', 1, 0, 30, size=5, k=4)
+        for idx in (3, 4, 5, 6, 7):
+            self.assertIsNone(game.place(idx, 'X'))
+        self.assertIsNone(check_winner(game.x_bits, 0, 5, 4))
+        self.assertEqual(game.place(8, 'X'), 'X')
+
+    def test_bad_boards(self):
+        for size, k in ((2, 2), (4, 5), (16, 5), (5, 2)):
+            with self.assertRaises(ValueError):
+                layout(size, k)
+
+
+class SerializationTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        game = Game('a1b2c3d4', 11, 500, 30, type='match', created_at=1000.5, size=7, k=5)
+        game.o = 22
+        game.started, game.started_at, game.last_move_time = True, 1010.0, 1020.0
+        game.messages = [[11, 100], [22, 200]]
+        for idx, symbol in ((22, 'X'), (0, 'O'), (23, 'X'), (48, 'O')):
+            game.place(idx, symbol)
+        game.turn = 'X'
+
+        copy = Game.from_dict(json.loads(json.dumps(game.to_dict())))
+        for name in Game.__slots__:
+            self.assertEqual(getattr(copy, name), getattr(game, name), name)
+        self.assertIsInstance(copy.moves, bytearray)
+        # восстановленная партия доигрывается так же
+        for idx, symbol in ((24, 'X'), (1, 'O'), (25, 'X'), (2, 'O')):
+            self.assertEqual(copy.place(idx, symbol), game.place(idx, symbol))
+        self.assertEqual(copy.place(26, 'X'), 'X')
+
+    def test_old_records(self):
+        # записи до N×N и до started_at: без size/k, ходы списком
+        data = Game('ffff0000', 1, 100, 30, created_at=50.0).to_dict()
+        for name in ('size', 'k', 'started_at'):
+            del data[name]
+        data.update(o=2, started=True, x_bits=0b11, o_bits=0b11000, moves=[0, 3, 1, 4])
+        game = Game.from_dict(data)
+        self.assertEqual((game.size, game.k, game.started_at), (3, 3, 50.0))
+        self.assertEqual(game.moves, bytearray([0, 3, 1, 4]))
+        self.assertEqual(game.place(2, 'X'), 'X')
+
+    def test_copy_has_own_moves(self):
+        game = Game('g', 1, 0, 30)
+        game.place(4, 'X')
+        copy = game.copy()
+        copy.place(0, 'O')
+        self.assertEqual(game.moves, bytearray([4]))
+        self.assertEqual(copy.moves, bytearray([4, 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
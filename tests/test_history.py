@@ -0,0 +1,142 @@
+# Сжатая история партий: упаковка ходов туда и обратно, winner() и replay
+# через настоящую таблицу game_history.
+# Запуск: python -m pytest tests или python -m unittest discover tests
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import history
+import storage
+from engine import WINNING, Game
+
+
+def all_classic_games():
+    # все партии 3×3 по правилам до победы или ничьей — последовательности ходов
+    def play(mine, theirs, moves):
+        for idx in range(9):
+            if (mine | theirs) >> idx & 1:
+                continue
+            moves.append(idx)
+            if WINNING[mine | 1 << idx] or len(moves) == 9:
+                yield tuple(moves)
+            else:
+                yield from play(theirs, mine | 1 << idx, moves)
+            moves.pop()
+    return play(0, 0, [])
+
+
+def random_game(rng, size, k):
+    game = Game(f'{rng.getrandbits(32):08x}', rng.randrange(1, 100), 100, 30, size=size, k=k)
+    game.o = rng.randrange(100, 200)
+    cells = list(range(size * size))
+    rng.shuffle(cells)
+    symbol = 'X'
+    for idx in cells:
+        result = game.place(idx, symbol)
+        if result:
+            return game, result
+        symbol = 'O' if symbol == 'X' else 'X'
+
+
+class PackTest(unittest.TestCase):
+
+    def test_every_classic_game(self):
+        n = 0
+        for moves in all_classic_games():
+            packed = history.pack_moves(moves)
+            self.assertEqual(len(packed), (len(moves) + 1) // 2)
+            self.assertEqual(history.unpack_moves(packed), tuple(moves))
+            n += 1
+        self.assertEqual(n, 255168)
+
+    def test_every_prefix(self):
+        # партия, прерванная таймаутом, может кончиться на любом ходу — и чётном, и нечётном
+        moves = (4, 0, 8, 2, 1, 7, 6, 3, 5)
+        for n in range(10):
+            self.assertEqual(history.unpack_moves(history.pack_moves(moves[:n])), moves[:n])
+        self.assertEqual(history.pack_moves(()), b'')
+
+    def test_large_boards(self):
+        rng = random.Random(11)
+        for size in (4, 7, 15):
+            moves = tuple(rng.sample(range(size * size), size * size))
+            packed = history.pack_moves(moves, size)
+            self.assertEqual(len(packed), len(moves))
+            self.assertEqual(history.unpack_moves(packed, size), moves)
+        self.assertEqual(history.unpack_moves(history.pack_moves((224, 0), 15), 15), (224, 0))
+
+
+class WinnerTest(unittest.TestCase):
+
+    def test_results(self):
+        self.assertEqual(history.winner('X', (0, 3, 1, 4, 2)), 'X')
+        self.assertEqual(history.winner('O', (0, 3, 1, 4, 8, 5)), 'O')
+        self.assertIsNone(history.winner('draw', (0, 1, 2, 4, 3, 5, 7, 6, 8)))
+
+    def test_timeout(self):
+        # проиграл тот, чья очередь: после чётного числа ходов — X
+        self.assertEqual(history.winner('timeout', ()), 'O')
+        self.assertEqual(history.winner('timeout', (4,)), 'X')
+        self.assertEqual(history.winner('timeout', (4, 0)), 'O')
+
+    def test_codes(self):
+        for name, code in history.RESULT_CODES.items():
+            self.assertEqual(history.RESULTS[code], name)
+
+
+class StoredGameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, 'h.db')
+        storage.init_db(path)
+        self.conn = sqlite3.connect(path)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def store(self, game, result, finished):
+        c = self.conn.execute(storage.HISTORY_SQL, history.history_row(game, result, finished))
+        return storage.get_history(self.conn, c.lastrowid)
+
+    def test_replay(self):
+        rng = random.Random(3)
+        for size, k in ((3, 3), (3, 3), (3, 3), (5, 4), (7, 5), (15, 5)):
+            game, result = random_game(rng, size, k)
+            game.started_at = 1000.0
+            record = self.store(game, result, 1042.7)
+            self.assertEqual(int(record['game_id']), int(game.id, 16))
+            self.assertEqual((record['x'], record['o'], record['size'], record['k']), (game.x, game.o, size, k))
+            self.assertEqual((record['started'], record['seconds']), (1000, 42))
+
+            moves = history.unpack_moves(record['moves'], size)
+            self.assertEqual(moves, tuple(game.moves))
+            self.assertEqual(history.winner(history.RESULTS[record['result']], moves), None if result == 'draw' else result)
+            final = history.replay(record)
+            self.assertEqual((final.x_bits, final.o_bits), (game.x_bits, game.o_bits))
+            # промежуточная позиция: первые n ходов и очередь следующего
+            n = len(moves) // 2
+            middle = history.replay(record, upto=n)
+            self.assertEqual(tuple(middle.moves), moves[:n])
+            self.assertEqual(middle.turn, 'X' if n % 2 == 0 else 'O')
+
+    def test_timeout_replay(self):
+        game = Game('0000abcd', 1, 100, 30)
+        game.o, game.started_at = 2, 500.0
+        for idx, symbol in ((4, 'X'), (0, 'O'), (8, 'X')):
+            game.place(idx, symbol)
+        record = self.store(game, 'timeout', 530.0)
+        moves = history.unpack_moves(record['moves'])
+        self.assertEqual(moves, (4, 0, 8))
+        self.assertEqual(history.winner('timeout', moves), 'X')
+        self.assertEqual(history.replay(record).turn, 'O')
+
+
+if __name__ == '__main__':
+    unittest.main()
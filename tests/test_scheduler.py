@@ -0,0 +1,74 @@
+# TimerWheel на VirtualClock: время двигаем руками, обходчик крутится как в боте.
+# Запуск: python -m pytest tests или python -m unittest discover tests
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduler import TimerWheel, VirtualClock
+
+
+class TimerWheelTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.clock = VirtualClock(start=1000.0)
+        self.fired = []
+        # 8 слотов по 0.5 s — оборот колеса 4 s
+        self.wheel = TimerWheel(self.on_fire, tick=0.5, slots=8, clock=self.clock)
+        self.wheel.start()
+
+    async def asyncTearDown(self):
+        await self.wheel.stop()
+
+    async def on_fire(self, key):
+        self.fired.append((key, self.clock.time()))
+
+    async def advance(self, delta):
+        await self.clock.advance(delta)
+        # колбэки запускаются отдельными задачами
+        await asyncio.sleep(0)
+
+    async def test_fires_on_deadline(self):
+        self.wheel.arm('g', 3)
+        await self.advance(2.9)
+        self.assertEqual(self.fired, [])
+        await self.advance(0.1)
+        self.assertEqual(self.fired, [('g', 1003.0)])
+        self.assertNotIn('g', self.wheel)
+
+    async def test_rearm_moves_deadline(self):
+        self.wheel.arm('g', 3)
+        await self.advance(2)
+        # ход сделан — таймер взводится заново от текущего времени
+        self.wheel.arm('g', 3)
+        await self.advance(2)
+        self.assertEqual(self.fired, [])
+        await self.advance(1)
+        self.assertEqual(self.fired, [('g', 1005.0)])
+        self.assertEqual(self.wheel.fired, 1)
+
+    async def test_cancel(self):
+        self.wheel.arm('a', 1)
+        self.wheel.arm('b', 1)
+        self.wheel.cancel('a')
+        await self.advance(5)
+        self.assertEqual(self.fired, [('b', 1001.0)])
+        self.assertEqual(len(self.wheel), 0)
+        # отмена несуществующего ключа — не ошибка
+        self.wheel.cancel('a')
+
+    async def test_several_revolutions(self):
+        # 10 s — два с половиной оборота: слот таймера проходится дважды впустую
+        self.wheel.arm('far', 10)
+        self.wheel.arm('near', 2)
+        await self.advance(9.5)
+        self.assertEqual(self.fired, [('near', 1002.0)])
+        self.assertIn('far', self.wheel)
+        await self.advance(0.5)
+        self.assertEqual(self.fired, [('near', 1002.0), ('far', 1010.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
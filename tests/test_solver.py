@@ -0,0 +1,119 @@
+# Таблица бота против независимого перебора: бот не проигрывает ни из одной
+# достижимой позиции, а маски лучших ходов совпадают с полным negamax.
+# Запуск: python -m pytest tests или python -m unittest discover tests
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import solver
+from solver import MoveTable
+
+# линии по координатам, без масок движка
+LINES = [[(r, c) for c in range(3)] for r in range(3)] + [[(r, c) for r in range(3)] for c in range(3)] \
+    + [[(i, i) for i in range(3)], [(i, 2 - i) for i in range(3)]]
+
+
+def won(cells, symbol):
+    return any(all(cells[r * 3 + c] == symbol for r, c in line) for line in LINES)
+
+
+def bits(cells, symbol):
+    return sum(1 << i for i, cell in enumerate(cells) if cell == symbol)
+
+
+def turn(cells):
+    return 'X' if cells.count('X') == cells.count('O') else 'O'
+
+
+class SolverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.table = MoveTable.build()
+
+    def best_moves(self, cells):
+        mask = self.table.best(bits(cells, 'X'), bits(cells, 'O'))
+        return [i for i in range(9) if mask >> i & 1]
+
+    def test_never_loses(self):
+        # бот — любым из своих лучших ходов, человек — любым свободным;
+        # в игре бот за O, но таблица должна держать и X
+        for bot in ('X', 'O'):
+            seen = set()
+            stack = [' ' * 9]
+            while stack:
+                cells = stack.pop()
+                if cells in seen:
+                    continue
+                seen.add(cells)
+                me = turn(cells)
+                if me == bot:
+                    moves = self.best_moves(cells)
+                    self.assertTrue(moves, cells)
+                else:
+                    moves = [i for i in range(9) if cells[i] == ' ']
+                for i in moves:
+                    child = cells[:i] + me + cells[i + 1:]
+                    if won(child, me):
+                        self.assertNotEqual(me, 'X' if bot == 'O' else 'O', f'bot {bot} lost: {child!r}')
+                    elif ' ' in child:
+                        stack.append(child)
+
+    def test_matches_full_negamax(self):
+        # та же оценка, что в solver: победа 10 - фишек на поле, ничья 0,
+        # поражение — минус оценка соперника; лучшие — все ходы с максимумом
+        memo = {}
+
+        def negamax(cells):
+            if cells in memo:
+                return memo[cells][0]
+            me = turn(cells)
+            scores = {}
+            for i in range(9):
+                if cells[i] != ' ':
+                    continue
+                child = cells[:i] + me + cells[i + 1:]
+                if won(child, me):
+                    scores[i] = 10 - (9 - child.count(' '))
+                elif ' ' not in child:
+                    scores[i] = 0
+                else:
+                    scores[i] = -negamax(child)
+            best = max(scores.values())
+            memo[cells] = best, [i for i, s in scores.items() if s == best]
+            return best
+
+        negamax(' ' * 9)
+        self.assertEqual(len(memo), 4520)  # незавершённые достижимые позиции
+        for cells, (_, moves) in memo.items():
+            self.assertEqual(self.best_moves(cells), moves, cells)
+        # конечные и недостижимые позиции в таблице пустые
+        self.assertEqual(sum(1 for mask in self.table.table if mask), len(memo))
+        # с пустого поля игра — ничья
+        self.assertEqual(memo[' ' * 9][0], 0)
+
+    def test_hard_plays_best(self):
+        rng = random.Random(5)
+        x_bits, o_bits = 1 << 0, 1 << 4
+        best = self.table.best(x_bits | 1 << 8, o_bits)
+        for _ in range(50):
+            self.assertTrue(best >> self.table.choose(x_bits | 1 << 8, o_bits, 'hard', rng) & 1)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'table.bin')
+            self.table.save(path)
+            self.assertEqual(os.path.getsize(path), len(solver.MAGIC) + 2 * solver.SIZE)
+            self.assertEqual(MoveTable.load(path).table, self.table.table)
+            with open(path, 'r+b') as f:
+                f.write(b'JUNK')
+            with self.assertRaises(ValueError):
+                MoveTable.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    # Приём апдейтов по вебхуку на aiohttp. Одновременно обрабатывается не
+    # больше max_concurrency апдейтов; пока все слоты заняты, ответ Telegram
+    # задерживается, и он сам притормаживает доставку (не больше
+    # max_connections запросов в полёте). Так очередь не копится в памяти.
+
+    def __init__(self, dp, path='/webhook', url=None, max_concurrency=64, secret=None,
+                 on_startup=None, on_shutdown=None, drain_timeout=10.0):
+        self.dp = dp
+        self.path = path
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.secret = secret
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+        self.drain_timeout = drain_timeout
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    async def handle(self, request):
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=403)
+        try:
+            update = types.Update(**(await request.json()))
+        except Exception:
+            return web.Response(status=400)
+        self.received += 1
+        # backpressure: держим HTTP-ответ, пока не освободится слот
+        await self._slots.acquire()
+        task = asyncio.ensure_future(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        try:
+            await self.dp.process_update(update)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            log.exception('update %s failed', update.update_id)
+        finally:
+            self._slots.release()
+
+    async def _startup(self, app):
+        if self.on_startup is not None:
+            await self.on_startup(self.dp)
+        if self.url:
+            await self.dp.bot.set_webhook(self.url + self.path, max_connections=self.max_concurrency,
+                                          secret_token=self.secret)
+
+    async def _shutdown(self, app):
+        # новые запросы уже не принимаются — дорабатываем начатые апдейты,
+        # потом хуки бота (сброс записей в БД, остановка таймеров)
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            if pending:
+                log.warning('%d updates still running on shutdown', len(pending))
+        if self.on_shutdown is not None:
+            await self.on_shutdown(self.dp)
+        await self.dp.storage.close()
+        await self.dp.storage.wait_closed()
+        session = await self.dp.bot.get_session()
+        await session.close()
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._startup)
+        app.on_shutdown.append(self._shutdown)
+        return app
+
+    def run(self, host='0.0.0.0', port=8080):
+        web.run_app(self.make_app(), host=host, port=port)
+
+    def stats(self):
+        return {
+            'inflight': len(self._tasks),
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+        }